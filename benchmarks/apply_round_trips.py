@@ -0,0 +1,128 @@
+"""Counts the network round trips apply takes against a local PostgreSQL
+
+Traffic is sent through a small TCP proxy which counts a round trip every
+time the client sends data after having received some. Run from the
+repository root with:
+
+    poetry run python benchmarks/apply_round_trips.py postgresql://postgres@localhost:5432
+"""
+
+import argparse
+import random
+import socket
+import string
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import psycopg
+from psycopg import sql
+
+from petite.utils import Database
+
+
+class RoundTripProxy:
+    """TCP proxy counting how often the client waits on the server"""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.target = (host, port)
+        self.round_trips = 0
+        self._server_spoke = False
+        self._lock = threading.Lock()
+
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            client, _ = self.listener.accept()
+            server = socket.create_connection(self.target)
+
+            threading.Thread(
+                target=self._forward, args=(client, server, True), daemon=True
+            ).start()
+            threading.Thread(
+                target=self._forward, args=(server, client, False), daemon=True
+            ).start()
+
+    def _forward(self, source: socket.socket, dest: socket.socket, from_client: bool):
+        while data := source.recv(65536):
+            with self._lock:
+                if from_client and self._server_spoke:
+                    self.round_trips += 1
+                self._server_spoke = not from_client
+            dest.sendall(data)
+
+        dest.close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.round_trips = 0
+            self._server_spoke = False
+
+
+@contextmanager
+def scratch_database(uri: str):
+    """Creates a database with a random name dropping it afterwards"""
+
+    name = "petite_bench_" + "".join(random.choices(string.ascii_lowercase, k=8))
+
+    with psycopg.connect(uri + "/postgres", autocommit=True) as conn:
+        conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+
+    try:
+        yield name
+    finally:
+        with psycopg.connect(uri + "/postgres", autocommit=True) as conn:
+            conn.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(name)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("uri", help="URI of the server without a database name.")
+    parser.add_argument("--migrations", type=int, default=400)
+    parser.add_argument("--statements", type=int, default=2)
+    parser.add_argument("--no-transaction", action="store_true")
+    args = parser.parse_args()
+
+    parts = urlsplit(args.uri)
+    proxy = RoundTripProxy(parts.hostname or "localhost", parts.port or 5432)
+    netloc = parts.netloc.rsplit("@", 1)
+    proxied = urlunsplit(
+        parts._replace(
+            netloc=(netloc[0] + "@" if len(netloc) > 1 else "")
+            + f"127.0.0.1:{proxy.port}"
+        )
+    )
+
+    migrations = [
+        (
+            f"{i:06}_bench.sql",
+            "".join(
+                f"CREATE TABLE bench_{i}_{j} (id INT);\n"
+                for j in range(args.statements)
+            ).encode(),
+        )
+        for i in range(args.migrations)
+    ]
+
+    with scratch_database(args.uri) as name:
+        db = Database(f"{proxied}/{name}")
+        db.create_migration_table()
+
+        proxy.reset()
+        db.apply_migrations(migrations, args.no_transaction)
+        db.conn.close()
+
+    print(
+        f"{proxy.round_trips} round trips to apply {args.migrations} migrations "
+        f"of {args.statements} statements"
+    )
+
+
+if __name__ == "__main__":
+    main()
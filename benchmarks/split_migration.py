@@ -0,0 +1,91 @@
+"""Compares the native statement splitter against parsing with sqlglot
+
+Run from the repository root with:
+
+    poetry run python benchmarks/split_migration.py
+"""
+
+import argparse
+import time
+
+import sqlglot
+
+from petite.utils.splitter import split_statements
+
+STATEMENT_TEMPLATES = [
+    "INSERT INTO seed (id, name, note) VALUES ({i}, 'name {i}', 'it''s; fine');\n",
+    "UPDATE seed SET note = E'line\\n{i};' WHERE id = {i};\n",
+    "-- comment for {i}; still a comment\n",
+    "CREATE OR REPLACE FUNCTION f_{i}() RETURNS int AS $$ SELECT {i}; $$ LANGUAGE sql;\n",
+]
+
+
+def make_migration(size: int) -> bytes:
+    """Builds migration content of at least size bytes"""
+
+    parts = []
+    total = 0
+    i = 0
+
+    while total < size:
+        part = STATEMENT_TEMPLATES[i % len(STATEMENT_TEMPLATES)].format(i=i)
+        parts.append(part)
+        total += len(part)
+        i += 1
+
+    return "".join(parts).encode("utf-8")
+
+
+def sqlglot_split(content: bytes):
+    """The parse and regenerate path the splitter replaced"""
+
+    return [
+        statement.sql(dialect="postgres").encode("utf-8")
+        for statement in sqlglot.parse(content.decode("utf-8"), read="postgres")
+        if statement
+    ]
+
+
+def native_split(content: bytes):
+    return [content[s.start : s.end] for s in split_statements(content)]
+
+
+def best_of(func, content: bytes, repeat: int) -> float:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100_000, 1_000_000, 5_000_000],
+        help="Migration sizes in bytes to benchmark.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>12} {'sqlglot':>12} {'native':>12} {'speedup':>10}")
+
+    for size in args.sizes:
+        content = make_migration(size)
+
+        sqlglot_time = best_of(sqlglot_split, content, args.repeat)
+        native_time = best_of(native_split, content, args.repeat)
+
+        print(
+            f"{len(content):>12} {sqlglot_time:>11.3f}s {native_time:>11.3f}s "
+            f"{sqlglot_time / native_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
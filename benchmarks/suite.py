@@ -0,0 +1,332 @@
+"""Times scanning, splitting and applying migrations and flags regressions
+
+Synthetic migrations directories, multi MB migration files and batches of
+migrations applied to a local PostgreSQL are each timed as the best of a
+few runs. Results are saved as JSON so a later run can be compared against
+them. Run from the repository root with:
+
+    poetry run python benchmarks/suite.py run --save benchmarks/baseline.json
+    poetry run python benchmarks/suite.py run --uri postgresql://postgres@localhost:5432 --compare benchmarks/baseline.json
+
+Apply benchmarks only run when --uri is given. Timings depend on the
+machine so only compare results from the same one.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+import rich
+from apply_round_trips import scratch_database
+from split_migration import make_migration
+
+from petite.utils import Database, MigrationCache
+from petite.utils.file_system import MigrationFile, list_migration_files
+from petite.utils.pending import find_pending
+from petite.utils.splitter import iter_statements
+
+# Slower than the baseline by more than this fraction is a regression
+DEFAULT_THRESHOLD = 0.10
+
+MB = 1024 * 1024
+
+
+class Sizes(NamedTuple):
+    directories: List[int]
+    migration_bytes: List[int]
+    # Migrations applied, each with a few statements
+    apply_migrations: int
+    copy_bytes: int
+
+
+FULL = Sizes([10_000, 100_000], [4 * MB, 32 * MB], 2000, 32 * MB)
+QUICK = Sizes([10_000], [4 * MB], 200, 4 * MB)
+
+
+class Result(NamedTuple):
+    seconds: float
+    # Amount of work done, like files scanned, for reporting a rate
+    work: int
+    unit: str
+
+
+def best_of(run: Callable[[], None], repeat: int) -> float:
+    """Times run repeat times returning the fastest"""
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def make_directory(directory: Path, count: int) -> List[str]:
+    """Fills a directory with count small migrations returning their names"""
+
+    names = [f"{i:012}_migration_{i}.sql" for i in range(count)]
+    for name in names:
+        (directory / name).write_bytes(b"CREATE TABLE t (id INT);\n")
+
+    # Files that aren't migrations are skipped by the scan
+    for i in range(count // 10):
+        (directory / f"data_{i}.csv").write_bytes(b"")
+
+    return names
+
+
+def bench_directories(sizes: Sizes, repeat: int) -> Iterator[tuple]:
+    for count in sizes.directories:
+        with tempfile.TemporaryDirectory() as name:
+            directory = Path(name)
+            names = make_directory(directory, count)
+
+            seconds = best_of(lambda: list_migration_files(directory), repeat)
+            yield f"scan-{count}", Result(seconds, count, "files")
+
+            # A database that has applied all but the newest 100
+            applied = names[:-100]
+            seconds = best_of(lambda: find_pending(directory, names, applied), repeat)
+            yield f"pending-{count}", Result(seconds, count, "files")
+
+
+def bench_split(sizes: Sizes, repeat: int) -> Iterator[tuple]:
+    for size in sizes.migration_bytes:
+        with tempfile.TemporaryDirectory() as name:
+            path = Path(name) / "1_seed.sql"
+            path.write_bytes(make_migration(size))
+            migration = MigrationFile(path)
+
+            def split():
+                with migration.open() as content:
+                    for _ in iter_statements(content):
+                        pass
+
+            seconds = best_of(split, repeat)
+            yield f"split-{size // MB}MB", Result(seconds, size, "bytes")
+
+            cache = MigrationCache(Path(name) / "cache")
+
+            def split_cached():
+                with migration.open() as content:
+                    for _ in cache.split(content):
+                        pass
+
+            # The first split fills the cache so the timed ones are hits
+            split_cached()
+            seconds = best_of(split_cached, repeat)
+            yield f"split-cached-{size // MB}MB", Result(seconds, size, "bytes")
+
+
+@contextmanager
+def quiet():
+    """Stops petite printing while a benchmark runs"""
+
+    console = rich.get_console()
+    console.quiet = True
+    try:
+        yield
+    finally:
+        console.quiet = False
+
+
+def time_apply(uri: str, migrations: list, no_transaction: bool, repeat: int) -> float:
+    """Best time to apply migrations to a new database"""
+
+    timings = []
+
+    for _ in range(repeat):
+        with scratch_database(uri) as name, quiet():
+            db = Database(f"{uri}/{name}")
+            db.create_migration_table()
+
+            start = time.perf_counter()
+            db.apply_migrations(migrations, no_transaction)
+            timings.append(time.perf_counter() - start)
+
+            db.conn.close()
+
+    return min(timings)
+
+
+def bench_apply(uri: str, sizes: Sizes, repeat: int) -> Iterator[tuple]:
+    count = sizes.apply_migrations
+    migrations = [
+        (
+            f"{i:06}_bench.sql",
+            (
+                f"CREATE TABLE bench_{i} (id INT PRIMARY KEY, name TEXT);\n"
+                f"INSERT INTO bench_{i} VALUES (1, 'one'), (2, 'two');\n"
+                f"CREATE INDEX ON bench_{i} (name);\n"
+            ).encode(),
+        )
+        for i in range(count)
+    ]
+
+    seconds = time_apply(uri, migrations, False, repeat)
+    yield f"apply-{count}", Result(seconds, count, "migrations")
+
+    seconds = time_apply(uri, migrations, True, repeat)
+    yield f"apply-{count}-no-transaction", Result(seconds, count, "migrations")
+
+    row = b"%d\tname of a seeded row\t2024-01-01 00:00:00\n"
+    rows = sizes.copy_bytes // len(row % 0)
+    content = (
+        b"CREATE TABLE seed (id INT, name TEXT, created TIMESTAMP);\n"
+        b"COPY seed (id, name, created) FROM stdin;\n"
+        + b"".join(row % i for i in range(rows))
+        + b"\\.\n"
+    )
+
+    seconds = time_apply(uri, [("1_seed.sql", content)], False, repeat)
+    yield f"copy-{sizes.copy_bytes // MB}MB", Result(seconds, len(content), "bytes")
+
+
+def format_rate(result: Result) -> str:
+    rate = result.work / max(result.seconds, 1e-9)
+    if result.unit == "bytes":
+        return f"{rate / MB:,.1f} MB/s"
+
+    return f"{rate:,.0f} {result.unit}/s"
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> int:
+    sizes = QUICK if args.quick else FULL
+    benchmarks = [
+        bench_directories(sizes, args.repeat),
+        bench_split(sizes, args.repeat),
+    ]
+    if args.uri:
+        benchmarks.append(bench_apply(args.uri, sizes, args.repeat))
+
+    results: Dict[str, Result] = {}
+
+    print(f"{'benchmark':<32} {'time':>10} {'rate':>20}")
+    for benchmark in benchmarks:
+        for name, result in benchmark:
+            results[name] = result
+            print(f"{name:<32} {result.seconds:>9.3f}s {format_rate(result):>20}")
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": {name: result._asdict() for name, result in results.items()},
+    }
+
+    if args.save:
+        args.save.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        print()
+        return compare_reports(
+            json.loads(args.compare.read_text()), report, args.threshold
+        )
+
+    return 0
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> int:
+    """Prints how each benchmark changed returning 1 if any regressed"""
+
+    regressions = []
+
+    print(f"{'benchmark':<32} {'baseline':>10} {'current':>10} {'change':>9}")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<32} {'':>10} {result['seconds']:>9.3f}s {'new':>9}")
+            continue
+
+        change = result["seconds"] / before["seconds"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+
+        print(
+            f"{name:<32} {before['seconds']:>9.3f}s {result['seconds']:>9.3f}s "
+            f"{change:>+8.1%}{'  regression' if regressed else ''}"
+        )
+
+    if regressions:
+        print(
+            f"\n{len(regressions)} benchmark{'s' if len(regressions) > 1 else ''} "
+            f"slower than the baseline by more than {threshold:.0%}: "
+            + ", ".join(regressions)
+        )
+        return 1
+
+    print(f"\nNo benchmark is slower than the baseline by more than {threshold:.0%}.")
+    return 0
+
+
+def compare(args) -> int:
+    return compare_reports(
+        json.loads(args.baseline.read_text()),
+        json.loads(args.current.read_text()),
+        args.threshold,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--uri",
+        help="URI of a PostgreSQL server without a database name to benchmark apply against.",
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument(
+        "--quick", action="store_true", help="Only run the smaller sizes."
+    )
+    run_parser.add_argument("--save", type=Path, help="File to save the results to.")
+    run_parser.add_argument(
+        "--compare", type=Path, help="Saved results to compare against."
+    )
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved results.")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.set_defaults(func=compare)
+
+    for command in (run_parser, compare_parser):
+        command.add_argument(
+            "--threshold",
+            type=float,
+            default=DEFAULT_THRESHOLD,
+            help="Fraction slower than the baseline that counts as a regression.",
+        )
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,29 @@
+import os
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, List, Optional, Tuple
 
 import typer
-from dotenv import load_dotenv
 from rich import print
+from typer.core import TyperGroup
 
-from .utils import Database, FileSystem
 from .utils.confirmations import NO_TRANSACTION_MESSAGE, confirm_no_transaction
 
+# Heavy modules (psycopg, sqlglot, dotenv) are imported inside the commands
+# that need them so startup stays fast for commands like `new` and `--help`
+
 POSTGRES_URI_HELP = "URI of the PostgreSQL database to connect to."
 
-load_dotenv("./.env")
 
-# Just to make the output prettier
-print()
+class PetiteGroup(TyperGroup):
+    def parse_args(self, ctx, args):
+        # The callback runs before the command parses its options so it
+        # can't see them any other way
+        ctx.meta["json_output"] = "--json" in args
+        return super().parse_args(ctx, args)
+
 
 app = typer.Typer(
+    cls=PetiteGroup,
     pretty_exceptions_show_locals=False,
     rich_markup_mode="rich",
     help="""
@@ -26,6 +34,19 @@ app = typer.Typer(
 )
 
 
+@app.callback()
+def main(ctx: typer.Context):
+    # Runs before any command but not for the top level --help
+    if os.path.isfile("./.env"):
+        from dotenv import load_dotenv
+
+        load_dotenv("./.env")
+
+    # Just to make the output prettier, except for output read by programs
+    if not ctx.meta.get("json_output"):
+        print()
+
+
 @app.command()
 def setup(
     postgres_uri: Annotated[
@@ -46,9 +67,12 @@ def setup(
 ):
     """Initializes the migration system by setting up the necessary directory and database table.
 
-    Should be run once per project before running any other commands.
+    Should be run once per project before running any other commands. Running
+    it again upgrades the database table if it was made by an older version.
     """
 
+    from .utils import Database, FileSystem
+
     db = Database(postgres_uri)
     FileSystem.create_migration_directory(migrations_directory)
     db.create_migration_table()
@@ -67,16 +91,39 @@ def new_migration(
         str,
         typer.Argument(help="Name of the new migration file."),
     ],
+    python: Annotated[
+        bool,
+        typer.Option(
+            "--python",
+            help="Create a Python migration defining a migrate function instead of a SQL one.",
+        ),
+    ] = False,
+    compressed: Annotated[
+        bool,
+        typer.Option(
+            "--compressed",
+            help="Create a SQL migration compressed with gzip, for large seed data.",
+        ),
+    ] = False,
 ):
     """Creates a new migration file in the migrations directory.
 
     Should be ran after `setup`. When created the file name will follow the
-    format: YYMMDDHHMMSS_migration_name.sql. This ensures that the migrations
-    are applied in the correct order. For this reason this command should be
-    used to create all migration files.
+    format: YYMMDDHHMMSS_migration_name.sql, or .py with --python and
+    .sql.gz with --compressed. This ensures that the migrations are applied
+    in the correct order. For this reason this command should be used to
+    create all migration files.
     """
 
-    FileSystem(migrations_directory).create_migration_file(migration_name)
+    from .utils import FileSystem
+
+    if python and compressed:
+        print("[bold red]Error[/] Python migrations can't be compressed.\n")
+        raise typer.Exit(code=1)
+
+    FileSystem(migrations_directory).create_migration_file(
+        migration_name, python=python, compressed=compressed
+    )
 
 
 @app.command(name="apply")
@@ -107,54 +154,967 @@ def apply_migrations(
             callback=confirm_no_transaction,
         ),
     ] = False,
+    yes: Annotated[
+        bool,
+        typer.Option(
+            "--yes",
+            "-y",
+            help="Skip the confirmation for --no-transaction, for automated deploys.",
+            is_eager=True,
+        ),
+    ] = False,
+    lock_timeout: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Longest a statement waits for a lock before giving up, like 5s.",
+            show_default="Server setting",
+        ),
+    ] = None,
+    statement_timeout: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Longest a statement can run before being cancelled, like 1min.",
+            show_default="Server setting",
+        ),
+    ] = None,
+    retries: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help="Times to retry after a lock timeout. Retries the whole "
+            + "transaction or with --no-transaction just the statement.",
+        ),
+    ] = 0,
+    retry_delay: Annotated[
+        float,
+        typer.Option(
+            min=0,
+            help="Base delay in seconds between retries. Doubles each attempt "
+            + "with random jitter.",
+        ),
+    ] = 1.0,
+    allow_out_of_order: Annotated[
+        bool,
+        typer.Option(
+            "--allow-out-of-order",
+            help="Also apply migrations older than the last applied one, "
+            + "like ones merged from a long running branch.",
+        ),
+    ] = False,
+    json_output: Annotated[
+        bool,
+        typer.Option(
+            "--json",
+            help="Print a line of JSON for each phase, migration and statement "
+            + "instead of the usual output.",
+        ),
+    ] = False,
+    metrics_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help="File to write Prometheus metrics of the run to, for "
+            + "node_exporter's textfile collector.",
+        ),
+    ] = None,
+    trace_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help="File to append OpenTelemetry spans of the run to in the OTLP "
+            + "JSON format.",
+        ),
+    ] = None,
 ):
     """Runs outstanding migrations.
 
     Should be run after `setup` and once new migrations have been created
     with `new`. Will find new migrations then apply specified number to the
-    database in order of oldest unapplied to newest. If an error occurs while
-    applying a migration, none of the migrations will be applied.
+    database in order of oldest unapplied to newest. Migrations are applied in
+    a transaction so if an error occurs none of them will be applied, except
+    for migrations that can't run in one which are applied on their own.
+    Unapplied migrations older than the last applied one are an error unless
+    --allow-out-of-order is given. Timings can be exported with --json,
+    --metrics-file and --trace-file.
+    """
+
+    from .utils import Database, FileSystem, MigrationCache
+    from .utils.events import PHASE, open_event_log, record_run
+    from .utils.timeouts import RetryPolicy, Timeouts
+
+    events = open_event_log(json_output, metrics_file, trace_file)
+
+    with record_run(events, "apply", quiet=json_output) as run:
+        with events.timed(PHASE, phase="connect"):
+            db = Database(postgres_uri, MigrationCache(), events)
+        fs = FileSystem(migrations_directory)
+
+        with events.timed(PHASE, phase="scan") as scan:
+            all_migration_files = fs.get_migration_files()
+            scan["files"] = len(all_migration_files)
+
+        # Checked before taking the lock so runs with nothing to do don't wait
+        # on runs that are applying migrations
+        with events.timed(PHASE, phase="plan") as plan:
+            outstanding, _ = _outstanding_migrations(
+                all_migration_files,
+                db.get_applied_migrations(),
+                migrations_directory,
+                allow_out_of_order,
+            )
+            plan["outstanding"] = len(outstanding)
+
+        print(
+            f"Found {len(all_migration_files)} migration files with {len(outstanding)} outstanding.\n"
+        )
+        run["applied"] = 0
+
+        # No new migrations
+        if not outstanding:
+            return
+
+        with db.migration_lock():
+            # Another run may have applied some while this one waited for the lock
+            recheck, baselines = _outstanding_migrations(
+                all_migration_files,
+                db.get_applied_migrations(quiet=True),
+                migrations_directory,
+                allow_out_of_order,
+            )
+            if len(recheck) != len(outstanding):
+                print(
+                    f"Another run applied {len(outstanding) - len(recheck)} of the outstanding migrations.\n"
+                )
+                outstanding = recheck
+
+                if not outstanding:
+                    return
+
+            # Databases that applied everything a baseline replaces record it so
+            # the migration table matches the directory
+            for baseline in baselines:
+                db.record_baseline(baseline, fs.get_migration(baseline))
+
+            files = outstanding[:count] if count > -1 else outstanding
+
+            to_apply = [(file, fs.get_migration(file)) for file in files]
+
+            db.set_timeouts(Timeouts(lock_timeout, statement_timeout))
+            db.apply_migrations(
+                to_apply, no_transaction, RetryPolicy(retries, base_delay=retry_delay)
+            )
+            run["applied"] = len(files)
+
+
+def _outstanding_migrations(
+    all_migration_files: List[str],
+    applied: List[str],
+    migrations_directory: Path,
+    allow_out_of_order: bool,
+) -> Tuple[List[str], List[str]]:
+    """Gets the migration files that haven't been applied and the baselines to record
+
+    Files older than the last applied migration are only included with
+    allow_out_of_order. A database whose last applied migration was squashed
+    continues from the baseline that replaced it.
+    """
+
+    from .utils.exits import fail
+    from .utils.file_system import ARCHIVE_DIRECTORY
+    from .utils.pending import find_pending
+
+    result = find_pending(migrations_directory, all_migration_files, applied)
+
+    if result.diverged:
+        archive = migrations_directory / ARCHIVE_DIRECTORY
+        if (archive / result.last_applied).is_file():  # type: ignore
+            fail(
+                f"[bold red]Error[/] migration [b]{result.last_applied}[/] was squashed into a baseline the database hasn't reached.\n"
+                f"Apply the rest of the squashed migrations with [b]--migrations-directory {archive}[/] first.\n"
+            )
+        fail(
+            f"[bold red]Error[/] migration [b]{result.last_applied}[/] not found in the migration directory.\n"
+        )
+
+    if not result.out_of_order:
+        return result.pending, result.baselines
+
+    if not allow_out_of_order:
+        fail(
+            f"[bold red]Error[/] {len(result.out_of_order)} migration{'s are' if len(result.out_of_order) > 1 else ' is'} older than the last applied migration [b]{result.last_applied}[/] but not applied:\n\n"
+            + "".join(f"  {file_name}\n" for file_name in result.out_of_order)
+            + "\nApply them anyway with [b]--allow-out-of-order[/].\n"
+        )
+
+    # Both are sorted and every out of order file sorts first
+    return result.out_of_order + result.pending, result.baselines
+
+
+@app.command(name="apply-all")
+def apply_all(
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    count: Annotated[
+        int,
+        typer.Argument(
+            help="Number of new migrations to apply to each database.",
+            show_default="All",
+        ),
+    ] = -1,
+    uris_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            exists=True,
+            dir_okay=False,
+            help="File with the URI of a database on each line.",
+        ),
+    ] = None,
+    discover_uri: Annotated[
+        Optional[str],
+        typer.Option(help="URI of the database to run --discover-query against."),
+    ] = None,
+    discover_query: Annotated[
+        Optional[str],
+        typer.Option(help="Query returning the URI of a database in each row."),
+    ] = None,
+    workers: Annotated[
+        int, typer.Option(min=1, help="Number of databases migrated at once.")
+    ] = 4,
+    fail_fast: Annotated[
+        bool,
+        typer.Option(
+            "--fail-fast",
+            help="Stop starting new databases once one fails instead of continuing.",
+        ),
+    ] = False,
+    log_directory: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to write the full output for each database to."),
+    ] = None,
+    no_transaction: Annotated[
+        bool,
+        typer.Option(
+            "--no-transaction",
+            help="Apply migrations without wrapping them in a transaction.\n\n"
+            + NO_TRANSACTION_MESSAGE,
+            callback=confirm_no_transaction,
+        ),
+    ] = False,
+    yes: Annotated[
+        bool,
+        typer.Option(
+            "--yes",
+            "-y",
+            help="Skip the confirmation for --no-transaction, for automated deploys.",
+            is_eager=True,
+        ),
+    ] = False,
+    lock_timeout: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Longest a statement waits for a lock before giving up, like 5s.",
+            show_default="Server setting",
+        ),
+    ] = None,
+    statement_timeout: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Longest a statement can run before being cancelled, like 1min.",
+            show_default="Server setting",
+        ),
+    ] = None,
+    retries: Annotated[
+        int,
+        typer.Option(min=0, help="Times to retry after a lock timeout."),
+    ] = 0,
+    retry_delay: Annotated[
+        float,
+        typer.Option(min=0, help="Base delay in seconds between retries."),
+    ] = 1.0,
+    allow_out_of_order: Annotated[
+        bool,
+        typer.Option(
+            "--allow-out-of-order",
+            help="Also apply migrations older than the last applied one.",
+        ),
+    ] = False,
+):
+    """Runs outstanding migrations on many databases at once.
+
+    Databases are read from --uris-file or found by running --discover-query
+    against --discover-uri. Each is migrated as with `apply` in its own
+    process with up to --workers running at once. Failures don't stop other
+    databases unless --fail-fast is given. A summary of every database is
+    shown at the end.
     """
 
+    from rich.markup import escape
+    from rich.table import Table
+
+    from .utils.fan_out import (
+        apply_to_databases,
+        discover_uris,
+        read_uris,
+        redact_uri,
+    )
+
+    if (uris_file is None) == (discover_query is None):
+        print("[bold red]Error[/] give either --uris-file or --discover-query.\n")
+        raise typer.Exit(code=1)
+
+    if uris_file is not None:
+        uris = read_uris(uris_file)
+    else:
+        if discover_uri is None:
+            print("[bold red]Error[/] --discover-query needs --discover-uri.\n")
+            raise typer.Exit(code=1)
+
+        uris = discover_uris(discover_uri, discover_query)  # type: ignore
+
+    print(f"Applying migrations to {len(uris)} databases with {workers} workers.\n")
+
+    apply_args = [
+        "--migrations-directory",
+        str(migrations_directory),
+        "--retries",
+        str(retries),
+        "--retry-delay",
+        str(retry_delay),
+    ]
+    if count > -1:
+        apply_args.append(str(count))
+    if no_transaction:
+        apply_args += ["--no-transaction", "--yes"]
+    if lock_timeout is not None:
+        apply_args += ["--lock-timeout", lock_timeout]
+    if statement_timeout is not None:
+        apply_args += ["--statement-timeout", statement_timeout]
+    if allow_out_of_order:
+        apply_args.append("--allow-out-of-order")
+
+    status_styles = {"applied": "bold green", "failed": "bold red", "skipped": "yellow"}
+
+    def report(result):
+        style = status_styles[result.status]
+        print(
+            f"[{style}]{result.status.capitalize()}[/] {redact_uri(result.uri)} "
+            f"({result.seconds:.1f}s) {escape(result.detail)}"
+        )
+
+    results = apply_to_databases(
+        uris, apply_args, workers, fail_fast, log_directory, report
+    )
+
+    table = Table("Database", "Status", "Duration", "Detail")
+    for result in results:
+        table.add_row(
+            redact_uri(result.uri),
+            f"[{status_styles[result.status]}]{result.status}[/]",
+            f"{result.seconds:.1f}s",
+            escape(result.detail),
+        )
+
+    print()
+    print(table)
+
+    totals = {
+        status: sum(result.status == status for result in results)
+        for status in status_styles
+    }
+    print(
+        f"\n{totals['applied']} applied, {totals['failed']} failed, "
+        f"{totals['skipped']} skipped.\n"
+    )
+
+    if totals["failed"]:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def status(
+    postgres_uri: Annotated[
+        str, typer.Option(envvar="POSTGRES_URI", help=POSTGRES_URI_HELP)
+    ],
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    json_output: Annotated[
+        bool, typer.Option("--json", help="Print the status as JSON.")
+    ] = False,
+    timeout: Annotated[
+        float,
+        typer.Option(min=0, help="Seconds to wait when connecting to the database."),
+    ] = 5.0,
+):
+    """Checks if the database has every migration applied without changing it.
+
+    Takes a single query and a scan of the migrations directory so it can be
+    used in readiness probes and CI. Exits with 0 when up to date, 3 when
+    migrations are outstanding and 4 when the last applied migration isn't in
+    the migrations directory. Other errors exit with 1.
+    """
+
+    import json
+
+    from .utils.errors import PetiteError
+    from .utils.status import EXIT_CODES, PENDING, UP_TO_DATE, get_status
+
+    try:
+        result = get_status(postgres_uri, migrations_directory, timeout)
+    except PetiteError as e:
+        if json_output:
+            typer.echo(json.dumps({"state": "error", "error": str(e)}))
+        else:
+            print(f"[bold red]Error[/] checking status: {e}\n")
+        raise typer.Exit(code=1)
+
+    if json_output:
+        typer.echo(json.dumps(result._asdict()))
+    elif result.state == UP_TO_DATE:
+        print(
+            f"[bold green]Up to date[/] with {result.applied_count} migration{'s' if result.applied_count != 1 else ''} applied.\n"
+        )
+    elif result.state == PENDING:
+        outstanding = result.out_of_order + result.pending
+        out_of_order = set(result.out_of_order)
+        print(
+            f"[bold yellow]Outstanding[/] {len(outstanding)} migration{'s' if len(outstanding) > 1 else ''}:\n"
+        )
+        for file_name in outstanding:
+            if file_name in out_of_order:
+                print(f"  {file_name} [yellow](out of order)[/]")
+            else:
+                print(f"  {file_name}")
+        print()
+    else:
+        print(
+            f"[bold red]Diverged[/] last applied migration [b]{result.last_applied}[/] not found in the migration directory.\n"
+        )
+
+    raise typer.Exit(code=EXIT_CODES[result.state])
+
+
+@app.command()
+def verify(
+    postgres_uri: Annotated[
+        str, typer.Option(envvar="POSTGRES_URI", help=POSTGRES_URI_HELP)
+    ],
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    workers: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help="Number of threads used to hash migration files.",
+            show_default="Based on CPU count",
+        ),
+    ] = None,
+):
+    """Checks applied migrations haven't changed since they were applied.
+
+    Hashes every file in the migrations directory and compares them against
+    the checksums recorded when the migrations were applied. Exits with code
+    1 if an applied migration was modified or is missing from the directory.
+    Files that have not been applied yet are listed but are not an error.
+    """
+
+    from .utils import Database, FileSystem
+    from .utils.checksum import find_drift
+
     db = Database(postgres_uri)
     fs = FileSystem(migrations_directory)
 
+    drift = find_drift(fs.get_migration_checksums(workers), db.get_applied_checksums())
+
+    for label, names in [
+        ("[bold red]Modified[/]", drift.modified),
+        ("[bold red]Missing[/]", drift.missing),
+        ("[bold yellow]Unknown[/]", drift.unknown),
+    ]:
+        for name in names:
+            print(f"{label} migration [b]{name}[/].")
+
+    if drift.unchecked:
+        print(
+            f"\n{len(drift.unchecked)} migration{'s were' if len(drift.unchecked) > 1 else ' was'} "
+            "applied before checksums were recorded and could not be checked."
+        )
+
+    if drift.modified or drift.missing:
+        print(
+            f"\n[bold red]Drift detected[/] {len(drift.modified)} modified and "
+            f"{len(drift.missing)} missing migration{'s' if len(drift.modified) + len(drift.missing) > 1 else ''}.\n"
+        )
+        raise typer.Exit(code=1)
+
+    print(
+        "\n[bold green]Verified[/] applied migrations match the migrations directory.\n"
+    )
+
+
+@app.command()
+def check(
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    workers: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help="Number of processes used to parse migration files.",
+            show_default="CPU count",
+        ),
+    ] = None,
+):
+    """Checks every migration file parses without connecting to the database.
+
+    Files are parsed in parallel across a pool of processes and syntax
+    errors are reported with their line and column. Results are cached by
+    file content so only new or changed files are parsed again. Exits with
+    code 1 if any migration has a syntax error.
+    """
+
+    from .utils import FileSystem, MigrationCache
+    from .utils.check import check_files
+
+    fs = FileSystem(migrations_directory)
+    files = fs.get_migration_files()
+
+    results = check_files(
+        [migrations_directory / file for file in files], workers, MigrationCache()
+    )
+
+    failed = 0
+    for file, problems in results.items():
+        if problems:
+            failed += 1
+        for problem in problems:
+            print(
+                f"[bold red]Error[/] {migrations_directory / file}:{problem.line}:{problem.column} {problem.message}"
+            )
+
+    if failed:
+        print(
+            f"\n[bold red]Found syntax errors[/] in {failed} of {len(files)} migration{'s' if len(files) > 1 else ''}.\n"
+        )
+        raise typer.Exit(code=1)
+
+    print(
+        f"[bold green]Checked[/] {len(files)} migration{'s' if len(files) != 1 else ''} without finding syntax errors.\n"
+    )
+
+
+@app.command()
+def lint(
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    postgres_uri: Annotated[
+        Optional[str],
+        typer.Option(
+            envvar="POSTGRES_URI",
+            help="URI of the database whose outstanding migrations are linted.",
+        ),
+    ] = None,
+    all_migrations: Annotated[
+        bool,
+        typer.Option(
+            "--all", help="Lint every migration instead of only outstanding ones."
+        ),
+    ] = False,
+    ignore: Annotated[
+        Optional[List[str]],
+        typer.Option(help="Rule to skip. Can be given multiple times."),
+    ] = None,
+    warn: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            help="Rule to report as a warning instead of an error. Can be given multiple times."
+        ),
+    ] = None,
+    strict: Annotated[
+        bool,
+        typer.Option("--strict", help="Fail on warnings as well as errors."),
+    ] = False,
+):
+    """Checks migrations for statements that lock or rewrite tables.
+
+    Every statement is classified by the lock it takes on an existing table
+    and if it rewrites or scans the whole table while holding it. Risky
+    statements are reported with a safer alternative. Without --all only
+    migrations outstanding on the database are reported, though earlier
+    ones are still read to know which columns have a validated NOT NULL
+    check. A rule can be skipped for one statement with a
+    `-- petite-lint: ignore RULE` comment before it. Exits with 1 if there
+    are errors, or warnings with --strict.
+    """
+
+    import logging
+
+    from rich.table import Table
+
+    from .utils import FileSystem
+    from .utils.errors import PetiteError
+    from .utils.file_system import is_python_migration, open_content
+    from .utils.lint import ERROR, RULES, WRITE_BLOCKING_LOCKS, Linter
+    from .utils.status import DIVERGED, get_status
+
+    # sqlglot warns about every statement it can't fully parse
+    logging.getLogger("sqlglot").setLevel(logging.ERROR)
+
+    try:
+        linter = Linter(ignore or [], warn or [])
+    except ValueError as e:
+        print(f"[bold red]Error[/] {e}. Rules are: {', '.join(RULES)}.\n")
+        raise typer.Exit(code=1)
+
+    fs = FileSystem(migrations_directory)
     all_migration_files = fs.get_migration_files()
-    most_recent_migration = db.get_last_applied_migration()
 
-    if most_recent_migration is not None:
+    if all_migrations:
+        reported = set(all_migration_files)
+    elif postgres_uri is None:
+        print(
+            "[bold red]Error[/] give --postgres-uri to lint outstanding migrations or --all.\n"
+        )
+        raise typer.Exit(code=1)
+    else:
         try:
-            most_recent_migration_index = all_migration_files.index(
-                most_recent_migration[1]
-            )
-        except ValueError:
+            result = get_status(postgres_uri, migrations_directory, 5.0)
+        except PetiteError as e:
+            print(f"[bold red]Error[/] finding outstanding migrations: {e}\n")
+            raise typer.Exit(code=1)
+
+        if result.state == DIVERGED:
             print(
-                f"[bold red]Error[/] migration [b]{most_recent_migration[1]}[/] not found in the migration directory.\n"
+                f"[bold red]Error[/] migration [b]{result.last_applied}[/] not found in the migration directory.\n"
             )
             raise typer.Exit(code=1)
-    else:
-        most_recent_migration_index = -1
 
-    starting_migration_index = most_recent_migration_index + 1
+        reported = set(result.out_of_order + result.pending)
+
+    errors = warnings = 0
+
+    for file in all_migration_files:
+        # Python migrations don't have statements to classify
+        if is_python_migration(file):
+            continue
+
+        with open_content(fs.get_migration(file)) as content:
+            reports = linter.lint(file, content)
+
+        if file not in reported:
+            continue
+
+        # Only statements that can block writes are worth listing
+        risky = [
+            report
+            for report in reports
+            if report.findings or report.rewrite or report.lock in WRITE_BLOCKING_LOCKS
+        ]
+        if not risky:
+            continue
+
+        table = Table("Line", "Statement", "Table", "Lock", "Rewrite", title=file)
+        for report in risky:
+            table.add_row(
+                str(report.line),
+                report.kind,
+                report.table or "",
+                report.lock or "",
+                "[bold red]yes[/]" if report.rewrite else "",
+            )
+        print(table)
+
+        for report in risky:
+            for finding in report.findings:
+                if finding.severity == ERROR:
+                    errors += 1
+                    label = "[bold red]Error[/]"
+                else:
+                    warnings += 1
+                    label = "[bold yellow]Warning[/]"
+
+                print(
+                    f"{label} {file}:{report.line} [b]{finding.rule}[/] {finding.message}\n"
+                    f"  Instead: {finding.suggestion}"
+                )
+        print()
 
     print(
-        f"Found {len(all_migration_files)} migration files with {len(all_migration_files[starting_migration_index:])} outstanding.\n"
+        f"Linted {len(reported)} migration{'s' if len(reported) != 1 else ''} "
+        f"with {errors} error{'s' if errors != 1 else ''} and {warnings} warning{'s' if warnings != 1 else ''}.\n"
     )
 
-    # No new migrations
-    if starting_migration_index == len(all_migration_files):
+    if errors or (strict and warnings):
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def history(
+    postgres_uri: Annotated[
+        str, typer.Option(envvar="POSTGRES_URI", help=POSTGRES_URI_HELP)
+    ],
+    limit: Annotated[
+        int, typer.Option(min=1, help="Number of migrations to list.")
+    ] = 10,
+    compare: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            help="""
+                URI of another database to compare durations against.
+                Can be given multiple times.
+            """,
+        ),
+    ] = None,
+    statements: Annotated[
+        bool,
+        typer.Option(
+            "--statements",
+            help="List the slowest statements of migrations applied without a transaction instead.",
+        ),
+    ] = False,
+):
+    """Lists the slowest applied migrations.
+
+    The duration, statement count and size of every migration is recorded
+    when it is applied, along with the duration of every statement when
+    applied without a transaction. Databases given with --compare have the
+    durations of the same migrations listed alongside so runs in different
+    environments can be compared.
+    """
+
+    from rich.table import Table
+
+    from .utils import Database
+
+    db = Database(postgres_uri)
+
+    if statements:
+        table = Table("Migration", "Statement", "Kind", "Duration", "Bytes")
+
+        for file_name, index, kind, duration_ms, size in db.get_statement_history(
+            limit
+        ):
+            table.add_row(
+                file_name, str(index + 1), kind, f"{duration_ms:,.1f} ms", f"{size:,}"
+            )
+
+        print(table)
         return
 
-    ending_migration_index = (
-        # Ensures we don't go out of bounds
-        min(starting_migration_index + count, len(all_migration_files))
-        if count > -1
-        # Run all migrations
-        else len(all_migration_files)
+    rows = db.get_migration_history(limit)
+    others = [
+        Database(uri).get_migration_durations([row[0] for row in rows])
+        for uri in compare or []
+    ]
+
+    table = Table("Migration", "Run on", "Duration", "Statements", "Bytes")
+    for index in range(len(others)):
+        table.add_column(f"Compare {index + 1}")
+
+    for file_name, run_on, duration_ms, statement_count, size in rows:
+        table.add_row(
+            file_name,
+            f"{run_on:%Y-%m-%d %H:%M:%S}",
+            _format_duration(duration_ms),
+            "" if statement_count is None else str(statement_count),
+            "" if size is None else f"{size:,}",
+            *(_format_duration(other.get(file_name)) for other in others),
+        )
+
+    print(table)
+
+
+def _format_duration(duration_ms: Optional[float]) -> str:
+    return "" if duration_ms is None else f"{duration_ms:,.1f} ms"
+
+
+@app.command()
+def squash(
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    scratch_uri: Annotated[
+        str,
+        typer.Option(
+            envvar="PETITE_SCRATCH_URI",
+            help="URI of a server where a temporary database can be created. "
+            + "Shouldn't be your production database.",
+        ),
+    ],
+    up_to: Annotated[
+        str,
+        typer.Argument(help="Last migration file the baseline replaces."),
+    ],
+    pg_dump: Annotated[
+        str,
+        typer.Option(help="Path of the pg_dump program to capture the schema with."),
+    ] = "pg_dump",
+    schema_only: Annotated[
+        bool,
+        typer.Option(
+            "--schema-only",
+            help="Leave out rows inserted by the migrations, like seed data.",
+        ),
+    ] = False,
+):
+    """Replaces every migration up to a file with a single baseline migration.
+
+    The migrations are applied to a temporary database and the result is
+    captured with pg_dump as the baseline. Squashed files are moved to an
+    archive directory inside the migrations directory. New databases apply
+    the baseline then the newer migrations while databases that already
+    applied the squashed migrations skip it.
+    """
+
+    import psycopg
+
+    from .utils import Database, FileSystem, MigrationCache
+    from .utils.squash import (
+        archive_migrations,
+        baseline_name,
+        dump_database,
+        scratch_database,
+        squashable_migrations,
+        write_baseline,
     )
 
-    files = all_migration_files[starting_migration_index:ending_migration_index]
+    fs = FileSystem(migrations_directory)
+
+    try:
+        files = squashable_migrations(migrations_directory, up_to)
+    except ValueError as e:
+        print(f"[bold red]Error[/] {e}.\n")
+        raise typer.Exit(code=1)
+
+    if (migrations_directory / baseline_name(up_to)).exists():
+        print(
+            f"[bold red]Error[/] baseline [b]{baseline_name(up_to)}[/] already exists.\n"
+        )
+        raise typer.Exit(code=1)
+
+    try:
+        with scratch_database(scratch_uri) as uri:
+            db = Database(uri, MigrationCache())
+            db.create_migration_table()
+            db.apply_migrations([(file, fs.get_migration(file)) for file in files])
+            db.conn.close()
+
+            dump = dump_database(uri, pg_dump, schema_only)
+    except psycopg.Error as e:
+        print(
+            f"[bold red]Could not create the scratch database![/]\n\n[b]Error[/]: {e}\n"
+        )
+        raise typer.Exit(code=1)
+    except RuntimeError as e:
+        print(
+            f"[bold red]Could not dump the scratch database![/]\n\n[b]Error[/]: {e}\n"
+        )
+        raise typer.Exit(code=1)
+
+    baseline = write_baseline(migrations_directory, up_to, len(files), dump)
+    archive = archive_migrations(migrations_directory, files)
+
+    print(
+        f"[bold green]Squashed[/] {len(files)} migration{'s' if len(files) > 1 else ''} into [b]{baseline}[/].\n"
+        f"The squashed files were moved to [b]{archive}[/].\n"
+    )
+
+
+@app.command()
+def template(
+    postgres_uri: Annotated[
+        str,
+        typer.Option(
+            envvar="POSTGRES_URI",
+            help="URI of a database on the server the template is created on.",
+        ),
+    ],
+    migrations_directory: Annotated[
+        Path,
+        typer.Option(
+            envvar="MIGRATIONS_DIRECTORY",
+            help="Path to location where the migration files are stored.",
+        ),
+    ],
+    prefix: Annotated[
+        str,
+        typer.Option(
+            help="Prefix of the template name, one per project sharing a server."
+        ),
+    ] = "petite_template",
+):
+    """Creates a template database with every migration applied.
+
+    The template is named after a checksum of the migrations directory so it
+    is only rebuilt when a migration changes. Test databases can then be
+    created from it with CREATE DATABASE ... TEMPLATE in milliseconds instead
+    of applying every migration. Prints the name of the template.
+    """
+
+    import psycopg
+
+    from .utils.errors import PetiteError
+    from .utils.templates import ensure_template
+
+    if not migrations_directory.is_dir():
+        print("[bold red]Migration directory not found![/]\n")
+        raise typer.Exit(code=1)
 
-    to_apply = [(file, fs.get_migration(file)) for file in files]
+    try:
+        name = ensure_template(postgres_uri, migrations_directory, prefix)
+    except (PetiteError, psycopg.Error) as e:
+        print(f"[bold red]Could not create the template![/]\n\n[b]Error[/]: {e}\n")
+        raise typer.Exit(code=1)
 
-    db.apply_migrations(to_apply, no_transaction)
+    print(f"[bold green]Template[/] [b]{name}[/] is up to date.\n")
+
+
+cache_app = typer.Typer(help="Manages the cache of split migration files.")
+app.add_typer(cache_app, name="cache")
+
+
+@cache_app.command(name="clear")
+def clear_cache():
+    """Removes every entry from the migration cache.
+
+    The cache stores the statements found in migration files so they don't
+    have to be split again on later runs. Its location can be changed with
+    the PETITE_CACHE_DIR environment variable.
+    """
+
+    from .utils import MigrationCache
+
+    cache = MigrationCache()
+    removed = cache.clear()
+
+    print(
+        f"[bold green]Cleared[/] {removed} cached migration{'s' if removed != 1 else ''} from [b]{cache.directory}[/].\n"
+    )
@@ -0,0 +1,102 @@
+"""Pytest plugin giving each test a database cloned from a migrated template
+
+Migrations are applied once into a template database named after a checksum
+of the migrations directory. Every test using the petite_database fixture
+gets its own database cloned from the template, which takes milliseconds
+instead of replaying every migration. The template is rebuilt when a
+migration changes.
+
+The server is set with --petite-uri, the petite_uri ini option or the
+PETITE_TEST_URI environment variable and the migrations with
+--petite-migrations-directory, the petite_migrations_directory ini option
+or the MIGRATIONS_DIRECTORY environment variable.
+"""
+
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("petite")
+    group.addoption(
+        "--petite-uri",
+        help="URI of a database on the server test databases are created on.",
+    )
+    group.addoption(
+        "--petite-migrations-directory",
+        help="Path to location where the migration files are stored.",
+    )
+
+    parser.addini(
+        "petite_uri", "URI of a database on the server test databases are created on."
+    )
+    parser.addini(
+        "petite_migrations_directory",
+        "Path to location where the migration files are stored.",
+    )
+    parser.addini(
+        "petite_template_prefix",
+        "Prefix of the template database name, one per project sharing a server.",
+        default="petite_template",
+    )
+
+
+def _setting(config: pytest.Config, name: str, envvar: str) -> str:
+    value = (
+        config.getoption(f"--{name.replace('_', '-')}")
+        or config.getini(name)
+        or os.environ.get(envvar)
+    )
+
+    if not value:
+        raise pytest.UsageError(
+            f"petite needs --{name.replace('_', '-')}, the {name} ini option "
+            f"or {envvar} to be set"
+        )
+
+    return value
+
+
+@pytest.fixture(scope="session")
+def petite_uri(pytestconfig: pytest.Config) -> str:
+    """URI of a database on the server test databases are created on"""
+
+    return _setting(pytestconfig, "petite_uri", "PETITE_TEST_URI")
+
+
+@pytest.fixture(scope="session")
+def petite_template(pytestconfig: pytest.Config, petite_uri: str) -> str:
+    """Name of the template database with every migration applied"""
+
+    from .utils.templates import ensure_template
+
+    migrations_directory = _setting(
+        pytestconfig, "petite_migrations_directory", "MIGRATIONS_DIRECTORY"
+    )
+
+    return ensure_template(
+        petite_uri,
+        Path(migrations_directory),
+        pytestconfig.getini("petite_template_prefix"),
+    )
+
+
+@pytest.fixture
+def petite_database(petite_uri: str, petite_template: str) -> Iterator[str]:
+    """URI of a new database with every migration applied
+
+    The database is dropped after the test.
+    """
+
+    from urllib.parse import urlsplit
+
+    from .utils.templates import clone_template, drop_database
+
+    uri = clone_template(petite_uri, petite_template)
+
+    yield uri
+
+    drop_database(petite_uri, urlsplit(uri).path.lstrip("/"))
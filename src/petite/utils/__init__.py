@@ -1,2 +1,32 @@
-from .database import Database
-from .file_system import FileSystem
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .async_database import AsyncDatabase
+    from .cache import MigrationCache
+    from .database import Database
+    from .file_system import FileSystem
+
+# Maps the public names of this package to the modules they live in. They are
+# only imported when first accessed so commands that don't need the database
+# don't pay for importing psycopg and sqlglot
+_LAZY_IMPORTS = {
+    "AsyncDatabase": ".async_database",
+    "Database": ".database",
+    "FileSystem": ".file_system",
+    "MigrationCache": ".cache",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    from importlib import import_module
+
+    value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+    # Cache the value so later lookups skip this function
+    globals()[name] = value
+
+    return value
@@ -0,0 +1,193 @@
+"""Asyncio counterpart to Database for use inside async applications"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import psycopg
+
+from .cache import MigrationCache
+from .errors import DatabaseConnectionError
+from .file_system import MigrationContent
+from .migrator import CopyResult, Migrator, Progress
+from .queries import SCHEMA_VERSION
+from .timeouts import RetryPolicy, Timeouts
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncDatabase:
+    """Class to handle database operations for migrations with asyncio
+
+    Behaves like Database but nothing is printed and problems are raised as
+    PetiteError subclasses instead of exiting, so it can be embedded in
+    async applications. Progress is logged to the petite logger.
+
+    Migrations are applied by the same Migrator as Database rather than a
+    copy of it written for psycopg's AsyncConnection, so both apply them
+    exactly the same way. The Migrator works over a blocking connection so
+    each call runs it in a worker thread, reading and splitting files
+    included, and the event loop isn't blocked. Cancelling a call cancels
+    the query running on the server then waits for the thread to stop.
+
+    Create one with connect:
+
+        async with await AsyncDatabase.connect(uri) as db:
+            await db.apply_migrations(migrations)
+    """
+
+    def __init__(
+        self, conn: psycopg.Connection, cache: Optional[MigrationCache] = None
+    ) -> None:
+        # Blocking so it's only ever used from the worker thread
+        self._conn = conn
+        self.migrator = Migrator(conn, cache, progress=_LoggedProgress())
+
+    @classmethod
+    async def connect(
+        cls, uri: str, cache: Optional[MigrationCache] = None
+    ) -> "AsyncDatabase":
+        """Connects to the database at uri"""
+
+        try:
+            conn = await asyncio.to_thread(psycopg.connect, uri)
+        except psycopg.Error as e:
+            raise DatabaseConnectionError(str(e)) from e
+
+        return cls(conn, cache)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._conn.close)
+
+    async def __aenter__(self) -> "AsyncDatabase":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def create_migration_table(self) -> None:
+        """Creates the migration tables or upgrades ones made by older versions"""
+
+        version = await self._run(self.migrator.upgrade_schema, True)
+        if 0 < version < SCHEMA_VERSION:
+            self.migrator.progress.upgraded_schema(version)
+
+    async def get_last_applied_migration(
+        self,
+    ) -> Optional[Tuple[int, str, datetime]]:
+        """Gets the last migration that was applied returning whole row
+
+        Tables made by older versions are upgraded first.
+        """
+
+        return await self._run(self.migrator.get_last_applied_migration)
+
+    @asynccontextmanager
+    async def migration_lock(self) -> AsyncIterator[None]:
+        """Holds the advisory lock that makes concurrent applies take turns
+
+        Check for outstanding migrations again once the lock is held since
+        another run may have applied them while this one waited.
+        """
+
+        await self._run(self.migrator.lock)
+        try:
+            yield
+        finally:
+            await self._run(self.migrator.unlock)
+
+    async def set_timeouts(self, timeouts: Timeouts) -> None:
+        """Sets the timeouts used for the rest of the session"""
+
+        await self._run(self.migrator.set_timeouts, timeouts)
+
+    async def apply_migrations(
+        self,
+        migrations: Sequence[Tuple[str, MigrationContent]],
+        no_transaction: bool = False,
+        retry: RetryPolicy = RetryPolicy(),
+    ) -> List[str]:
+        """Applies migration files to the database in order
+
+        Migrations are planned and applied the same way as by Database,
+        Python migrations included. Returns the names of the migrations
+        applied. Raises InvalidMigration if a migration has invalid
+        directives and MigrationError if one fails to apply.
+        """
+
+        return await self._run(
+            self.migrator.apply_migrations, migrations, no_transaction, retry
+        )
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs a Migrator method in a worker thread
+
+        Threads can't be stopped, so on cancellation the server is asked to
+        cancel the running query, which makes the method fail soon after.
+        The connection is only handed back once the thread is done with it.
+        """
+
+        work = asyncio.ensure_future(asyncio.to_thread(func, *args))
+
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self._conn.cancel_safe)
+            # The method then fails on the cancelled query. Retrieving the
+            # error stops asyncio logging it as never retrieved.
+            await asyncio.wait([work])
+            if not work.cancelled():
+                work.exception()
+            raise
+
+
+class _LoggedProgress(Progress):
+    """Logs the steps of applying migrations worth knowing about"""
+
+    def upgraded_schema(self, version: int) -> None:
+        logger.info(
+            "Upgraded migration table from version %d to %d", version, SCHEMA_VERSION
+        )
+
+    def waiting_for_lock(self) -> None:
+        logger.info("Waiting for another run to finish applying migrations")
+
+    def copied(self, name: str, rows: CopyResult) -> None:
+        logger.info(
+            "Copied %d rows in %.2fs into migration %s", rows.count, rows.seconds, name
+        )
+
+    def retrying(self, name: str, attempt: int, retries: int, delay: float) -> None:
+        logger.warning(
+            "Lock timeout applying migration %s (attempt %d of %d), retrying in %.2fs",
+            name,
+            attempt + 1,
+            retries + 1,
+            delay,
+        )
+
+    def resuming_backfill(
+        self, name: str, last_key: str, rows: int, chunks: int
+    ) -> None:
+        logger.info(
+            "Resuming backfill %s after key %s with %d rows updated",
+            name,
+            last_key,
+            rows,
+        )
+
+    def backfilled(self, name: str, rows: int, chunks: int) -> None:
+        logger.info("Backfilled %d rows in %d chunks of %s", rows, chunks, name)
@@ -0,0 +1,112 @@
+"""Backfill migrations that update a large table in many small transactions
+
+A backfill migration has a backfill directive naming its table and a single
+statement run once per chunk of keys, with $1 and $2 set to the first and
+last key of the chunk:
+
+    -- petite: backfill=users, key=id, batch_size=5000, rows_per_second=20000
+    UPDATE users SET email_lower = lower(email) WHERE id BETWEEN $1 AND $2;
+
+Chunks are found by walking the key in order so gaps in it don't make empty
+chunks. Each chunk is committed along with the last key done so an
+interrupted backfill carries on where it stopped.
+"""
+
+from typing import Dict, NamedTuple, Optional
+
+DEFAULT_KEY = "id"
+DEFAULT_BATCH_SIZE = 1000
+
+# Seconds between progress messages of a running backfill
+PROGRESS_EVERY = 10.0
+
+
+class Backfill(NamedTuple):
+    """How a backfill migration walks its table"""
+
+    table: str
+    key: str = DEFAULT_KEY
+    batch_size: int = DEFAULT_BATCH_SIZE
+    # Most keys walked per second, None runs chunks back to back
+    rows_per_second: Optional[float] = None
+
+
+def parse_backfill(settings: Dict[str, str]) -> Optional[Backfill]:
+    """Takes the backfill directives out of a migration's settings
+
+    Raises ValueError if they are invalid or given without backfill.
+    """
+
+    table = settings.pop("backfill", None)
+    key = settings.pop("key", None)
+    batch_size = settings.pop("batch_size", None)
+    rows_per_second = settings.pop("rows_per_second", None)
+
+    if table is None:
+        given = [
+            name
+            for name, value in [
+                ("key", key),
+                ("batch_size", batch_size),
+                ("rows_per_second", rows_per_second),
+            ]
+            if value is not None
+        ]
+        if given:
+            raise ValueError(f"{', '.join(given)} can only be used with backfill")
+        return None
+
+    backfill = Backfill(table, key or DEFAULT_KEY)
+
+    if batch_size is not None:
+        if not batch_size.isdigit() or int(batch_size) < 1:
+            raise ValueError(f"Invalid value for batch_size: {batch_size!r}")
+        backfill = backfill._replace(batch_size=int(batch_size))
+
+    if rows_per_second is not None:
+        try:
+            rate = float(rows_per_second)
+        except ValueError:
+            rate = 0
+        if not rate > 0:
+            raise ValueError(f"Invalid value for rows_per_second: {rows_per_second!r}")
+        backfill = backfill._replace(rows_per_second=rate)
+
+    return backfill
+
+
+def chunk_query(backfill: Backfill, resuming: bool):
+    """Builds the query finding the first key, last key and size of the next chunk
+
+    Keys are returned as text so progress can be stored whatever the key's
+    type. When resuming it takes the last key done as its first parameter
+    and the batch size as the last.
+    """
+
+    from psycopg import sql
+
+    table = sql.Identifier(*backfill.table.split("."))
+    key = sql.Identifier(backfill.key)
+
+    return sql.SQL(
+        "SELECT min({key})::text, max({key})::text, count(*) FROM ("
+        "SELECT {key} FROM {table}{where} ORDER BY {key} LIMIT %s"
+        ") chunk"
+    ).format(
+        key=key,
+        table=table,
+        where=(
+            sql.SQL(" WHERE {key} > %s").format(key=key) if resuming else sql.SQL("")
+        ),
+    )
+
+
+def throttle_delay(
+    rows: int, elapsed: float, rows_per_second: Optional[float]
+) -> float:
+    """Seconds to wait for rows walked over elapsed seconds to keep to the rate"""
+
+    if rows_per_second is None:
+        return 0.0
+
+    return max(0.0, rows / rows_per_second - elapsed)
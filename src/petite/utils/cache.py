@@ -0,0 +1,186 @@
+"""On disk cache of results for migrations keyed by their content"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, List, Optional
+
+from .checksum import checksum
+from .splitter import PARSER_VERSION, Statement, split_statements
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_directory() -> Path:
+    """Returns the directory used for the cache when none is given"""
+
+    if "PETITE_CACHE_DIR" in os.environ:
+        return Path(os.environ["PETITE_CACHE_DIR"])
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "petite"
+
+
+class MigrationCache:
+    """Class to cache the statements found in migrations on disk
+
+    Entries are keyed by a hash of the migration content and the parser
+    version so an edited file or a new version of petite never sees stale
+    results. Entries are written to a temporary file and renamed into place
+    so concurrent runs only ever see whole entries. Once the cache grows
+    past max_size the least recently used entries are removed.
+    """
+
+    def __init__(
+        self, directory: Optional[Path] = None, max_size: int = DEFAULT_MAX_SIZE
+    ) -> None:
+        self.directory = directory or default_cache_directory()
+        self.max_size = max_size
+
+    def split(self, content: bytes) -> List[Statement]:
+        """Splits migration content using cached results when possible"""
+
+        key = self.key(content)
+
+        statements = self.get(key)
+        if statements is None:
+            statements = split_statements(content)
+            self.put(key, statements)
+
+        return statements
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        """Returns the cache key for migration content"""
+
+        return f"{PARSER_VERSION}-{checksum(content)}"
+
+    def get(self, key: str) -> Optional[List[Statement]]:
+        """Gets cached statements returning None if not cached"""
+
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+
+        try:
+            return [
+                Statement(
+                    start,
+                    end,
+                    kind,
+                    transactional,
+                    tuple(copy_data) if copy_data is not None else None,
+                )
+                for start, end, kind, transactional, copy_data in entry["statements"]
+            ]
+        except (ValueError, KeyError, TypeError):
+            # Entries that can't be read are misses
+            return None
+
+    def put(self, key: str, statements: List[Statement]) -> None:
+        """Stores statements in the cache"""
+
+        self.put_entry(key, {"statements": statements})
+
+    def get_entry(self, key: str) -> Optional[Any]:
+        """Gets a cached JSON entry returning None if not cached"""
+
+        entry_path = self.directory / f"{key}.json"
+
+        try:
+            with open(entry_path, "rb") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            # Missing entries and ones that can't be read are both misses
+            return None
+
+        try:
+            # Marks the entry as recently used for eviction
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return entry
+
+    def put_entry(self, key: str, entry: Any, evict: bool = True) -> None:
+        """Stores a JSON serializable entry in the cache
+
+        Failing to write to the cache is never an error since it only makes
+        later runs slower. Callers storing many entries at once can skip
+        eviction and evict once at the end.
+        """
+
+        data = json.dumps(entry, separators=(",", ":"))
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.directory, suffix=".tmp", delete=False
+            ) as f:
+                f.write(data)
+
+            os.replace(f.name, self.directory / f"{key}.json")
+        except OSError:
+            return
+
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until under the size limit"""
+
+        entries = []
+        total_size = 0
+
+        try:
+            with os.scandir(self.directory) as it:
+                for dir_entry in it:
+                    if not dir_entry.name.endswith(".json"):
+                        continue
+
+                    try:
+                        stat = dir_entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                    total_size += stat.st_size
+        except OSError:
+            return
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another run evicted it first
+                pass
+
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def clear(self) -> int:
+        """Removes every entry in the cache returning how many were removed"""
+
+        removed = 0
+
+        if not self.directory.exists():
+            return removed
+
+        for path in self.directory.iterdir():
+            if path.suffix in (".json", ".tmp"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+
+                if path.suffix == ".json":
+                    removed += 1
+
+        return removed
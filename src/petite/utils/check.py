@@ -0,0 +1,192 @@
+"""Parses every migration in a directory to find syntax errors"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import sqlglot
+
+from .cache import MigrationCache
+from .checksum import checksum_files
+from .compression import open_decompressed
+from .directives import parse_directives
+from .file_system import is_python_migration
+from .splitter import PARSER_VERSION, iter_statements
+
+# Bump whenever a change to this module could change the problems found for
+# the same content. Cached results are keyed on it.
+CHECK_VERSION = 2
+
+# Below this many files to parse the cost of starting worker processes is
+# more than parsing them in this one
+SERIAL_THRESHOLD = 16
+
+
+class Problem(NamedTuple):
+    """Syntax error found in a migration"""
+
+    line: int
+    column: int
+    message: str
+
+
+def check_content(content: bytes) -> List[Problem]:
+    """Finds the syntax errors in migration content
+
+    Each statement found by the splitter is parsed with sqlglot on its own
+    so an error is reported at its position in the file. Statements sqlglot
+    doesn't know are accepted rather than reported, only ones it fails to
+    make sense of are problems.
+    """
+
+    problems = []
+
+    try:
+        parse_directives(content)
+    except ValueError as e:
+        problems.append(Problem(1, 1, str(e)))
+
+    # Counting from the start of the previous statement takes in the lines
+    # of the statement itself and of any COPY data following it
+    previous_start = 0
+    line = 1
+
+    for statement in iter_statements(content):
+        line += content.count(b"\n", previous_start, statement.start)
+        line_start = content.rfind(b"\n", 0, statement.start) + 1
+        previous_start = statement.start
+
+        try:
+            text = content[statement.start : statement.end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            problems.append(
+                Problem(line, statement.start - line_start + 1, f"Invalid UTF-8: {e}")
+            )
+            continue
+
+        problem = _parse_statement(text)
+        if problem is not None:
+            problem_line, column, message = problem
+            # Columns on the first line start from where the statement does
+            if problem_line == 1:
+                column += statement.start - line_start
+            problems.append(Problem(line + problem_line - 1, column, message))
+
+    return problems
+
+
+def _parse_statement(text: str) -> Optional[Problem]:
+    """Parses a statement returning its first error relative to it"""
+
+    try:
+        sqlglot.parse(text, read="postgres")
+    except sqlglot.errors.ParseError as e:
+        if not e.errors:
+            return Problem(1, 1, str(e))
+
+        error = e.errors[0]
+        return Problem(
+            error.get("line") or 1, error.get("col") or 1, error["description"]
+        )
+    except sqlglot.errors.TokenError as e:
+        return Problem(1, 1, str(e))
+
+    return None
+
+
+def check_python(content: bytes, name: str = "<migration>") -> List[Problem]:
+    """Finds the syntax error in a Python migration by compiling it
+
+    Compiling doesn't run any of it so nothing the migration imports or
+    does is needed.
+    """
+
+    try:
+        compile(content, name, "exec")
+    except SyntaxError as e:
+        return [Problem(e.lineno or 1, e.offset or 1, e.msg)]
+    except ValueError as e:
+        # Like source containing null bytes
+        return [Problem(1, 1, str(e))]
+
+    return []
+
+
+def check_file(path: Path) -> List[Problem]:
+    """Finds the syntax errors in a migration file"""
+
+    with open_decompressed(path) as f:
+        content = f.read()
+
+    if is_python_migration(path.name):
+        return check_python(content, path.name)
+
+    return check_content(content)
+
+
+def _init_worker() -> None:
+    # sqlglot warns about every statement it can't fully parse
+    logging.getLogger("sqlglot").setLevel(logging.ERROR)
+
+
+def check_files(
+    paths: Sequence[Path],
+    workers: Optional[int] = None,
+    cache: Optional[MigrationCache] = None,
+) -> Dict[str, List[Problem]]:
+    """Finds the syntax errors in many migration files keyed by file name
+
+    Parsing is CPU bound so files are spread across a pool of worker
+    processes. Results are cached by content so only new or changed files
+    are parsed on later runs.
+    """
+
+    _init_worker()
+
+    keys = {}
+    if cache is not None:
+        for name, checksum in checksum_files(paths, workers).items():
+            keys[name] = (
+                f"check-{CHECK_VERSION}-{PARSER_VERSION}-{sqlglot.__version__}-"
+                f"{'py-' if is_python_migration(name) else ''}{checksum}"
+            )
+
+    results: Dict[str, List[Problem]] = {}
+    misses = []
+
+    for path in paths:
+        entry = cache.get_entry(keys[path.name]) if cache is not None else None
+        if entry is None:
+            misses.append(path)
+            continue
+
+        try:
+            results[path.name] = [Problem(*problem) for problem in entry]
+        except TypeError:
+            misses.append(path)
+
+    workers = workers or os.cpu_count() or 1
+
+    if len(misses) < SERIAL_THRESHOLD or workers == 1:
+        checked = [check_file(path) for path in misses]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            # Large chunks cut down on the overhead of sending work to
+            # workers while leaving enough to balance the load
+            checked = list(
+                pool.map(
+                    check_file, misses, chunksize=max(1, len(misses) // (workers * 4))
+                )
+            )
+
+    for path, problems in zip(misses, checked):
+        results[path.name] = problems
+        if cache is not None:
+            cache.put_entry(keys[path.name], problems, evict=False)
+
+    if cache is not None and misses:
+        cache.evict()
+
+    return {path.name: results[path.name] for path in paths}
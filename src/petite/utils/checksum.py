@@ -0,0 +1,85 @@
+"""Functions for hashing migration content"""
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .compression import open_decompressed
+
+# Large enough that hashlib releases the GIL while hashing each chunk
+CHUNK_SIZE = 1024 * 1024
+
+
+def checksum(content: bytes) -> str:
+    """Returns the checksum of migration content"""
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def checksum_file(path: Path) -> str:
+    """Returns the checksum of a file reading it in chunks
+
+    Compressed files are hashed decompressed so recompressing a migration
+    doesn't change its checksum.
+    """
+
+    digest = hashlib.sha256()
+
+    with open_decompressed(path) as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def checksum_files(
+    paths: Iterable[Path], workers: Optional[int] = None
+) -> Dict[str, str]:
+    """Returns the checksum of each file keyed by file name
+
+    Files are hashed concurrently in a thread pool since hashing and file
+    reads both release the GIL.
+    """
+
+    paths = list(paths)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        checksums = executor.map(checksum_file, paths)
+
+        return {path.name: value for path, value in zip(paths, checksums)}
+
+
+class Drift(NamedTuple):
+    """Differences between the migrations directory and applied migrations"""
+
+    # Applied migrations whose file changed since being applied
+    modified: List[str]
+    # Applied migrations whose file is no longer in the directory
+    missing: List[str]
+    # Files in the directory that have not been applied
+    unknown: List[str]
+    # Applied migrations recorded before checksums so they can't be checked
+    unchecked: List[str]
+
+
+def find_drift(
+    file_checksums: Dict[str, str], applied_checksums: Dict[str, Optional[str]]
+) -> Drift:
+    """Compares migration file checksums against applied migration checksums"""
+
+    modified = []
+    missing = []
+    unchecked = []
+
+    for name, applied_checksum in sorted(applied_checksums.items()):
+        if name not in file_checksums:
+            missing.append(name)
+        elif applied_checksum is None:
+            unchecked.append(name)
+        elif applied_checksum != file_checksums[name]:
+            modified.append(name)
+
+    unknown = sorted(name for name in file_checksums if name not in applied_checksums)
+
+    return Drift(modified, missing, unknown, unchecked)
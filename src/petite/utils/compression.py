@@ -0,0 +1,69 @@
+"""Reading migrations and COPY data files compressed with gzip or zstd
+
+Compressed files are decompressed as they are read so they never need to
+be held in memory. Migrations are decompressed once into a temporary file
+so they can be memory mapped, while COPY data files are streamed. gzip is
+always available while zstd needs Python 3.14 or the zstandard package.
+"""
+
+import gzip
+from pathlib import Path
+from typing import BinaryIO
+
+GZIP_SUFFIX = ".gz"
+ZSTD_SUFFIX = ".zst"
+COMPRESSED_SUFFIXES = (GZIP_SUFFIX, ZSTD_SUFFIX)
+
+
+def is_compressed(name: str) -> bool:
+    return name.endswith(COMPRESSED_SUFFIXES)
+
+
+def zstd_available() -> bool:
+    """Whether files compressed with zstd can be read"""
+
+    try:
+        _zstd_module()
+    except ImportError:
+        return False
+
+    return True
+
+
+def _zstd_module():
+    try:
+        # Part of the standard library from Python 3.14
+        from compression import zstd  # type: ignore
+
+        return zstd
+    except ImportError:
+        import zstandard  # type: ignore
+
+        return zstandard
+
+
+def open_decompressed(path: Path) -> BinaryIO:
+    """Opens a file for reading its content decompressed if it is compressed
+
+    Raises ImportError for files compressed with zstd if neither module that
+    reads them is installed.
+    """
+
+    if path.name.endswith(GZIP_SUFFIX):
+        return gzip.open(path, "rb")  # type: ignore
+
+    if path.name.endswith(ZSTD_SUFFIX):
+        try:
+            zstd = _zstd_module()
+        except ImportError:
+            raise ImportError(
+                f"Reading {path.name} needs zstd support. "
+                "Install the zstandard package or use Python 3.14 or later"
+            ) from None
+
+        if zstd.__name__ == "zstandard":
+            return zstd.ZstdDecompressor().stream_reader(open(path, "rb"))
+
+        return zstd.open(path, "rb")
+
+    return open(path, "rb")
@@ -12,9 +12,12 @@ NO_TRANSACTION_MESSAGE = (
 )
 
 
-def confirm_no_transaction(value: bool):
-    """Callback to confirm no-transaction option on apply command"""
-    if value:
+def confirm_no_transaction(ctx: typer.Context, value: bool):
+    """Callback to confirm no-transaction option on apply command
+
+    Skipped when --yes was given which is processed first as it's eager.
+    """
+    if value and not ctx.params.get("yes"):
         print(NO_TRANSACTION_MESSAGE)
 
         continue_prompt = typer.confirm("Are you sure you want to continue?")
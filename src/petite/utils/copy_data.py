@@ -0,0 +1,67 @@
+"""Functions for streaming COPY data into the database"""
+
+import re
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from .compression import open_decompressed
+from .file_system import Buffer, release_pages
+
+CHUNK_SIZE = 1024 * 1024
+
+# COPY from a relative file path, which petite reads from next to the
+# migration file instead of leaving the server to look for it
+_SIDECAR_COPY = re.compile(
+    rb"(?P<head>COPY\b.*?\bFROM\s+)'(?P<path>[^'/][^']*)'(?P<tail>.*)",
+    re.I | re.S,
+)
+
+
+def sidecar_copy(
+    statement: bytes, migration_directory: Optional[Path]
+) -> Optional[Tuple[bytes, Path]]:
+    """Finds the sidecar data file a COPY statement reads from
+
+    Returns the statement rewritten to copy from stdin along with the path
+    of the data file, or None if the statement doesn't copy from a relative
+    path. Relative paths are resolved against the migration's directory.
+    """
+
+    match = _SIDECAR_COPY.match(statement)
+    if match is None:
+        return None
+
+    if migration_directory is None:
+        raise ValueError(
+            "COPY from a data file is only supported in migration files on disk"
+        )
+
+    path = migration_directory / match.group("path").decode("utf-8")
+    if not path.is_file():
+        raise FileNotFoundError(f"COPY data file {path} not found")
+
+    return (
+        match.group("head") + b"STDIN" + match.group("tail"),
+        path,
+    )
+
+
+def iter_content_chunks(content: Buffer, start: int, end: int) -> Iterator[bytes]:
+    """Yields inline COPY data from migration content in chunks"""
+
+    for chunk_start in range(start, end, CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHUNK_SIZE, end)
+        yield content[chunk_start:chunk_end]
+
+        release_pages(content, chunk_end)
+
+
+def iter_file_chunks(path: Path) -> Iterator[bytes]:
+    """Yields the contents of a sidecar data file in chunks
+
+    Files compressed with gzip or zstd are decompressed as they are read.
+    """
+
+    with open_decompressed(path) as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
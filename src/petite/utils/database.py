@@ -1,146 +1,375 @@
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Tuple
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import psycopg
-import sqlglot
-import typer
 from rich import print
 
+from .cache import MigrationCache
+from .errors import (
+    BackfillError,
+    InvalidMigration,
+    MigrationError,
+    MigrationTableNotFound,
+    MigrationTableOutdated,
+    PetiteError,
+)
+from .events import EventLog
+from .exits import fail
+from .file_system import MigrationContent, is_python_migration, open_content
+from .migrator import CopyResult, Migrator, Progress
+from .queries import SCHEMA_VERSION
+from .timeouts import RetryPolicy, Timeouts
+
+TABLE_NOT_FOUND = "[bold red]Migration table not found![/]\nRun the [b]setup[/] command to setup migrations table.\n"
+
 
 class Database:
-    """Class to handle database operations for migrations"""
+    """Class to handle database operations for migrations
 
-    def __init__(self, uri: str) -> None:
+    Migrations are applied by a Migrator with every step printed. Problems
+    are printed before exiting the command.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        cache: Optional[MigrationCache] = None,
+        events: Optional[EventLog] = None,
+    ) -> None:
         try:
             self.conn = psycopg.connect(uri)
             print("[bold green]Connected[/] to the database successfully!\n")
         except Exception as e:
-            print(
+            fail(
                 f"[bold red]Could not connect to the database![/]\nMake sure the database is running and URI is correct.\n\n[b]Error[/]: {e}\n"
             )
-            raise typer.Exit(code=1)
+
+        self.migrator = Migrator(self.conn, cache, events, _PrintedProgress())
+
+    @property
+    def events(self) -> EventLog:
+        return self.migrator.events
 
     def create_migration_table(self) -> None:
-        """Creates a migration table in the db if it doesn't exist"""
-
-        table = """
-        CREATE TABLE IF NOT EXISTS migration (
-            id SERIAL PRIMARY KEY,
-            file_name VARCHAR(255) UNIQUE NOT NULL,
-            run_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-        );
+        """Creates the migration tables or upgrades ones made by older versions"""
+
+        with self.__failing():
+            version = self.migrator.upgrade_schema(create=True)
+
+        if version == 0:
+            print("[bold green]Created[/] migration table in the database.\n")
+        elif version < SCHEMA_VERSION:
+            print(
+                f"[bold green]Upgraded[/] migration table from version {version} to {SCHEMA_VERSION}.\n"
+            )
+        else:
+            print("Migration table is up to date.\n")
+
+    def get_last_applied_migration(
+        self, quiet: bool = False
+    ) -> Optional[Tuple[int, str, datetime]]:
+        """Gets the last migration that was applied returning whole row
+
+        Tables made by older versions are upgraded first.
         """
 
-        with self.conn.cursor() as cur:
-            cur.execute(table)
+        with self.__failing():
+            value = self.migrator.get_last_applied_migration()
 
-        self.conn.commit()
+        if value is not None and not quiet:
+            print(f"Found last applied migration [b]{value[1]}[/].\n")
+
+        return value  # type: ignore
+
+    def get_applied_migrations(self, quiet: bool = False) -> List[str]:
+        """Gets the name of every applied migration sorted like the directory
+
+        Tables made by older versions are upgraded first.
+        """
+
+        with self.__failing():
+            applied = self.migrator.get_applied_migrations()
+
+        if applied and not quiet:
+            print(f"Found last applied migration [b]{applied[-1]}[/].\n")
 
-        print("[bold green]Created[/] migration table in the database.\n")
+        return applied
 
-    def get_last_applied_migration(self) -> Optional[Tuple[int, str, datetime]]:
-        """Gets the last migration that was applied returning whole row"""
+    @contextmanager
+    def migration_lock(self) -> Iterator[None]:
+        """Holds the advisory lock that makes concurrent applies take turns
+
+        Runs that find the lock taken say so then wait for it. Whatever was
+        applied while waiting has to be checked for after the lock is
+        acquired.
+        """
+
+        self.migrator.lock()
+        try:
+            yield
+        finally:
+            self.migrator.unlock()
+
+    def get_applied_checksums(self) -> Dict[str, Optional[str]]:
+        """Gets the checksum of every applied migration keyed by file name
+
+        Migrations applied before checksums were recorded have a checksum of
+        None.
+        """
+
+        return dict(self.__fetch_all("SELECT file_name, checksum FROM migration"))
+
+    def get_migration_history(
+        self, limit: int
+    ) -> List[Tuple[str, datetime, Optional[float], Optional[int], Optional[int]]]:
+        """Gets the slowest applied migrations
+
+        Rows hold the file name, when it was run, duration in milliseconds,
+        statement count and bytes. Migrations applied before timings were
+        recorded come last.
+        """
+
+        return self.__fetch_all(
+            """
+            SELECT file_name, run_on, duration_ms, statement_count, bytes
+            FROM migration
+            ORDER BY duration_ms DESC NULLS LAST, file_name
+            LIMIT %s
+            """,
+            (limit,),
+        )
+
+    def get_statement_history(
+        self, limit: int
+    ) -> List[Tuple[str, int, str, float, int]]:
+        """Gets the slowest statements of migrations applied without a transaction
+
+        Rows hold the file name, statement index, statement kind, duration in
+        milliseconds and bytes.
+        """
+
+        return self.__fetch_all(
+            """
+            SELECT file_name, statement_index, kind, duration_ms, bytes
+            FROM migration_statement
+            ORDER BY duration_ms DESC
+            LIMIT %s
+            """,
+            (limit,),
+        )
+
+    def __fetch_all(self, query: str, params: Optional[Tuple] = None) -> List[Tuple]:
+        """Runs a query against the migration tables returning all rows"""
 
         with self.conn.cursor() as cur:
             try:
-                cur.execute(
-                    "SELECT * FROM migration ORDER BY file_name DESC, run_on DESC, id DESC LIMIT 1"
-                )
+                cur.execute(query, params)
             except psycopg.errors.UndefinedTable:
-                print(
-                    f"[bold red]Migration table not found![/]\nRun the [b]setup[/] command to setup migrations table.\n"
+                fail(TABLE_NOT_FOUND)
+            except psycopg.errors.UndefinedColumn:
+                fail(
+                    f"[bold red]Migration table is out of date![/]\nRun the [b]setup[/] command to upgrade the migrations table.\n"
                 )
-                raise typer.Exit(code=1)
 
-            value = cur.fetchone()
+            return cur.fetchall()
 
-        if value is not None:
-            print(f"Found last applied migration [b]{value[1]}[/].\n")
+    def get_migration_durations(self, file_names: List[str]) -> Dict[str, float]:
+        """Gets the duration in milliseconds of the given applied migrations"""
 
-        return value
+        return self.migrator.get_migration_durations(file_names)
+
+    def set_timeouts(self, timeouts: Timeouts) -> None:
+        """Sets the timeouts used for the rest of the session"""
+
+        try:
+            self.migrator.set_timeouts(timeouts)
+        except PetiteError as e:
+            fail(f"[bold red]Invalid timeout![/]\n\n[b]Error[/]: {e.__cause__}\n")
+
+    def record_baseline(self, name: str, content: MigrationContent) -> None:
+        """Records a baseline as applied without running it
+
+        Used for databases that already applied every migration the baseline
+        replaces.
+        """
+
+        self.migrator.record_baseline(name, content)
+
+        print(
+            f"[bold green]Recorded[/] baseline [b]{name}[/] as applied since the migrations it replaces already are.\n"
+        )
 
     def apply_migrations(
-        self, migrations: List[Tuple[str, bytes]], no_transaction: bool = False
+        self,
+        migrations: Sequence[Tuple[str, MigrationContent]],
+        no_transaction: bool = False,
+        retry: RetryPolicy = RetryPolicy(),
     ) -> None:
-        """Applies a single migration file to the database"""
+        """Applies migration files to the database in order
+
+        Migrations are grouped into batches by the planner. Consecutive
+        migrations that can run in a transaction share one, while ones that
+        can't, either by directive or because they contain statements like
+        CREATE INDEX CONCURRENTLY, run in autocommit mode. With
+        no_transaction every migration runs in autocommit mode.
+        """
 
         print(
             f"Attempting to apply {len(migrations)} migration{'s' if len(migrations) > 1 else ''}.\n"
         )
 
-        no_transaction_fail_index = -1
-        if no_transaction:
-            # Need to commit any open transaction before setting autocommit
-            self.conn.commit()
-            self.conn.autocommit = no_transaction
-
-        with self.conn.cursor() as cur:
-            for migration_name, migration_content in migrations:
-                try:
-                    cur.execute(
-                        "INSERT INTO migration (file_name) VALUES (%s)",
-                        (migration_name,),
-                    )
-
-                    if not no_transaction:
-                        cur.execute(migration_content)
-                    else:
-                        # Run each statement in the migration file separately so no
-                        # transaction is opened by psycopg because if multiple
-                        # statements are run in one execute call psycopg will open a
-                        # transaction even if autocommit is True
-                        for index, statement in enumerate(
-                            self.__split_migration(migration_content)
-                        ):
-                            # Track the current statement so we know what was not
-                            # applied for error message later
-                            no_transaction_fail_index = index
-                            cur.execute(statement)
-
-                    print(f"[bold green]Applied[/] migration [b]{migration_name}[/].")
-
-                except Exception as e:
-                    print(
-                        f"[bold red]Error[/] applying migration: [b]{migration_name}[/]!\n\n"
-                        + f"[bold red]Error[/]: {e}\n"
-                        + (
-                            "Rolling back migrations applied so far."
-                            if not no_transaction
-                            else (
-                                "[bold red]Danger:[/] Statements before the error in the "
-                                f"migration file [b]{migration_name}[/] have already been applied. "
-                                "The statements not applied include:\n\n"
-                                + "\n".join(
-                                    [
-                                        stmt.decode("utf-8") + ";"
-                                        for stmt in self.__split_migration(
-                                            migration_content
-                                        )[no_transaction_fail_index:]
-                                    ]
-                                )
-                                + "\n\nIt is recommended you personally check which statements succeeded "
-                                "and remove any that did not from the migration file. "
-                                "Unapplied statements should be moved to a new migration file."
-                            )
-                        )
-                    )
-                    raise typer.Exit(code=1)
-
-        self.conn.commit()
+        try:
+            self.migrator.apply_migrations(migrations, no_transaction, retry)
+        except InvalidMigration as e:
+            fail(f"[bold red]Error[/] {e}!\n")
+        except MigrationError as e:
+            fail(self.__error_message(e, dict(migrations)[e.migration]))
 
         print(
             f"\n[bold green]Successfully applied[/] {len(migrations)} migration{'s' if len(migrations) > 1 else ''}.\n"
         )
 
-    def __split_migration(self, migration_content: bytes) -> List[bytes]:
-        """Splits a migrations content into individual SQL statements"""
+    def __error_message(self, error: MigrationError, content: MigrationContent) -> str:
+        """Explains a failed migration and what was left applied"""
+
+        if isinstance(error, BackfillError):
+            return (
+                f"[bold red]Error[/] applying backfill migration: [b]{error.migration}[/]!\n\n"
+                + f"[bold red]Error[/]: {error.message}\n"
+                + (
+                    f"Chunks up to key {error.last_key} are committed and the backfill carries on after it when applied again."
+                    if error.last_key is not None
+                    else "No chunks were committed."
+                )
+            )
+
+        if is_python_migration(error.migration):
+            return (
+                f"[bold red]Error[/] applying Python migration: [b]{error.migration}[/]!\n\n"
+                + f"[bold red]Error[/]: {error.message}\n"
+                + "Rolling back the migration."
+            )
+
+        message = (
+            f"[bold red]Error[/] applying migration: [b]{error.migration}[/]!\n\n"
+            + f"[bold red]Error[/]: {error.message}\n"
+        )
+
+        if error.statement_index is not None:
+            message += (
+                f"The error is in statement {error.statement_index + 1} on line "
+                f"{self.__statement_line(content, error.statement_index)} "
+                f"of [b]{error.migration}[/].\n"
+            )
+        elif isinstance(error.__cause__, psycopg.errors.UndefinedColumn):
+            message += "The migration table is out of date, run the [b]setup[/] command to upgrade it.\n"
+
+        if error.rolled_back:
+            return message + (
+                "Rolling back migrations applied in this transaction. "
+                "Migrations applied before it have been committed."
+                if error.applied
+                else "Rolling back migrations applied so far."
+            )
+
+        return message + (
+            "[bold red]Danger:[/] Statements before the error in the "
+            f"migration file [b]{error.migration}[/] have already been applied. "
+            "The statements not applied include:\n\n"
+            + "\n".join(
+                stmt.decode("utf-8") + ";"
+                for stmt in self.__remaining_statements(
+                    content, error.statement_index or 0
+                )
+            )
+            + "\n\nIt is recommended you personally check which statements succeeded "
+            "and remove any that did not from the migration file. "
+            "Unapplied statements should be moved to a new migration file."
+        )
+
+    def __statement_line(self, migration_content: MigrationContent, index: int) -> int:
+        """Gets the line of a migration a statement starts on"""
+
+        with open_content(migration_content) as content:
+            statement = next(
+                islice(self.migrator.iter_statements(content), index, None)
+            )
+            return content[: statement.start].count(b"\n") + 1
+
+    def __remaining_statements(
+        self, migration_content: MigrationContent, start: int
+    ) -> List[bytes]:
+        """Gets the statements of a migration from the start index onwards"""
+
+        with open_content(migration_content) as content:
+            return [
+                content[statement.start : statement.end]
+                for statement in islice(
+                    self.migrator.iter_statements(content), start, None
+                )
+            ]
+
+    @contextmanager
+    def __failing(self) -> Iterator[None]:
+        """Exits explaining problems with the migration tables"""
+
+        try:
+            yield
+        except MigrationTableNotFound:
+            fail(TABLE_NOT_FOUND)
+        except MigrationTableOutdated as e:
+            fail(
+                f"[bold red]Migration table is from a newer version of petite![/]\n{e}.\n"
+            )
+
+
+class _PrintedProgress(Progress):
+    """Prints each step of applying migrations"""
+
+    def upgraded_schema(self, version: int) -> None:
+        print(
+            f"[bold green]Upgraded[/] migration table from version {version} to {SCHEMA_VERSION}.\n"
+        )
+
+    def waiting_for_lock(self) -> None:
+        print(
+            "[bold yellow]Waiting[/] for another run to finish applying migrations.\n"
+        )
+
+    def applied(self, name: str) -> None:
+        print(f"[bold green]Applied[/] migration [b]{name}[/].")
+
+    def copied(self, name: str, rows: CopyResult) -> None:
+        print(
+            f"[bold green]Copied[/] {rows.count} rows in {rows.seconds:.2f}s "
+            f"({rows.count / max(rows.seconds, 1e-9):,.0f} rows/s)."
+        )
+
+    def retrying(self, name: str, attempt: int, retries: int, delay: float) -> None:
+        print(
+            f"[bold yellow]Lock timeout[/] applying migration [b]{name}[/] "
+            f"(attempt {attempt + 1} of {retries + 1}), retrying in {delay:.2f}s."
+        )
 
-        parsed_migration = sqlglot.parse(
-            migration_content.decode("utf-8"), read="postgres"
+    def resuming_backfill(
+        self, name: str, last_key: str, rows: int, chunks: int
+    ) -> None:
+        print(
+            f"[bold yellow]Resuming[/] backfill [b]{name}[/] after key {last_key} "
+            f"with {rows} rows updated in {chunks} chunks.\n"
         )
 
-        return [
-            statement.sql(dialect="postgres").encode("utf-8")
-            for statement in parsed_migration
-            if statement
-        ]
+    def backfill_progress(
+        self, name: str, rows: int, chunks: int, last_key: str, rate: float
+    ) -> None:
+        print(
+            f"Backfilled {rows} rows in {chunks} chunks of [b]{name}[/] "
+            f"up to key {last_key} ({rate:,.0f} rows/s)."
+        )
+
+    def backfilled(self, name: str, rows: int, chunks: int) -> None:
+        print(
+            f"[bold green]Backfilled[/] {rows} rows in {chunks} chunks of [b]{name}[/]."
+        )
@@ -0,0 +1,87 @@
+"""Execution directives given in the header of migration files"""
+
+import re
+from typing import NamedTuple, Optional
+
+from .backfill import Backfill, parse_backfill
+from .file_system import Buffer
+from .timeouts import Timeouts
+
+# Directives are only looked for in this many bytes at the start of a file
+HEADER_SIZE = 4096
+
+# Comment lines like `-- petite: transaction=off lock_timeout=5s`
+_DIRECTIVE = re.compile(rb"--\s*petite:(?P<settings>.*)", re.I)
+_SETTING = re.compile(r"(?P<key>[A-Za-z_]+)\s*=\s*(?P<value>[^\s,]+)")
+
+_BOOLEANS = {
+    "on": True,
+    "true": True,
+    "yes": True,
+    "off": False,
+    "false": False,
+    "no": False,
+}
+
+
+class Directives(NamedTuple):
+    """Settings a migration file asks to be applied with"""
+
+    # None leaves it to petite to detect if a transaction can be used
+    transaction: Optional[bool] = None
+    timeouts: Timeouts = Timeouts()
+    # Last migration a baseline made by squash covers
+    baseline: Optional[str] = None
+    # How to walk the table of a backfill migration
+    backfill: Optional[Backfill] = None
+
+
+def parse_directives(content: Buffer) -> Directives:
+    """Reads the directives in the leading comments of a migration
+
+    Only comment and blank lines before the first statement are looked at.
+    Raises ValueError for unknown or malformed directives.
+    """
+
+    settings = {}
+
+    for line in content[:HEADER_SIZE].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith(b"--"):
+            break
+
+        directive = _DIRECTIVE.match(line)
+        if directive is None:
+            continue
+
+        text = directive.group("settings").decode("utf-8").strip()
+        matches = list(_SETTING.finditer(text))
+        if not matches or _SETTING.sub("", text).strip(" ,\t"):
+            raise ValueError(f"Malformed directive: {text!r}")
+
+        for match in matches:
+            settings[match.group("key").lower()] = match.group("value")
+
+    transaction = None
+    if "transaction" in settings:
+        value = settings.pop("transaction")
+        if value.lower() not in _BOOLEANS:
+            raise ValueError(f"Invalid value for transaction: {value!r}")
+        transaction = _BOOLEANS[value.lower()]
+
+    timeouts = Timeouts(
+        settings.pop("lock_timeout", None), settings.pop("statement_timeout", None)
+    )
+
+    baseline = settings.pop("baseline", None)
+
+    backfill = parse_backfill(settings)
+    if backfill is not None and transaction:
+        raise ValueError("A backfill commits each chunk so can't use a transaction")
+
+    if settings:
+        raise ValueError(f"Unknown directive: {', '.join(settings)}")
+
+    return Directives(transaction, timeouts, baseline, backfill)
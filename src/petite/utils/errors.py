@@ -0,0 +1,72 @@
+"""Exceptions raised by petite when used as a library"""
+
+from typing import List, Optional
+
+
+class PetiteError(Exception):
+    """Base class of every error petite raises"""
+
+
+class DatabaseConnectionError(PetiteError):
+    """Could not connect to the database"""
+
+
+class DatabaseError(PetiteError):
+    """A query failed, like by being cancelled or not having permission"""
+
+
+class MigrationDirectoryNotFound(PetiteError):
+    """The migrations directory doesn't exist"""
+
+
+class MigrationTableNotFound(PetiteError):
+    """The migration table doesn't exist yet"""
+
+
+class MigrationTableOutdated(PetiteError):
+    """The migration table's schema doesn't match this version of petite"""
+
+
+class InvalidMigration(PetiteError):
+    """A migration file can't be applied as written, like a bad directive"""
+
+
+class MigrationError(PetiteError):
+    """A migration failed to apply
+
+    The error from the database is the exception's cause. applied lists
+    the migrations that stayed applied, which without a transaction can
+    include statements of the failed migration before statement_index.
+    """
+
+    def __init__(
+        self,
+        migration: str,
+        statement_index: Optional[int],
+        applied: List[str],
+        rolled_back: bool,
+        message: str,
+    ) -> None:
+        super().__init__(f"Error applying migration {migration}: {message}")
+        self.migration = migration
+        # The error from the database, or from a Python migration
+        self.message = message
+        # None when the error was in recording the migration
+        self.statement_index = statement_index
+        self.applied = applied
+        # If the failed migration's transaction was rolled back
+        self.rolled_back = rolled_back
+
+
+class BackfillError(MigrationError):
+    """A backfill migration failed part way through
+
+    Chunks up to last_key stay committed and the backfill carries on after
+    it when applied again. last_key is None if no chunk was committed.
+    """
+
+    def __init__(
+        self, migration: str, applied: List[str], last_key: Optional[str], message: str
+    ) -> None:
+        super().__init__(migration, None, applied, True, message)
+        self.last_key = last_key
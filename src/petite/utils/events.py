@@ -0,0 +1,378 @@
+"""Machine readable events of a run and exports of them
+
+Events are dicts whose event field names their kind. Ones that took time
+have start, a Unix timestamp in seconds, and duration_ms. They can be
+written as JSON lines for log pipelines, as Prometheus metrics for
+node_exporter's textfile collector or as OpenTelemetry spans in the OTLP
+JSON file format.
+"""
+
+import json
+import os
+import secrets
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TextIO
+
+import rich
+import typer
+from rich.errors import MarkupError
+from rich.markup import render
+
+from .exits import CommandFailed
+
+Event = Dict[str, Any]
+
+# Kinds of events with their own spans and metrics
+PHASE = "phase"
+BATCH = "batch"
+MIGRATION = "migration"
+STATEMENT = "statement"
+RETRY = "retry"
+RUN = "run"
+
+
+class JsonLinesSink:
+    """Writes each event as a line of JSON as soon as it happens"""
+
+    def __init__(self, file: TextIO) -> None:
+        self.file = file
+
+    def write(self, event: Event) -> None:
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        pass
+
+
+class PrometheusSink:
+    """Writes gauges describing the run for node_exporter's textfile collector
+
+    The file is replaced when the run ends so the collector never reads a
+    partly written one. Scraping it after every run tracks how long
+    migrations take over time.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.events: List[Event] = []
+
+    def write(self, event: Event) -> None:
+        # Statements are left out to keep the number of series bounded
+        if event["event"] in (PHASE, MIGRATION, RUN):
+            self.events.append(event)
+
+    def close(self) -> None:
+        run = next((event for event in self.events if event["event"] == RUN), None)
+        if run is None:
+            return
+
+        command = run["command"]
+        metrics: Dict[str, List[str]] = {}
+
+        def add(name: str, help: str, value: float, **labels: str) -> None:
+            lines = metrics.setdefault(
+                name, [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            )
+            label_text = ",".join(
+                f'{key}="{_escape_label(label)}"' for key, label in labels.items()
+            )
+            lines.append(
+                f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}"
+            )
+
+        add(
+            f"petite_{command}_success",
+            "Whether the last run succeeded.",
+            int(run["status"] == "succeeded"),
+        )
+        add(
+            f"petite_{command}_last_run_timestamp_seconds",
+            "When the last run finished.",
+            run["start"] + run["duration_ms"] / 1000,
+        )
+        add(
+            f"petite_{command}_duration_seconds",
+            "How long the last run took.",
+            run["duration_ms"] / 1000,
+        )
+
+        migrations = [
+            event
+            for event in self.events
+            if event["event"] == MIGRATION and event["status"] == "applied"
+        ]
+        add(
+            f"petite_{command}_migrations_applied",
+            "Migrations applied by the last run.",
+            len(migrations),
+        )
+        add(
+            f"petite_{command}_bytes_applied",
+            "Bytes of migrations applied by the last run.",
+            sum(event["bytes"] for event in migrations),
+        )
+
+        for event in self.events:
+            if event["event"] == PHASE:
+                add(
+                    f"petite_{command}_phase_duration_seconds",
+                    "How long each phase of the last run took.",
+                    event["duration_ms"] / 1000,
+                    phase=event["phase"],
+                )
+
+        for event in migrations:
+            if event["duration_ms"] is not None:
+                add(
+                    "petite_migration_duration_seconds",
+                    "How long each migration applied by the last run took.",
+                    event["duration_ms"] / 1000,
+                    migration=event["name"],
+                )
+            add(
+                "petite_migration_bytes",
+                "Size of each migration applied by the last run.",
+                event["bytes"],
+                migration=event["name"],
+            )
+
+        temporary = self.path.with_name(f".{self.path.name}.tmp")
+        temporary.write_text(
+            "".join(line + "\n" for lines in metrics.values() for line in lines)
+        )
+        os.replace(temporary, self.path)
+
+
+class SpanSink:
+    """Appends the run as OpenTelemetry spans to a file
+
+    Each run is one line in the OTLP JSON format, the same as the
+    collector's file exporter writes, so it can be read back with its
+    otlpjsonfile receiver. The run is the root span with phases, batches
+    and migrations under it and statements under their migration.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.events: List[Event] = []
+
+    def write(self, event: Event) -> None:
+        if event.get("duration_ms") is not None:
+            self.events.append(event)
+
+    def close(self) -> None:
+        run = next((event for event in self.events if event["event"] == RUN), None)
+        if run is None:
+            return
+
+        trace_id = secrets.token_hex(16)
+        root_id = secrets.token_hex(8)
+        migration_ids = {
+            event["name"]: secrets.token_hex(8)
+            for event in self.events
+            if event["event"] == MIGRATION
+        }
+
+        spans = []
+        for event in self.events:
+            kind = event["event"]
+            if kind == RUN:
+                span_id, parent_id, name = root_id, "", f"petite {event['command']}"
+            elif kind == MIGRATION:
+                span_id, parent_id = migration_ids[event["name"]], root_id
+                name = f"migration {event['name']}"
+            elif kind == STATEMENT:
+                span_id = secrets.token_hex(8)
+                parent_id = migration_ids.get(event["migration"], root_id)
+                name = event["kind"]
+            else:
+                span_id, parent_id = secrets.token_hex(8), root_id
+                name = event.get("phase", kind)
+
+            start = int(event["start"] * 1e9)
+            failed = event.get("status") == "failed"
+            spans.append(
+                {
+                    "traceId": trace_id,
+                    "spanId": span_id,
+                    "parentSpanId": parent_id,
+                    "name": name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(start),
+                    "endTimeUnixNano": str(start + int(event["duration_ms"] * 1e6)),
+                    "attributes": _attributes(event),
+                    "status": (
+                        {"code": 2, "message": event.get("error") or ""}
+                        if failed
+                        else {"code": 1}
+                    ),
+                }
+            )
+
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _attributes({"service.name": "petite"})},
+                    "scopeSpans": [{"scope": {"name": "petite"}, "spans": spans}],
+                }
+            ]
+        }
+
+        with open(self.path, "a") as file:
+            file.write(json.dumps(request) + "\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _plain(obj: Any) -> str:
+    """Gets the text of a printed message without its markup"""
+
+    if not isinstance(obj, str):
+        return str(obj)
+
+    try:
+        return render(obj).plain.strip()
+    except MarkupError:
+        return obj.strip()
+
+
+def _attributes(event: Event) -> List[Dict[str, Any]]:
+    """Converts the fields of an event to OTLP JSON attributes"""
+
+    attributes = []
+    for key, value in event.items():
+        if key in ("event", "start", "duration_ms") or value is None:
+            continue
+
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            # 64 bit integers are strings in OTLP JSON
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+
+        attributes.append(
+            {"key": f"petite.{key}" if "." not in key else key, "value": typed}
+        )
+
+    return attributes
+
+
+class EventLog:
+    """Sends the events of a run to sinks
+
+    With no sinks every method returns straight away so recording costs
+    nothing when nothing is exported.
+    """
+
+    def __init__(self, sinks: Sequence[Any] = ()) -> None:
+        self.sinks = list(sinks)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    def emit(self, event: str, **fields: Any) -> None:
+        if not self.sinks:
+            return
+
+        record = {"event": event, **fields}
+        for sink in self.sinks:
+            sink.write(record)
+
+    @contextmanager
+    def timed(self, event: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Emits an event with how long the block took if it succeeds
+
+        Fields added to the yielded dict are included in the event.
+        """
+
+        start = time.time()
+        started = time.perf_counter()
+
+        yield fields
+
+        self.emit(
+            event,
+            start=start,
+            duration_ms=(time.perf_counter() - started) * 1000,
+            **fields,
+        )
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def open_event_log(
+    json_output: bool, metrics_file: Optional[Path], trace_file: Optional[Path]
+) -> EventLog:
+    """Makes an event log writing to the outputs chosen on the command line"""
+
+    sinks: List[Any] = []
+    if json_output:
+        sinks.append(JsonLinesSink(sys.stdout))
+    if metrics_file is not None:
+        sinks.append(PrometheusSink(metrics_file))
+    if trace_file is not None:
+        sinks.append(SpanSink(trace_file))
+
+    return EventLog(sinks)
+
+
+@contextmanager
+def record_run(
+    events: EventLog, command: str, quiet: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """Emits a run event summarising a command once it ends then closes the log
+
+    Fields added to the yielded dict are included in the event. When quiet
+    the usual output isn't rendered, which takes measurable time on large
+    runs. Commands that fail with fail() hand it the message the run event
+    gives as the error.
+    """
+
+    console = rich.get_console()
+    was_quiet = console.quiet
+    if quiet:
+        console.quiet = True
+
+    summary: Dict[str, Any] = {}
+    status = "failed"
+    start = time.time()
+    started = time.perf_counter()
+
+    try:
+        yield summary
+        status = "succeeded"
+    except CommandFailed as e:
+        summary["error"] = _plain(e.message)
+        raise
+    except typer.Exit as e:
+        if not e.exit_code:
+            status = "succeeded"
+        raise
+    except Exception as e:
+        summary["error"] = str(e)
+        raise
+    finally:
+        console.quiet = was_quiet
+
+        events.emit(
+            RUN,
+            command=command,
+            status=status,
+            start=start,
+            duration_ms=(time.perf_counter() - started) * 1000,
+            **summary,
+        )
+        events.close()
@@ -0,0 +1,25 @@
+"""Ending a command because something went wrong"""
+
+from typing import NoReturn
+
+import typer
+from rich import print
+
+
+class CommandFailed(typer.Exit):
+    """Exits a command with code 1 keeping the message explaining why
+
+    Summaries of a run, like the run event, read the message from here
+    rather than from what was printed.
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(code=1)
+        self.message = message
+
+
+def fail(message: str) -> NoReturn:
+    """Prints why a command failed then exits it with code 1"""
+
+    print(message)
+    raise CommandFailed(message)
@@ -0,0 +1,212 @@
+"""Applies migrations to many databases at once"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import psycopg
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+# Directory containing the petite package
+_PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+
+# Anything else is a key/value connection string
+_URI_SCHEMES = ("postgresql://", "postgres://")
+_CONNINFO_PASSWORD = re.compile(r"password\s*=.*", re.S)
+
+
+class FanOutResult(NamedTuple):
+    """Outcome of applying migrations to one database"""
+
+    uri: str
+    # One of applied, failed or skipped
+    status: str
+    seconds: float
+    # Short description like how many migrations were applied or the error
+    detail: str
+
+
+def read_uris(path: Path) -> List[str]:
+    """Reads one URI per line skipping blank lines and # comments"""
+
+    uris = []
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            uris.append(line)
+
+    return uris
+
+
+def discover_uris(uri: str, query: str) -> List[str]:
+    """Runs a query returning a URI in the first column of each row"""
+
+    with psycopg.connect(uri) as conn:
+        return [row[0] for row in conn.execute(query.encode("utf-8")).fetchall()]
+
+
+def redact_uri(uri: str) -> str:
+    """Hides the passwords in a URI so it can be shown
+
+    Passwords can be in the user info or in a password query parameter, or
+    a password key of a key/value connection string like host=db
+    password=secret.
+    """
+
+    if not uri.startswith(_URI_SCHEMES):
+        return _redact_conninfo(uri)
+
+    parts = urlsplit(uri)
+
+    if parts.password is not None:
+        host = parts.hostname or ""
+        # IPv6 addresses lose their brackets when split
+        if ":" in host:
+            host = f"[{host}]"
+
+        netloc = f"{parts.username}:****@{host}"
+        if parts.port is not None:
+            netloc += f":{parts.port}"
+
+        parts = parts._replace(netloc=netloc)
+
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if any(key == "password" for key, _ in query):
+        parts = parts._replace(
+            query=urlencode(
+                [(key, "****" if key == "password" else value) for key, value in query],
+                safe="*",
+            )
+        )
+
+    return urlunsplit(parts)
+
+
+def _redact_conninfo(conninfo: str) -> str:
+    try:
+        params = conninfo_to_dict(conninfo)
+    except psycopg.ProgrammingError:
+        # Can't be parsed so anything after a password key is hidden
+        return _CONNINFO_PASSWORD.sub("password=****", conninfo)
+
+    if "password" not in params:
+        return conninfo
+
+    params["password"] = "****"
+    return make_conninfo(**params)
+
+
+def _run_event(output: str) -> Optional[Dict[str, Any]]:
+    """Finds the run event in the output of `petite apply --json`"""
+
+    for line in reversed(output.splitlines()):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # Like a traceback written to stderr
+            continue
+
+        if isinstance(event, dict) and event.get("event") == "run":
+            return event
+
+    return None
+
+
+def apply_to_databases(
+    uris: Sequence[str],
+    apply_args: Sequence[str],
+    workers: int,
+    fail_fast: bool = False,
+    log_directory: Optional[Path] = None,
+    on_result: Optional[Callable[[FanOutResult], None]] = None,
+) -> List[FanOutResult]:
+    """Runs `petite apply` against every database with a bounded pool
+
+    Each database gets its own apply process so their output and failures
+    stay separate. Its outcome is read from the run event of `apply --json`. The URI is passed through the environment rather than
+    the command line so passwords don't show up in process lists. With
+    fail_fast databases not yet started are skipped once one fails.
+
+    Results are returned in the order of the URIs given while on_result is
+    called as each finishes.
+    """
+
+    stop = threading.Event()
+    env = {
+        **os.environ,
+        # Makes sure workers run this copy of petite even if not installed
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(_PACKAGE_ROOT), os.environ.get("PYTHONPATH")])
+        ),
+    }
+
+    def apply(index: int, uri: str) -> FanOutResult:
+        if stop.is_set():
+            return FanOutResult(uri, "skipped", 0.0, "Skipped after a failure")
+
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-m", "petite", "apply", "--json", *apply_args],
+            env={**env, "POSTGRES_URI": uri},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        seconds = time.perf_counter() - start
+
+        if log_directory is not None:
+            log_directory.mkdir(parents=True, exist_ok=True)
+            (log_directory / f"{index:04}.log").write_text(
+                f"{redact_uri(uri)}\n{process.stdout}"
+            )
+
+        run = _run_event(process.stdout)
+
+        if process.returncode != 0:
+            if fail_fast:
+                stop.set()
+
+            error = run.get("error") if run is not None else None
+            return FanOutResult(
+                uri,
+                "failed",
+                seconds,
+                (
+                    " ".join(line for line in error.splitlines() if line)
+                    if error
+                    else f"Exited with code {process.returncode}"
+                ),
+            )
+
+        applied = run.get("applied") if run is not None else None
+        return FanOutResult(
+            uri,
+            "applied",
+            seconds,
+            f"{applied} applied" if applied else "Up to date",
+        )
+
+    results: List[Optional[FanOutResult]] = [None] * len(uris)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(apply, index, uri): index for index, uri in enumerate(uris)
+        }
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+
+            if on_result is not None:
+                on_result(result)
+
+    return [result for result in results if result is not None]
@@ -1,31 +1,272 @@
+import gzip
+import hashlib
+import mmap
 import os
+import re
+import tempfile
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, ContextManager, Dict, Iterator, List, Optional, Union
 
-import typer
 from rich import print
 
+from .checksum import CHUNK_SIZE, checksum, checksum_file, checksum_files
+from .compression import (
+    GZIP_SUFFIX,
+    ZSTD_SUFFIX,
+    is_compressed,
+    open_decompressed,
+    zstd_available,
+)
+from .exits import fail
+
+# Bytes of a migration in memory or memory mapped from disk
+Buffer = Union[bytes, mmap.mmap]
+
+# Directory inside the migrations directory squashed migrations are moved to.
+# Only files directly in the migrations directory are applied.
+ARCHIVE_DIRECTORY = "archive"
+
+# Python migrations define a migrate function instead of holding SQL
+PYTHON_SUFFIX = ".py"
+MIGRATION_SUFFIXES = (
+    ".sql",
+    ".sql" + GZIP_SUFFIX,
+    ".sql" + ZSTD_SUFFIX,
+    PYTHON_SUFFIX,
+)
+# Python migrations need the numbered prefix create gives them so modules
+# like __init__.py, conftest.py or shared helpers aren't run as migrations
+_PYTHON_MIGRATION_NAME = re.compile(r"[0-9]+_.+\.py")
+
+
+PYTHON_TEMPLATE = '''"""Write migration code in migrate below
+
+ctx.conn is inside the transaction the migration is recorded in so don't
+commit. ctx also has execute, executemany, stream, copy_in and copy_out.
+"""
+
+
+def migrate(ctx):
+    pass
+'''
+
+
+class MigrationFile:
+    """Migration file on disk that is only read while it is open
+
+    Opening the file memory maps it rather than reading it so very large
+    migrations don't have to fit in memory. Compressed files are
+    decompressed once into a temporary file that every open maps instead,
+    so they are split and applied the same as any other migration. The
+    temporary file is deleted when the MigrationFile is closed or garbage
+    collected.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._decompressed: Optional[BinaryIO] = None
+        self._checksum: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"MigrationFile({str(self.path)!r})"
+
+    def checksum(self) -> str:
+        """Returns the checksum of the file's content, decompressed if it is"""
+
+        if self._checksum is None:
+            if is_compressed(self.path.name):
+                # Hashed while decompressing so the file is only read once
+                self._decompress()
+            else:
+                self._checksum = checksum_file(self.path)
+
+        return self._checksum  # type: ignore
+
+    @contextmanager
+    def open(self) -> Iterator[Buffer]:
+        """Memory maps the file for the duration of the context"""
+
+        if not is_compressed(self.path.name):
+            with open(self.path, "rb") as f:
+                yield from _map_file(f)
+            return
+
+        yield from _map_file(self._decompress())
+
+    def close(self) -> None:
+        """Deletes the decompressed copy of a compressed file if one was made"""
+
+        if self._decompressed is not None:
+            self._decompressed.close()
+            self._decompressed = None
+
+    def _decompress(self) -> BinaryIO:
+        """Decompresses the file into a temporary file the first time it's needed"""
+
+        if self._decompressed is None:
+            digest = hashlib.sha256()
+            # Deleted as soon as it's closed
+            f = tempfile.TemporaryFile()
+
+            try:
+                with open_decompressed(self.path) as source:
+                    while chunk := source.read(CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                f.flush()
+            except BaseException:
+                f.close()
+                raise
+
+            self._decompressed = f  # type: ignore
+            self._checksum = digest.hexdigest()
+
+        return self._decompressed  # type: ignore
+
+
+def _map_file(f) -> Iterator[Buffer]:
+    # Empty files can't be memory mapped
+    if os.fstat(f.fileno()).st_size == 0:
+        yield b""
+        return
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        yield content
+
+
+# Content of a migration either already in memory or still on disk
+MigrationContent = Union[bytes, MigrationFile]
+
+
+def open_content(content: MigrationContent) -> ContextManager[Buffer]:
+    """Returns a context giving the bytes of migration content"""
+
+    if isinstance(content, MigrationFile):
+        return content.open()
+
+    return nullcontext(content)
+
+
+def content_directory(content: MigrationContent) -> Optional[Path]:
+    """Returns the directory migration content was read from if on disk"""
+
+    if isinstance(content, MigrationFile):
+        return content.path.parent
+
+    return None
+
+
+def content_checksum(content: MigrationContent) -> str:
+    """Returns the checksum of migration content"""
+
+    if isinstance(content, MigrationFile):
+        return content.checksum()
+
+    return checksum(content)
+
+
+# Pages of memory mapped migrations are released after this many bytes
+RELEASE_EVERY = 16 * 1024 * 1024
+
+
+def release_pages(content: Buffer, end: int) -> None:
+    """Lets the OS drop pages of memory mapped content before end
+
+    The pages are read back from the file if they are accessed again so
+    this only affects memory use.
+    """
+
+    if not isinstance(content, mmap.mmap) or not hasattr(mmap, "MADV_DONTNEED"):
+        return
+
+    end -= end % mmap.PAGESIZE
+    if end > 0:
+        content.madvise(mmap.MADV_DONTNEED, 0, end)
+
+
+def is_python_migration(name: str) -> bool:
+    return name.endswith(PYTHON_SUFFIX)
+
+
+def is_migration_name(name: str) -> bool:
+    """Whether a file with this name in the directory is a migration"""
+
+    if is_python_migration(name):
+        return _PYTHON_MIGRATION_NAME.fullmatch(name) is not None
+
+    return name.endswith(MIGRATION_SUFFIXES)
+
+
+def migration_stem(name: str) -> str:
+    """Returns a migration's name without its file extension"""
+
+    for suffix in MIGRATION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+
+    return name
+
+
+def list_migration_files(directory: Path) -> List[str]:
+    """Returns the sorted names of the SQL and Python migrations in a directory
+
+    Python files only count when they are numbered like the ones create
+    makes. Uses the file types from the directory listing so large
+    directories don't need a stat call per file.
+    """
+
+    with os.scandir(directory) as it:
+        migrations = [
+            entry.name
+            for entry in it
+            if is_migration_name(entry.name) and entry.is_file()
+        ]
+
+    migrations.sort()
+    return migrations
+
 
 class FileSystem:
     """Class to handle file system operations for migrations"""
 
     def __init__(self, migrations_directory: Path):
         if not migrations_directory.exists():
-            print(
+            fail(
                 f"[bold red]Migration directory not found![/]\nRun the [b]setup[/] command to setup the migrations directory.\n"
             )
-            raise typer.Exit(code=1)
 
         self.migrations_directory = migrations_directory
 
-    def create_migration_file(self, migration_name: str) -> None:
-        """Creates a new migration file in the migrations directory"""
+    def create_migration_file(
+        self, migration_name: str, python: bool = False, compressed: bool = False
+    ) -> None:
+        """Creates a new SQL or Python migration file in the migrations directory
 
-        file_name = datetime.now().strftime("%y%m%d%H%M%S") + f"_{migration_name}.sql"
+        SQL migrations can be compressed with gzip, which suits large seed
+        data.
+        """
 
-        with open(self.migrations_directory / file_name, "w") as f:
-            f.write("-- Write migration code below\n")
+        if python:
+            suffix = PYTHON_SUFFIX
+        elif compressed:
+            suffix = ".sql" + GZIP_SUFFIX
+        else:
+            suffix = ".sql"
+
+        file_name = (
+            datetime.now().strftime("%y%m%d%H%M%S") + f"_{migration_name}{suffix}"
+        )
+        path = self.migrations_directory / file_name
+
+        if python:
+            path.write_text(PYTHON_TEMPLATE)
+        elif compressed:
+            with gzip.open(path, "wt") as f:
+                f.write("-- Write migration code below\n")
+        else:
+            path.write_text("-- Write migration code below\n")
 
         print(
             f"[bold green]Created[/] migration file at: [b]{self.migrations_directory}/{file_name}[/].\n"
@@ -34,28 +275,49 @@ class FileSystem:
     def get_migration_files(self) -> List[str]:
         """Returns sorted list of all migration files in the migrations directory"""
 
-        # Creates list of all files in the migrations directory ending with .sql
-        all_migrations = [
-            file_path.name
-            for file_path in self.migrations_directory.glob("*.sql")
-            if file_path.is_file()
-        ]
-        all_migrations.sort()
+        files = list_migration_files(self.migrations_directory)
+
+        if not zstd_available():
+            compressed = [file for file in files if file.endswith(ZSTD_SUFFIX)]
+            if compressed:
+                fail(
+                    f"[bold red]Error[/] migration [b]{compressed[0]}[/] is compressed with zstd which needs Python 3.14 or the zstandard package.\n"
+                    "Install it with [b]pip install zstandard[/].\n"
+                )
+
+        return files
 
-        return all_migrations
+    def get_migration(self, migration_name: str) -> MigrationFile:
+        """Gets a migration file from the migration directory
 
-    def get_migration(self, migration_name: str) -> bytes:
-        """Gets a migration file from the migration directory"""
+        The file is not read until it is opened.
+        """
 
         migration_file = self.migrations_directory / migration_name
 
         if not migration_file.exists():
-            print(
+            fail(
                 f"\n[bold red]Error[/] migration [b]{migration_name}[/] not found in the migration directory.\n"
             )
-            raise typer.Exit(code=1)
 
-        return migration_file.read_bytes()
+        return MigrationFile(migration_file)
+
+    def get_migration_checksums(self, workers: Optional[int] = None) -> Dict[str, str]:
+        """Returns the checksum of every migration file keyed by file name
+
+        Includes migrations archived by squash since databases made before
+        the squash have them applied.
+        """
+
+        paths = [
+            self.migrations_directory / file for file in self.get_migration_files()
+        ]
+
+        archive = self.migrations_directory / ARCHIVE_DIRECTORY
+        if archive.is_dir():
+            paths += [archive / file for file in list_migration_files(archive)]
+
+        return checksum_files(paths, workers)
 
     @staticmethod
     def create_migration_directory(migrations_directory: Path) -> None:
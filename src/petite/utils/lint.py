@@ -0,0 +1,627 @@
+"""Offline checks for migration statements that lock or rewrite tables"""
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from .directives import parse_directives
+from .file_system import Buffer
+from .splitter import iter_statements
+
+ERROR = "error"
+WARNING = "warning"
+
+# Lock modes from weakest to strongest as named by PostgreSQL
+ACCESS_SHARE = "ACCESS SHARE"
+ROW_EXCLUSIVE = "ROW EXCLUSIVE"
+SHARE_UPDATE_EXCLUSIVE = "SHARE UPDATE EXCLUSIVE"
+SHARE = "SHARE"
+SHARE_ROW_EXCLUSIVE = "SHARE ROW EXCLUSIVE"
+EXCLUSIVE = "EXCLUSIVE"
+ACCESS_EXCLUSIVE = "ACCESS EXCLUSIVE"
+
+# Locks that stop other sessions writing to the table
+WRITE_BLOCKING_LOCKS = frozenset(
+    [SHARE, SHARE_ROW_EXCLUSIVE, EXCLUSIVE, ACCESS_EXCLUSIVE]
+)
+
+# Larger statements, like big INSERTs, are only classified by their kind
+PARSE_LIMIT = 64 * 1024
+
+
+class Rule(NamedTuple):
+    """Something risky a statement can do along with how to avoid it"""
+
+    severity: str
+    message: str
+    suggestion: str
+
+
+RULES = {
+    "alter-column-type": Rule(
+        ERROR,
+        "Changing a column's type rewrites the table under an ACCESS EXCLUSIVE lock.",
+        "Add a new column, backfill it in batches and switch reads over, "
+        + "unless the change is binary compatible like widening a varchar.",
+    ),
+    "volatile-default": Rule(
+        ERROR,
+        "Adding a column with a volatile default or a generated column rewrites "
+        + "the table under an ACCESS EXCLUSIVE lock.",
+        "Add the column without a default, set the default in another "
+        + "statement then backfill existing rows in batches.",
+    ),
+    "create-index": Rule(
+        ERROR,
+        "Creating an index without CONCURRENTLY blocks writes to the table "
+        + "until it is built.",
+        "Use CREATE INDEX CONCURRENTLY in a migration with "
+        + "`-- petite: transaction=off`.",
+    ),
+    "set-not-null": Rule(
+        ERROR,
+        "Setting NOT NULL scans the whole table under an ACCESS EXCLUSIVE lock.",
+        "Add CHECK (column IS NOT NULL) NOT VALID, VALIDATE CONSTRAINT it, "
+        + "then SET NOT NULL which skips the scan.",
+    ),
+    "constraint-not-valid": Rule(
+        ERROR,
+        "Adding a CHECK or FOREIGN KEY constraint checks every row while "
+        + "holding a lock that blocks writes.",
+        "Add the constraint with NOT VALID then VALIDATE CONSTRAINT it in "
+        + "another statement, which doesn't block writes.",
+    ),
+    "add-unique-constraint": Rule(
+        ERROR,
+        "Adding a UNIQUE or PRIMARY KEY constraint builds an index under an "
+        + "ACCESS EXCLUSIVE lock.",
+        "CREATE UNIQUE INDEX CONCURRENTLY then ADD CONSTRAINT ... USING INDEX.",
+    ),
+    "table-rewrite": Rule(
+        ERROR,
+        "The statement rewrites the whole table under an ACCESS EXCLUSIVE lock.",
+        "Use a tool like pg_repack or run it in a maintenance window.",
+    ),
+    "reindex": Rule(
+        WARNING,
+        "Reindexing without CONCURRENTLY blocks writes while the index is rebuilt.",
+        "Use REINDEX CONCURRENTLY in a migration with `-- petite: transaction=off`.",
+    ),
+    "lock-table": Rule(
+        WARNING,
+        "Explicitly locking a table can block other queries for the rest of "
+        + "the migration.",
+        "Keep the migration short and set a lock_timeout.",
+    ),
+    "unbatched-update": Rule(
+        WARNING,
+        "Updating or deleting every row locks them all in one transaction and "
+        + "can bloat the table.",
+        "Update rows in batches by key range with a backfill migration, "
+        + "`-- petite: backfill=<table>`.",
+    ),
+    "missing-lock-timeout": Rule(
+        WARNING,
+        "The migration takes an ACCESS EXCLUSIVE lock without a lock_timeout "
+        + "so it can queue behind long queries and block everything after it.",
+        "Add `-- petite: lock_timeout=5s` to the migration or apply with "
+        + "--lock-timeout and --retries.",
+    ),
+}
+
+# Functions that return a different value for every row, so using one as a
+# default makes PostgreSQL fill in every existing row
+_VOLATILE_FUNCTIONS = frozenset(
+    [
+        "CLOCK_TIMESTAMP",
+        "GEN_RANDOM_UUID",
+        "NEXTVAL",
+        "RAND",
+        "RANDOM",
+        "TIMEOFDAY",
+        "TXID_CURRENT",
+        "UUID",
+        "UUID_GENERATE_V1",
+        "UUID_GENERATE_V1MC",
+        "UUID_GENERATE_V4",
+    ]
+)
+_SERIAL_TYPES = frozenset(
+    [
+        exp.DataType.Type.SERIAL,
+        exp.DataType.Type.BIGSERIAL,
+        exp.DataType.Type.SMALLSERIAL,
+    ]
+)
+
+# Comments like `-- petite-lint: ignore create-index, set-not-null` before
+# a statement
+_IGNORE = re.compile(rb"--\s*petite-lint:\s*ignore\s+(?P<rules>[\w\-, ]+)", re.I)
+
+# Statements sqlglot can't parse are looked at with these instead
+_TABLE_NAME = r"(?:ONLY\s+)?(?:IF\s+EXISTS\s+)?(?P<table>[\w\".]+)"
+_ALTER_TABLE = re.compile(rf"ALTER\s+TABLE\s+{_TABLE_NAME}\s+(?P<rest>.*)", re.I | re.S)
+_VALIDATE = re.compile(r"\bVALIDATE\s+CONSTRAINT\s+(?P<name>[\w\"]+)", re.I)
+_WEAK_ALTER = re.compile(
+    r"^(?:ALTER\s+(?:COLUMN\s+)?[\w\"]+\s+SET\s+STATISTICS|SET\s*\(|CLUSTER\s+ON"
+    r"|SET\s+WITHOUT\s+CLUSTER|VALIDATE\s+CONSTRAINT)\b",
+    re.I,
+)
+_LOCK_MODE = re.compile(
+    r"^LOCK\s+(?:TABLE\s+)?(?:ONLY\s+)?(?P<table>[\w\".]+).*?"
+    r"(?:\bIN\s+(?P<mode>[A-Z ]+?)\s+MODE)?\s*(?:NOWAIT)?\s*$",
+    re.I | re.S,
+)
+_VACUUM_FULL = re.compile(
+    r"^VACUUM\s*(?:\(\s*[^)]*\bFULL\b[^)]*\)|(?:\w+\s+)*?FULL\b)", re.I
+)
+_CONCURRENTLY = re.compile(r"\bCONCURRENTLY\b", re.I)
+_REFRESH = re.compile(r"^REFRESH\s+MATERIALIZED\s+VIEW\b", re.I)
+_OPTIONS = re.compile(r"\([^)]*\)")
+_MAINTENANCE_KEYWORDS = frozenset(
+    [
+        "ANALYZE",
+        "CONCURRENTLY",
+        "FREEZE",
+        "FULL",
+        "INDEX",
+        "MATERIALIZED",
+        "ONLY",
+        "TABLE",
+        "VERBOSE",
+        "VIEW",
+    ]
+)
+
+
+class Finding(NamedTuple):
+    """A rule a statement broke"""
+
+    rule: str
+    severity: str
+    message: str
+    suggestion: str
+
+
+class StatementReport(NamedTuple):
+    """How a statement in a migration locks the table it touches"""
+
+    file: str
+    # Position of the statement in the file, starting at 0
+    index: int
+    line: int
+    kind: str
+    table: Optional[str]
+    # Strongest lock the statement takes on an existing table, or None if it
+    # only touches objects it creates
+    lock: Optional[str]
+    # If the statement copies or scans the whole table while holding the lock
+    rewrite: bool
+    findings: List[Finding]
+
+
+class _Classification(NamedTuple):
+    table: Optional[str] = None
+    lock: Optional[str] = None
+    rewrite: bool = False
+    rules: Tuple[str, ...] = ()
+
+
+class Linter:
+    """Classifies the statements of migrations by the locks they take
+
+    Migrations have to be linted in the order they are applied since
+    constraints validated by earlier migrations change what is risky in later
+    ones. Statements on tables created earlier in the same migration are
+    never flagged since the table is still empty.
+
+    ignored rules are skipped and warnings are rules reported as warnings
+    instead of errors.
+    """
+
+    def __init__(
+        self, ignored: Iterable[str] = (), warnings: Iterable[str] = ()
+    ) -> None:
+        self.ignored = set(ignored)
+        self.warnings = set(warnings)
+
+        unknown = (self.ignored | self.warnings) - RULES.keys()
+        if unknown:
+            raise ValueError(f"Unknown lint rule: {', '.join(sorted(unknown))}")
+
+        # Tables created by the migration being linted
+        self.new_tables: Set[str] = set()
+        # Columns with a validated IS NOT NULL check, keyed by table
+        self.not_null_checks: Set[Tuple[str, str]] = set()
+        # Constraint name to the column it checks IS NOT NULL
+        self.pending_checks: Dict[Tuple[str, str], str] = {}
+
+    def lint(self, file: str, content: Buffer) -> List[StatementReport]:
+        """Lints every statement of a migration"""
+
+        try:
+            lock_timeout = parse_directives(content).timeouts.lock_timeout
+        except ValueError:
+            lock_timeout = None
+        warned_lock_timeout = lock_timeout is not None
+
+        self.new_tables.clear()
+
+        reports = []
+        previous_end = 0
+        line = 1
+
+        for index, statement in enumerate(iter_statements(content)):  # type: ignore
+            line += content[previous_end : statement.start].count(b"\n")
+
+            if statement.copy_data is not None:
+                line += content[statement.start : statement.copy_data[1]].count(b"\n")
+                previous_end = statement.copy_data[1]
+                continue
+
+            ignored = self.ignored | _ignored_rules(
+                content[previous_end : statement.start], previous_end > 0
+            )
+            previous_end = statement.end
+
+            text = content[statement.start : statement.end].decode("utf-8", "replace")
+            result = self.__classify(statement.kind, text)
+
+            # Tables created earlier in this migration are empty
+            new_table = result.table is not None and result.table in self.new_tables
+            lock = None if new_table else result.lock
+            rules = [] if new_table else list(result.rules)
+
+            if lock == ACCESS_EXCLUSIVE and not warned_lock_timeout:
+                rules.append("missing-lock-timeout")
+                warned_lock_timeout = True
+
+            findings = []
+            for rule_id in rules:
+                if rule_id in ignored:
+                    continue
+
+                rule = RULES[rule_id]
+                severity = WARNING if rule_id in self.warnings else rule.severity
+                findings.append(
+                    Finding(rule_id, severity, rule.message, rule.suggestion)
+                )
+
+            reports.append(
+                StatementReport(
+                    file,
+                    index,
+                    line,
+                    statement.kind,
+                    result.table,
+                    lock,
+                    result.rewrite and not new_table,
+                    findings,
+                )
+            )
+            line += text.count("\n")
+
+        return reports
+
+    def __classify(self, kind: str, text: str) -> _Classification:
+        """Works out the lock, rewrite risk and rules broken by a statement"""
+
+        if kind in ("INSERT", "UPDATE", "DELETE", "MERGE", "WITH"):
+            return self.__classify_dml(kind, text)
+
+        if kind == "SELECT":
+            return _Classification(lock=ACCESS_SHARE)
+
+        if kind in ("VACUUM", "CLUSTER", "REINDEX", "LOCK", "REFRESH"):
+            return _classify_maintenance(kind, text)
+
+        if len(text) > PARSE_LIMIT:
+            return _Classification()
+
+        try:
+            tree = sqlglot.parse_one(text, read="postgres")
+        except sqlglot.errors.SqlglotError:
+            tree = None
+
+        if isinstance(tree, exp.Create):
+            return self.__classify_create(tree)
+        if isinstance(tree, exp.Alter) and tree.args.get("kind") == "TABLE":
+            return self.__classify_alter(tree)
+        if kind == "ALTER TABLE":
+            return self.__classify_alter_text(text)
+        if isinstance(tree, exp.Drop):
+            return _classify_drop(tree)
+        if isinstance(tree, exp.TruncateTable):
+            tables = tree.expressions
+            return _Classification(
+                _table_name(tables[0]) if tables else None, ACCESS_EXCLUSIVE
+            )
+
+        return _Classification()
+
+    def __classify_dml(self, kind: str, text: str) -> _Classification:
+        tree = None
+        if len(text) <= PARSE_LIMIT:
+            try:
+                tree = sqlglot.parse_one(text, read="postgres")
+            except sqlglot.errors.SqlglotError:
+                pass
+
+        if not isinstance(tree, (exp.Insert, exp.Update, exp.Delete, exp.Merge)):
+            return _Classification(lock=ROW_EXCLUSIVE)
+
+        table = tree.this if not isinstance(tree, exp.Insert) else tree.find(exp.Table)
+        table_name = _table_name(table) if isinstance(table, exp.Table) else None
+
+        rules = ()
+        if (
+            isinstance(tree, (exp.Update, exp.Delete))
+            and tree.args.get("where") is None
+        ):
+            rules = ("unbatched-update",)
+
+        return _Classification(table_name, ROW_EXCLUSIVE, False, rules)
+
+    def __classify_create(self, tree: exp.Create) -> _Classification:
+        kind = tree.args.get("kind")
+
+        if kind == "TABLE":
+            table = tree.find(exp.Table)
+            if table is not None:
+                self.new_tables.add(_table_name(table))
+            return _Classification()
+
+        if kind == "INDEX":
+            table = tree.this.args.get("table")
+            table_name = _table_name(table) if table is not None else None
+
+            if tree.args.get("concurrently"):
+                return _Classification(table_name, SHARE_UPDATE_EXCLUSIVE)
+            return _Classification(table_name, SHARE, False, ("create-index",))
+
+        if kind == "TRIGGER":
+            table = tree.find(exp.Table)
+            return _Classification(
+                _table_name(table) if table is not None else None, SHARE_ROW_EXCLUSIVE
+            )
+
+        return _Classification()
+
+    def __classify_alter(self, tree: exp.Alter) -> _Classification:
+        table = _table_name(tree.this)
+        not_valid = bool(tree.args.get("not_valid"))
+
+        lock = ACCESS_EXCLUSIVE
+        rewrite = False
+        rules: List[str] = []
+
+        for action in tree.args.get("actions") or []:
+            if isinstance(action, exp.ColumnDef):
+                if _rewrites_on_add(action):
+                    rewrite = True
+                    rules.append("volatile-default")
+                if action.find(
+                    exp.PrimaryKeyColumnConstraint, exp.UniqueColumnConstraint
+                ):
+                    rules.append("add-unique-constraint")
+
+            elif isinstance(action, exp.AlterColumn):
+                if action.args.get("dtype") is not None:
+                    rewrite = True
+                    rules.append("alter-column-type")
+                elif action.args.get("allow_null") is False:
+                    column = action.this.name.lower()
+                    if (table, column) not in self.not_null_checks:
+                        rewrite = True
+                        rules.append("set-not-null")
+
+            elif isinstance(action, exp.AddConstraint):
+                for constraint in action.expressions:
+                    if constraint.find(
+                        exp.PrimaryKey,
+                        exp.PrimaryKeyColumnConstraint,
+                        exp.UniqueColumnConstraint,
+                    ):
+                        rewrite = True
+                        rules.append("add-unique-constraint")
+                    elif constraint.find(exp.ForeignKey):
+                        if not not_valid:
+                            rewrite = True
+                            rules.append("constraint-not-valid")
+                    elif constraint.find(exp.CheckColumnConstraint):
+                        self.__record_check(table, constraint, not_valid)
+                        if not not_valid:
+                            rewrite = True
+                            rules.append("constraint-not-valid")
+
+            elif isinstance(action, exp.AlterSet):
+                if action.args.get("tablespace") is not None or (
+                    action.args.get("option") is not None
+                    and action.args["option"].name.upper() in ("LOGGED", "UNLOGGED")
+                ):
+                    rewrite = True
+                    rules.append("table-rewrite")
+
+        # Foreign keys only need to stop rows changing while they are added
+        actions = tree.args.get("actions") or []
+        if actions and all(
+            isinstance(action, exp.AddConstraint) and action.find(exp.ForeignKey)
+            for action in actions
+        ):
+            lock = SHARE_ROW_EXCLUSIVE
+
+        return _Classification(table, lock, rewrite, tuple(dict.fromkeys(rules)))
+
+    def __classify_alter_text(self, text: str) -> _Classification:
+        """Classifies ALTER TABLE statements sqlglot doesn't understand"""
+
+        match = _ALTER_TABLE.match(text)
+        if match is None:
+            return _Classification(lock=ACCESS_EXCLUSIVE)
+
+        table = _normalize(match.group("table"))
+        rest = match.group("rest")
+
+        validate = _VALIDATE.search(rest)
+        if validate is not None:
+            column = self.pending_checks.pop(
+                (table, _normalize(validate.group("name"))), None
+            )
+            if column is not None:
+                self.not_null_checks.add((table, column))
+
+        if _WEAK_ALTER.match(rest):
+            return _Classification(table, SHARE_UPDATE_EXCLUSIVE)
+
+        return _Classification(table, ACCESS_EXCLUSIVE)
+
+    def __record_check(
+        self, table: str, constraint: exp.Expression, not_valid: bool
+    ) -> None:
+        """Remembers CHECK (column IS NOT NULL) constraints for SET NOT NULL"""
+
+        check = constraint.find(exp.CheckColumnConstraint)
+        condition = check.this if check is not None else None
+
+        if not (
+            isinstance(condition, exp.Not) and isinstance(condition.this, exp.Is)
+        ) and not (isinstance(condition, exp.Is) and condition.args.get("negate")):
+            return
+
+        inner = condition.this if isinstance(condition, exp.Not) else condition
+        if not isinstance(inner.this, exp.Column) or not isinstance(
+            inner.expression, exp.Null
+        ):
+            return
+
+        column = inner.this.name.lower()
+        if not_valid:
+            self.pending_checks[(table, constraint.name.lower())] = column
+        else:
+            self.not_null_checks.add((table, column))
+
+
+def _classify_maintenance(kind: str, text: str) -> _Classification:
+    """Classifies statements sqlglot can't parse from their text"""
+
+    if kind == "VACUUM":
+        if _VACUUM_FULL.match(text):
+            return _Classification(
+                _target_table(text), ACCESS_EXCLUSIVE, True, ("table-rewrite",)
+            )
+        return _Classification(_target_table(text), SHARE_UPDATE_EXCLUSIVE)
+
+    if kind == "CLUSTER":
+        return _Classification(
+            _target_table(text), ACCESS_EXCLUSIVE, True, ("table-rewrite",)
+        )
+
+    if kind == "REINDEX":
+        if _CONCURRENTLY.search(text):
+            return _Classification(_target_table(text), SHARE_UPDATE_EXCLUSIVE)
+        return _Classification(_target_table(text), SHARE, False, ("reindex",))
+
+    if kind == "LOCK":
+        match = _LOCK_MODE.match(text)
+        if match is None:
+            return _Classification(lock=ACCESS_EXCLUSIVE, rules=("lock-table",))
+        mode = " ".join((match.group("mode") or ACCESS_EXCLUSIVE).upper().split())
+        return _Classification(
+            _normalize(match.group("table")), mode, False, ("lock-table",)
+        )
+
+    if kind == "REFRESH" and _REFRESH.match(text):
+        if _CONCURRENTLY.search(text):
+            return _Classification(_target_table(text), EXCLUSIVE)
+        return _Classification(_target_table(text), ACCESS_EXCLUSIVE)
+
+    return _Classification()
+
+
+def _classify_drop(tree: exp.Drop) -> _Classification:
+    kind = tree.args.get("kind")
+    tables = tree.args.get("tables") or []
+    table = _table_name(tables[0]) if tables else None
+
+    if kind == "INDEX" and tree.args.get("concurrently"):
+        return _Classification(table, SHARE_UPDATE_EXCLUSIVE)
+    if kind in ("TABLE", "INDEX", "VIEW"):
+        return _Classification(table, ACCESS_EXCLUSIVE)
+
+    return _Classification()
+
+
+def _rewrites_on_add(column: exp.ColumnDef) -> bool:
+    """If adding a column makes PostgreSQL fill in every existing row"""
+
+    kind = column.args.get("kind")
+    if isinstance(kind, exp.DataType) and kind.this in _SERIAL_TYPES:
+        return True
+
+    for constraint in column.args.get("constraints") or []:
+        if isinstance(constraint.kind, exp.ComputedColumnConstraint):
+            return True
+        if isinstance(constraint.kind, exp.DefaultColumnConstraint):
+            for function in constraint.kind.find_all(exp.Func):
+                name = (
+                    function.name
+                    if isinstance(function, exp.Anonymous)
+                    else function.key
+                )
+                if name.upper() in _VOLATILE_FUNCTIONS:
+                    return True
+
+    return False
+
+
+def _ignored_rules(comments: Buffer, after_statement: bool) -> Set[str]:
+    """Rules turned off by comments right before a statement
+
+    Comments on the same line as the end of the previous statement belong to
+    it so are skipped when there is one.
+    """
+
+    comments = bytes(comments)
+    if after_statement:
+        comments = comments[comments.find(b"\n") + 1 :] if b"\n" in comments else b""
+
+    rules = set()
+    for match in _IGNORE.finditer(comments):
+        rules.update(
+            rule.strip()
+            for rule in match.group("rules").decode("utf-8").split(",")
+            if rule.strip()
+        )
+
+    return rules
+
+
+def _table_name(table: exp.Expression) -> str:
+    """Name of a table without its schema, folded to lower case unless quoted"""
+
+    identifier = table.this
+    if isinstance(identifier, exp.Identifier) and identifier.quoted:
+        return identifier.name
+    return table.name.lower()
+
+
+def _normalize(name: str) -> str:
+    """Strips the schema and quotes from a table name in SQL"""
+
+    name = name.rsplit(".", 1)[-1]
+    if name.startswith('"'):
+        return name.strip('"').replace('""', '"')
+    return name.lower()
+
+
+def _target_table(text: str) -> Optional[str]:
+    """Finds the table of maintenance commands like VACUUM and REINDEX"""
+
+    words = _OPTIONS.sub(" ", text).split()[1:]
+    for word in words:
+        if word.upper() not in _MAINTENANCE_KEYWORDS:
+            return _normalize(word.rstrip(",;"))
+
+    return None
@@ -0,0 +1,1060 @@
+"""Applying migrations over a blocking connection
+
+The part of Database and AsyncDatabase that talks to PostgreSQL. Nothing is
+printed, progress is reported to a Progress and problems are raised as
+PetiteError subclasses so each can present them its own way.
+"""
+
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import psycopg
+
+from . import queries
+from .backfill import PROGRESS_EVERY, chunk_query, throttle_delay
+from .cache import MigrationCache
+from .copy_data import iter_content_chunks, iter_file_chunks, sidecar_copy
+from .errors import (
+    BackfillError,
+    InvalidMigration,
+    MigrationError,
+    MigrationTableNotFound,
+    MigrationTableOutdated,
+    PetiteError,
+)
+from .events import BATCH, MIGRATION, PHASE, RETRY, STATEMENT, EventLog
+from .file_system import (
+    RELEASE_EVERY,
+    Buffer,
+    MigrationContent,
+    content_checksum,
+    content_directory,
+    open_content,
+    release_pages,
+)
+from .planner import Batch, PlannedMigration, plan_migrations
+from .python_migrations import MigrationContext, load_migration
+from .splitter import Statement, iter_statements
+from .timeouts import RetryPolicy, Timeouts
+
+# Statements queued in a pipeline are synced after this many so the cursors
+# waiting on results stay bounded on very large migrations
+SYNC_EVERY = 1000
+# Migrations larger than this are split lazily without the cache
+CACHE_MAX_CONTENT = 8 * 1024 * 1024
+
+
+class StatementTiming(NamedTuple):
+    """How long a statement took to run and how large it was"""
+
+    kind: str
+    duration_ms: float
+    bytes: int
+
+
+class CopyResult(NamedTuple):
+    """Rows copied by a COPY statement and how long it took"""
+
+    count: int
+    seconds: float
+
+
+class Progress:
+    """Told what is happening while migrations are applied
+
+    Does nothing by default. Database prints each step and AsyncDatabase
+    logs them.
+    """
+
+    def upgraded_schema(self, version: int) -> None:
+        pass
+
+    def waiting_for_lock(self) -> None:
+        pass
+
+    def applied(self, name: str) -> None:
+        pass
+
+    def copied(self, name: str, rows: CopyResult) -> None:
+        pass
+
+    def retrying(self, name: str, attempt: int, retries: int, delay: float) -> None:
+        pass
+
+    def resuming_backfill(
+        self, name: str, last_key: str, rows: int, chunks: int
+    ) -> None:
+        pass
+
+    def backfill_progress(
+        self, name: str, rows: int, chunks: int, last_key: str, rate: float
+    ) -> None:
+        pass
+
+    def backfilled(self, name: str, rows: int, chunks: int) -> None:
+        pass
+
+
+class Migrator:
+    """Applies migrations and keeps the bookkeeping tables"""
+
+    def __init__(
+        self,
+        conn: psycopg.Connection,
+        cache: Optional[MigrationCache] = None,
+        events: Optional[EventLog] = None,
+        progress: Optional[Progress] = None,
+    ) -> None:
+        self.conn = conn
+        self.cache = cache
+        self.events = events or EventLog()
+        self.progress = progress or Progress()
+        # Session timeouts, restored after migrations that override them
+        self.timeouts = Timeouts()
+
+    def upgrade_schema(self, create: bool) -> int:
+        """Brings the bookkeeping tables up to the current schema version
+
+        Returns the version they were at, 0 meaning they didn't exist. They
+        are only created if create is set. Upgrades run in one transaction
+        under a lock so concurrent runs don't upgrade at the same time.
+        """
+
+        with self.conn.cursor() as cur:
+            cur.execute(queries.SCHEMA_LOCK, (queries.MIGRATION_LOCK_KEY,))
+
+            cur.execute(queries.SCHEMA_TABLES)
+            has_migration, has_metadata = cur.fetchone()  # type: ignore
+
+            if has_metadata:
+                cur.execute(queries.SCHEMA_VERSION_QUERY)
+                version = cur.fetchone()[0]  # type: ignore
+            else:
+                version = 1 if has_migration else 0
+
+            if version > queries.SCHEMA_VERSION:
+                self.conn.rollback()
+                raise MigrationTableOutdated(
+                    f"Migration table schema is version {version} but this "
+                    f"version of petite supports up to {queries.SCHEMA_VERSION}"
+                )
+
+            if version == 0 and not create:
+                self.conn.rollback()
+                return version
+
+            for upgrade in queries.SCHEMA_UPGRADES[version:]:
+                cur.execute(upgrade)
+
+            if version < queries.SCHEMA_VERSION:
+                cur.execute(queries.SET_SCHEMA_VERSION, (queries.SCHEMA_VERSION,))
+
+        self.conn.commit()
+        return version
+
+    def get_last_applied_migration(self) -> Optional[Tuple]:
+        """Gets the whole row of the last applied migration
+
+        Takes a single query served by the C collated file_name index.
+        Tables made by older versions are upgraded first.
+        """
+
+        row = self.__fetch_metadata(queries.LAST_APPLIED_MIGRATION)
+
+        if row is None or row[0] < queries.SCHEMA_VERSION:
+            self.__require_schema()
+            row = self.__fetch_metadata(queries.LAST_APPLIED_MIGRATION)
+
+        # Nothing applied yet
+        if row is None or row[1] is None:
+            return None
+
+        return row[1:]
+
+    def get_applied_migrations(self) -> List[str]:
+        """Gets the name of every applied migration sorted like the directory
+
+        Takes a single query however many have been applied. Tables made by
+        older versions are upgraded first.
+        """
+
+        row = self.__fetch_metadata(queries.APPLIED_MIGRATIONS)
+
+        if row is None or row[0] < queries.SCHEMA_VERSION:
+            self.__require_schema()
+            row = self.__fetch_metadata(queries.APPLIED_MIGRATIONS)
+
+        # Sorted here as sorting bytewise in the database can't use an index
+        return sorted(row[1]) if row is not None else []
+
+    def __fetch_metadata(self, query: str) -> Optional[Tuple]:
+        """Runs a query starting with the schema version from the metadata row"""
+
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(query)
+            except psycopg.errors.UndefinedTable:
+                self.conn.rollback()
+                return None
+
+            return cur.fetchone()
+
+    def __require_schema(self) -> None:
+        """Upgrades the bookkeeping tables raising if they don't exist"""
+
+        version = self.upgrade_schema(create=False)
+
+        if version == 0:
+            raise MigrationTableNotFound(
+                "Migration table not found, create it with create_migration_table"
+            )
+
+        self.progress.upgraded_schema(version)
+
+    def lock(self) -> None:
+        """Takes the advisory lock that makes concurrent applies take turns
+
+        Waits for it if another run holds it. The lock is held by the session
+        so it is released even if the process dies.
+        """
+
+        with self.events.timed(PHASE, phase="lock") as lock, self.conn.cursor() as cur:
+            cur.execute(queries.TRY_MIGRATION_LOCK, (queries.MIGRATION_LOCK_KEY,))
+            locked = cur.fetchone()[0]  # type: ignore
+            lock["waited"] = not locked
+
+            if not locked:
+                self.progress.waiting_for_lock()
+                cur.execute(queries.MIGRATION_LOCK, (queries.MIGRATION_LOCK_KEY,))
+
+        # Ends the transaction so later reads see what the other run applied
+        self.conn.commit()
+
+    def unlock(self) -> None:
+        """Releases the advisory lock taken by lock"""
+
+        if self.conn.closed:
+            return
+
+        if self.conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            self.conn.rollback()
+        self.conn.execute(queries.MIGRATION_UNLOCK, (queries.MIGRATION_LOCK_KEY,))
+        self.conn.commit()
+
+    def get_migration_durations(self, file_names: List[str]) -> Dict[str, float]:
+        """Gets the duration in milliseconds of the given applied migrations"""
+
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT file_name, duration_ms FROM migration
+                WHERE file_name = ANY(%s) AND duration_ms IS NOT NULL
+                """,
+                (file_names,),
+            )
+            return dict(cur.fetchall())
+
+    def set_timeouts(self, timeouts: Timeouts) -> None:
+        """Sets the timeouts used for the rest of the session"""
+
+        settings = [
+            (name, value) for name, value in timeouts._asdict().items() if value
+        ]
+        if not settings:
+            return
+
+        with self.conn.cursor() as cur:
+            try:
+                for name, value in settings:
+                    cur.execute(queries.SET_CONFIG, (name, value))
+            except psycopg.errors.InvalidParameterValue as e:
+                self.conn.rollback()
+                raise PetiteError(f"Invalid timeout: {e}") from e
+
+        # Committed so rolling back a failed attempt doesn't undo them
+        self.conn.commit()
+        self.timeouts = timeouts
+
+    def record_baseline(self, name: str, content: MigrationContent) -> None:
+        """Records a baseline as applied without running it"""
+
+        with self.conn.cursor() as cur:
+            cur.execute(queries.START_MIGRATION, (name, content_checksum(content)))
+            cur.execute(queries.FINISH_MIGRATION, (0, 0, name))
+
+        self.conn.commit()
+
+    def apply_migrations(
+        self,
+        migrations: Sequence[Tuple[str, MigrationContent]],
+        no_transaction: bool = False,
+        retry: RetryPolicy = RetryPolicy(),
+    ) -> List[str]:
+        """Applies migration files to the database in order
+
+        Migrations are grouped into batches by the planner. Consecutive
+        migrations that can run in a transaction share one, while ones that
+        can't, either by directive or because they contain statements like
+        CREATE INDEX CONCURRENTLY, run in autocommit mode. With
+        no_transaction every migration runs in autocommit mode.
+
+        Returns the names of the migrations applied. Raises InvalidMigration
+        if a migration can't be applied as written and MigrationError if one
+        fails to apply.
+        """
+
+        try:
+            batches = plan_migrations(migrations, self.iter_statements, no_transaction)
+        except ValueError as e:
+            raise InvalidMigration(str(e)) from e
+
+        applied: List[str] = []
+        for batch in batches:
+            if batch.migrations[0].backfill is not None:
+                self.__apply_backfill(batch.migrations[0], retry, applied)
+            elif batch.migrations[0].python:
+                self.__apply_python(batch.migrations[0], retry, applied)
+            else:
+                self.__apply_batch(batch, retry, applied)
+
+        return applied
+
+    def __apply_batch(
+        self, batch: Batch, retry: RetryPolicy, applied: List[str]
+    ) -> None:
+        """Applies a batch of migrations in a transaction or autocommit mode
+
+        In a transaction every statement of every migration is sent through
+        psycopg's pipeline mode so the whole batch takes a single round trip
+        instead of two per migration. Without a transaction each statement
+        still gets its own round trip since statements batched in a pipeline
+        share an implicit transaction.
+
+        Migrations are opened one at a time and their statements are split
+        and executed lazily so memory use doesn't grow with the size or
+        number of migrations. COPY data, either inline after a COPY ... FROM
+        stdin statement or in a data file next to the migration, is streamed
+        to the database.
+
+        When a lock timeout is hit the whole transaction is retried, or
+        without a transaction just the statement, following the retry
+        policy. The names of the migrations are added to applied once they
+        are committed.
+        """
+
+        migrations = batch.migrations
+        transactional = batch.transactional
+
+        if not transactional:
+            # Need to commit any open transaction before setting autocommit
+            self.conn.commit()
+            self.conn.autocommit = True
+        elif self.conn.autocommit:
+            self.conn.autocommit = False
+
+        start = time.time()
+        started = time.perf_counter()
+
+        for attempt in range(retry.retries + 1):
+            executor = _Executor(self.conn, pipelined=transactional)
+            # Size and statement timings of each migration run so far
+            finished: List[Tuple[int, List[StatementTiming]]] = []
+
+            try:
+                with executor:
+                    for migration_index, migration in enumerate(migrations):
+                        finished.append(
+                            self.__apply_migration(
+                                executor,
+                                migration_index,
+                                migration,
+                                transactional,
+                                retry,
+                            )
+                        )
+
+                    if transactional:
+                        self.conn.commit()
+
+            except Exception as e:
+                failed_migration, failed_statement = executor.find_failure()
+                migration = migrations[failed_migration]
+
+                if (
+                    isinstance(e, psycopg.errors.LockNotAvailable)
+                    and transactional
+                    and attempt < retry.retries
+                ):
+                    # Nothing was committed so the whole transaction can be
+                    # run again once the lock is hopefully free
+                    self.conn.rollback()
+                    self.__wait_for_retry(retry, attempt, migration.name)
+                    continue
+
+                for earlier in migrations[:failed_migration]:
+                    self.progress.applied(earlier.name)
+
+                self.events.emit(
+                    MIGRATION,
+                    name=migration.name,
+                    status="failed",
+                    statement_index=max(failed_statement, 0),
+                    error=str(e).strip(),
+                )
+
+                if transactional:
+                    self.conn.rollback()
+                else:
+                    applied.extend(
+                        earlier.name for earlier in migrations[:failed_migration]
+                    )
+
+                raise MigrationError(
+                    migration.name,
+                    failed_statement if failed_statement >= 0 else None,
+                    applied,
+                    transactional,
+                    str(e).strip(),
+                ) from e
+
+            finally:
+                executor.close()
+
+            break
+
+        if self.events.enabled:
+            self.__emit_batch(
+                batch,
+                finished,
+                start,
+                (time.perf_counter() - started) * 1000,
+                attempt + 1,
+                executor.pipelined,
+            )
+
+        for migration in migrations:
+            self.progress.applied(migration.name)
+            applied.append(migration.name)
+
+    def __apply_migration(
+        self,
+        executor: "_Executor",
+        migration_index: int,
+        migration: PlannedMigration,
+        transactional: bool,
+        retry: RetryPolicy,
+    ) -> Tuple[int, List[StatementTiming]]:
+        """Runs a migration and records it returning its size and timings"""
+
+        executor.execute(
+            (migration_index, -1),
+            queries.START_MIGRATION,
+            (migration.name, content_checksum(migration.content)),
+        )
+
+        # Timeouts from directives only last for their migration
+        overrides = [
+            name for name, value in migration.timeouts._asdict().items() if value
+        ]
+        for name in overrides:
+            executor.execute(
+                (migration_index, -1),
+                queries.SET_CONFIG,
+                (name, getattr(migration.timeouts, name)),
+            )
+
+        with open_content(migration.content) as content:
+            timings = self.__run_statements(
+                executor,
+                migration_index,
+                migration.name,
+                content,
+                content_directory(migration.content),
+                retry if not transactional else RetryPolicy(),
+            )
+            content_size = len(content)
+
+        # A null value resets the setting to the server's
+        for name in overrides:
+            executor.execute(
+                (migration_index, -1),
+                queries.SET_CONFIG,
+                (name, getattr(self.timeouts, name)),
+            )
+
+        executor.execute(
+            (migration_index, -1),
+            queries.FINISH_MIGRATION,
+            (len(timings), content_size, migration.name),
+        )
+
+        if not transactional and timings:
+            executor.execute_many(
+                (migration_index, -1),
+                queries.RECORD_STATEMENT,
+                [
+                    (migration.name, index, *timing)
+                    for index, timing in enumerate(timings)
+                ],
+            )
+
+        return content_size, timings
+
+    def __apply_backfill(
+        self, migration: PlannedMigration, retry: RetryPolicy, applied: List[str]
+    ) -> None:
+        """Runs a backfill migration one chunk of keys at a time
+
+        Each chunk is committed along with the last key done so a backfill
+        that is interrupted carries on after the last committed chunk when
+        applied again. The migration is only recorded as applied once every
+        chunk is done. A lock timeout retries just the chunk.
+        """
+
+        backfill = migration.backfill
+        assert backfill is not None
+
+        start = time.time()
+        started = time.perf_counter()
+        checksum = content_checksum(migration.content)
+
+        with open_content(migration.content) as content:
+            statement = next(iter(self.iter_statements(content)))
+            query = bytes(content[statement.start : statement.end])
+            content_size = len(content)
+
+        # Needs to commit any open transaction before changing autocommit
+        self.conn.commit()
+        self.conn.autocommit = False
+
+        with self.conn.cursor() as cur:
+            cur.execute(queries.BACKFILL_PROGRESS, (migration.name,))
+            progress = cur.fetchone()
+        self.conn.commit()
+
+        if progress is None:
+            last_key, rows, chunks = None, 0, 0
+        else:
+            saved_checksum, last_key, rows, chunks = progress
+            if saved_checksum != checksum:
+                raise InvalidMigration(
+                    f"Backfill migration {migration.name} changed since it was "
+                    "started, restore it or delete its row from the "
+                    "migration_backfill table to start it again"
+                )
+
+            self.progress.resuming_backfill(migration.name, last_key, rows, chunks)
+
+        # Timeouts from directives only last for their migration
+        overrides = [
+            name for name, value in migration.timeouts._asdict().items() if value
+        ]
+        self.__set_config(
+            [(name, getattr(migration.timeouts, name)) for name in overrides]
+        )
+
+        first_chunk = chunk_query(backfill, resuming=False)
+        next_chunk = chunk_query(backfill, resuming=True)
+        walked = 0
+        reported = time.perf_counter()
+
+        try:
+            while True:
+                for attempt in range(retry.retries + 1):
+                    try:
+                        with self.conn.cursor() as cur:
+                            if last_key is None:
+                                cur.execute(first_chunk, (backfill.batch_size,))
+                            else:
+                                cur.execute(next_chunk, (last_key, backfill.batch_size))
+                            first_key, chunk_last_key, size = cur.fetchone()  # type: ignore
+
+                            if not size:
+                                break
+
+                            # $1 and $2 placeholders are passed to the server as is
+                            with psycopg.RawCursor(self.conn) as raw:
+                                raw.execute(query, (first_key, chunk_last_key))
+                                updated = max(raw.rowcount, 0)
+
+                            cur.execute(
+                                queries.SAVE_BACKFILL_PROGRESS,
+                                (
+                                    migration.name,
+                                    checksum,
+                                    chunk_last_key,
+                                    rows + updated,
+                                    chunks + 1,
+                                ),
+                            )
+
+                        self.conn.commit()
+                    except psycopg.errors.LockNotAvailable:
+                        self.conn.rollback()
+                        if attempt == retry.retries:
+                            raise
+
+                        self.__wait_for_retry(retry, attempt, migration.name)
+                    else:
+                        break
+
+                if not size:
+                    self.conn.rollback()
+                    break
+
+                last_key = chunk_last_key
+                rows += updated
+                chunks += 1
+                walked += size
+
+                elapsed = time.perf_counter() - started
+                if time.perf_counter() - reported >= PROGRESS_EVERY:
+                    self.progress.backfill_progress(
+                        migration.name,
+                        rows,
+                        chunks,
+                        last_key,
+                        walked / max(elapsed, 1e-9),
+                    )
+                    reported = time.perf_counter()
+
+                time.sleep(throttle_delay(walked, elapsed, backfill.rows_per_second))
+
+            with self.conn.cursor() as cur:
+                cur.execute(queries.START_MIGRATION, (migration.name, checksum))
+                cur.execute(
+                    queries.FINISH_MIGRATION, (chunks, content_size, migration.name)
+                )
+                cur.execute(
+                    queries.BACKFILL_DURATION,
+                    ((time.perf_counter() - started) * 1000, migration.name),
+                )
+                cur.execute(queries.FINISH_BACKFILL, (migration.name,))
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+
+            self.events.emit(
+                MIGRATION, name=migration.name, status="failed", error=str(e).strip()
+            )
+
+            raise BackfillError(
+                migration.name, applied, last_key, str(e).strip()
+            ) from e
+
+        finally:
+            # A null value resets the setting to the server's
+            self.__set_config(
+                [(name, getattr(self.timeouts, name)) for name in overrides]
+            )
+
+        self.progress.backfilled(migration.name, rows, chunks)
+
+        self.events.emit(
+            MIGRATION,
+            name=migration.name,
+            status="applied",
+            start=start,
+            duration_ms=(time.perf_counter() - started) * 1000,
+            bytes=content_size,
+            statements=chunks,
+            rows=rows,
+            transactional=False,
+        )
+
+        self.progress.applied(migration.name)
+        applied.append(migration.name)
+
+    def __apply_python(
+        self, migration: PlannedMigration, retry: RetryPolicy, applied: List[str]
+    ) -> None:
+        """Runs a Python migration's migrate function in its own transaction
+
+        The migration is recorded in the same transaction so it is either
+        applied and recorded or neither. A lock timeout retries the whole
+        migration following the retry policy.
+        """
+
+        start = time.time()
+        started = time.perf_counter()
+        checksum = content_checksum(migration.content)
+        with open_content(migration.content) as content:
+            content_size = len(content)
+
+        # Needs to commit any open transaction before changing autocommit
+        self.conn.commit()
+        self.conn.autocommit = False
+
+        for attempt in range(retry.retries + 1):
+            context = MigrationContext(self.conn, content_directory(migration.content))
+
+            try:
+                migrate = load_migration(migration.name, migration.content)
+
+                with self.conn.cursor() as cur:
+                    cur.execute(queries.START_MIGRATION, (migration.name, checksum))
+
+                migrate(context)
+
+                with self.conn.cursor() as cur:
+                    cur.execute(
+                        queries.FINISH_MIGRATION,
+                        (context.statements, content_size, migration.name),
+                    )
+
+                self.conn.commit()
+
+            except Exception as e:
+                self.conn.rollback()
+
+                if (
+                    isinstance(e, psycopg.errors.LockNotAvailable)
+                    and attempt < retry.retries
+                ):
+                    self.__wait_for_retry(retry, attempt, migration.name)
+                    continue
+
+                self.events.emit(
+                    MIGRATION,
+                    name=migration.name,
+                    status="failed",
+                    error=str(e).strip(),
+                )
+
+                raise MigrationError(
+                    migration.name, None, applied, True, f"{type(e).__name__}: {e}"
+                ) from e
+
+            break
+
+        self.events.emit(
+            MIGRATION,
+            name=migration.name,
+            status="applied",
+            start=start,
+            duration_ms=(time.perf_counter() - started) * 1000,
+            bytes=content_size,
+            statements=context.statements,
+            transactional=True,
+        )
+
+        self.progress.applied(migration.name)
+        applied.append(migration.name)
+
+    def __set_config(self, settings: List[Tuple[str, Optional[str]]]) -> None:
+        """Sets settings for the rest of the session"""
+
+        if not settings:
+            return
+
+        with self.conn.cursor() as cur:
+            for name, value in settings:
+                cur.execute(queries.SET_CONFIG, (name, value))
+
+        self.conn.commit()
+
+    def __emit_batch(
+        self,
+        batch: Batch,
+        finished: List[Tuple[int, List[StatementTiming]]],
+        start: float,
+        duration_ms: float,
+        attempts: int,
+        pipelined: bool,
+    ) -> None:
+        """Emits events for a batch once its migrations are committed
+
+        Migration durations are the ones recorded by the server since in a
+        pipeline statements are only queued on the client. For the same
+        reason statement durations are left out of pipelined batches. Start
+        times are laid out one after another from the start of the batch.
+        """
+
+        self.events.emit(
+            BATCH,
+            start=start,
+            duration_ms=duration_ms,
+            transactional=batch.transactional,
+            migrations=len(batch.migrations),
+            attempts=attempts,
+        )
+
+        durations = self.get_migration_durations(
+            [migration.name for migration in batch.migrations]
+        )
+
+        migration_start = start
+        for migration, (size, timings) in zip(batch.migrations, finished):
+            migration_duration = durations.get(migration.name)
+
+            self.events.emit(
+                MIGRATION,
+                name=migration.name,
+                status="applied",
+                start=migration_start,
+                duration_ms=migration_duration,
+                bytes=size,
+                statements=len(timings),
+                transactional=batch.transactional,
+            )
+
+            statement_start = migration_start
+            for index, timing in enumerate(timings):
+                self.events.emit(
+                    STATEMENT,
+                    migration=migration.name,
+                    index=index,
+                    kind=timing.kind,
+                    start=None if pipelined else statement_start,
+                    duration_ms=None if pipelined else timing.duration_ms,
+                    bytes=timing.bytes,
+                )
+                statement_start += timing.duration_ms / 1000
+
+            migration_start += (migration_duration or 0) / 1000
+
+    def __run_statements(
+        self,
+        executor: "_Executor",
+        migration_index: int,
+        migration_name: str,
+        content: Buffer,
+        directory: Optional[Path],
+        retry: RetryPolicy,
+    ) -> List[StatementTiming]:
+        """Runs every statement in a migration's content
+
+        Returns the timing of every statement. The durations are only
+        accurate without a pipeline since otherwise statements are only
+        queued. Statements hitting a lock timeout are retried following the
+        retry policy.
+        """
+
+        timings = []
+        released = 0
+
+        for statement_index, statement in enumerate(self.iter_statements(content)):
+            position = (migration_index, statement_index)
+            query = content[statement.start : statement.end]
+            start = time.perf_counter()
+
+            if statement.copy_data is not None:
+                rows = executor.copy(
+                    position,
+                    query,
+                    iter_content_chunks(content, *statement.copy_data),
+                )
+            elif statement.kind == "COPY" and (
+                sidecar := sidecar_copy(query, directory)
+            ):
+                query, data_path = sidecar
+                rows = executor.copy(position, query, iter_file_chunks(data_path))
+            else:
+                for attempt in range(retry.retries + 1):
+                    try:
+                        executor.execute(position, query)
+                    except psycopg.errors.LockNotAvailable:
+                        if attempt == retry.retries:
+                            raise
+
+                        self.__wait_for_retry(retry, attempt, migration_name)
+                    else:
+                        break
+
+                rows = None
+
+            if rows is not None:
+                self.progress.copied(migration_name, rows)
+
+            end = (
+                statement.copy_data[1]
+                if statement.copy_data is not None
+                else statement.end
+            )
+            timings.append(
+                StatementTiming(
+                    statement.kind,
+                    (time.perf_counter() - start) * 1000,
+                    end - statement.start,
+                )
+            )
+
+            if end - released >= RELEASE_EVERY:
+                release_pages(content, end)
+                released = end
+
+        return timings
+
+    def __wait_for_retry(
+        self, retry: RetryPolicy, attempt: int, migration_name: str
+    ) -> None:
+        """Reports a lock timeout and sleeps before the next attempt"""
+
+        delay = retry.delay(attempt)
+        self.events.emit(
+            RETRY,
+            migration=migration_name,
+            attempt=attempt + 1,
+            delay_s=delay,
+        )
+        self.progress.retrying(migration_name, attempt, retry.retries, delay)
+        time.sleep(delay)
+
+    def iter_statements(self, content: Buffer) -> Iterable[Statement]:
+        """Finds the statements in a migration's content
+
+        Statements are sliced out of the original content so they are sent
+        to the database exactly as written. Large migrations are split
+        lazily and skip the cache so their statements never have to be held
+        in memory at once.
+        """
+
+        if self.cache is not None and len(content) <= CACHE_MAX_CONTENT:
+            return self.cache.split(content)
+
+        return iter_statements(content)
+
+
+class _Executor:
+    """Runs the statements of an apply keeping track of where each came from
+
+    When pipelined, statements are queued in psycopg's pipeline mode which
+    is paused around COPY statements since they can't be pipelined.
+
+    Each statement is run on its own cursor. Cursors are given their results
+    in the order they were executed and the failing statement along with
+    everything queued after it never gets one, which is how the failing
+    statement is found when an error surfaces later in the pipeline.
+    """
+
+    def __init__(self, conn: psycopg.Connection, pipelined: bool) -> None:
+        self.conn = conn
+        self.pipelined = pipelined and psycopg.Pipeline.is_supported()
+        # Migration and statement index of the last statement run
+        self.position = (0, -1)
+        self.executed: List[Tuple[int, int, psycopg.Cursor]] = []
+        self._pipeline: Optional[psycopg.Pipeline] = None
+        self._pipeline_stack = ExitStack()
+
+    def __enter__(self) -> "_Executor":
+        self.resume()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._pipeline = None
+        self._pipeline_stack.__exit__(*exc_info)
+
+    def resume(self) -> None:
+        """Starts queuing statements in a pipeline if pipelined"""
+
+        if self.pipelined and self._pipeline is None:
+            self._pipeline = self._pipeline_stack.enter_context(self.conn.pipeline())
+
+    def pause(self) -> None:
+        """Leaves the pipeline waiting for the results of queued statements"""
+
+        if self._pipeline is not None:
+            self._pipeline = None
+            self._pipeline_stack.close()
+
+        self.settle()
+
+    def execute(
+        self,
+        position: Tuple[int, int],
+        query: Union[str, bytes],
+        params: Optional[Tuple] = None,
+    ) -> None:
+        """Executes a query on its own cursor recording where it came from"""
+
+        self.position = position
+
+        cur = self.conn.cursor()
+        self.executed.append((*position, cur))
+        cur.execute(query, params)
+
+        self.__after_execute()
+
+    def execute_many(
+        self,
+        position: Tuple[int, int],
+        query: str,
+        params_seq: Sequence[Tuple],
+    ) -> None:
+        """Executes a query once for each set of parameters"""
+
+        self.position = position
+
+        cur = self.conn.cursor()
+        self.executed.append((*position, cur))
+        cur.executemany(query, params_seq)
+
+        self.__after_execute()
+
+    def copy(
+        self, position: Tuple[int, int], query: bytes, chunks: Iterable[bytes]
+    ) -> CopyResult:
+        """Streams data to the database through a COPY ... FROM stdin query"""
+
+        self.position = position
+        self.pause()
+
+        start = time.perf_counter()
+
+        cur = self.conn.cursor()
+        self.executed.append((*position, cur))
+
+        with cur.copy(query) as copy:
+            for chunk in chunks:
+                copy.write(chunk)
+
+        result = CopyResult(cur.rowcount, time.perf_counter() - start)
+
+        self.settle()
+        self.resume()
+
+        return result
+
+    def __after_execute(self) -> None:
+        # Outside a pipeline a statement has succeeded once it returns so
+        # there's nothing left to track
+        if self._pipeline is None:
+            self.close()
+        elif len(self.executed) >= SYNC_EVERY:
+            self.settle()
+
+    def settle(self) -> None:
+        """Waits for the results of executed statements then forgets them
+
+        Keeps the number of cursors held at once bounded on large runs.
+        """
+
+        if self._pipeline is not None:
+            self._pipeline.sync()
+
+        self.close()
+
+    def close(self) -> None:
+        """Closes the cursors of executed statements"""
+
+        for _, _, cur in self.executed:
+            cur.close()
+
+        self.executed.clear()
+
+    def find_failure(self) -> Tuple[int, int]:
+        """Finds the migration and statement index of the failed statement
+
+        A statement index of -1 means the migration failed to be recorded in
+        the migration table.
+        """
+
+        for migration_index, statement_index, cur in self.executed:
+            if cur.pgresult is None:
+                return migration_index, statement_index
+
+        # Nothing is left waiting on a result so it was the last one run
+        return self.position
@@ -0,0 +1,92 @@
+"""Works out which migrations a database still needs from what it applied"""
+
+from bisect import bisect_left
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from .file_system import MIGRATION_SUFFIXES
+from .squash import baseline_name, find_baseline
+
+BASELINE_SUFFIX = "_baseline.sql"
+
+
+class Pending(NamedTuple):
+    """Migrations in a directory that haven't been applied to a database"""
+
+    last_applied: Optional[str]
+    # Unapplied migrations after the last applied one
+    pending: List[str]
+    # Unapplied migrations before the last applied one, usually from a
+    # branch merged after newer migrations were applied
+    out_of_order: List[str]
+    # Baselines replacing migrations that are already applied, recorded
+    # rather than run
+    baselines: List[str]
+    # Whether the last applied migration is missing from the directory
+    # without a baseline replacing it
+    diverged: bool
+
+
+def diff_migrations(
+    files: Sequence[str], applied: Sequence[str]
+) -> Tuple[List[str], List[str]]:
+    """Finds the files that aren't applied, split around the last applied one
+
+    Both lists have to be sorted the same way. They are walked together
+    once so the cost is linear in their lengths. Applied migrations missing
+    from the files, like squashed ones, are skipped over.
+    """
+
+    out_of_order = []
+    i = j = 0
+
+    while i < len(files) and j < len(applied):
+        if files[i] == applied[j]:
+            i += 1
+            j += 1
+        elif files[i] < applied[j]:
+            out_of_order.append(files[i])
+            i += 1
+        else:
+            j += 1
+
+    # Whatever is left sorts after every applied migration
+    return out_of_order, list(files[i:])
+
+
+def find_pending(
+    migrations_directory: Path, files: Sequence[str], applied: Sequence[str]
+) -> Pending:
+    """Compares the sorted migration files with the sorted applied migrations"""
+
+    last_applied = applied[-1] if applied else None
+    out_of_order, pending = diff_migrations(files, applied)
+
+    baselines = []
+    candidates = [
+        name for name in out_of_order + pending if name.endswith(BASELINE_SUFFIX)
+    ]
+    if candidates:
+        applied_names = set(applied)
+        for name in candidates:
+            stem = name.removesuffix(BASELINE_SUFFIX)
+            # The migration it covers can be SQL or Python
+            for suffix in MIGRATION_SUFFIXES:
+                covers = stem + suffix
+                if covers in applied_names and find_baseline(
+                    migrations_directory, [name], covers
+                ):
+                    baselines.append(name)
+                    break
+
+        out_of_order = [name for name in out_of_order if name not in baselines]
+        pending = [name for name in pending if name not in baselines]
+
+    diverged = False
+    if last_applied is not None:
+        index = bisect_left(files, last_applied)
+        diverged = (
+            index == len(files) or files[index] != last_applied
+        ) and baseline_name(last_applied) not in baselines
+
+    return Pending(last_applied, pending, out_of_order, baselines, diverged)
@@ -0,0 +1,133 @@
+"""Groups migrations into the transactions they are applied in"""
+
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .backfill import Backfill
+from .directives import parse_directives
+from .file_system import (
+    RELEASE_EVERY,
+    Buffer,
+    MigrationContent,
+    is_python_migration,
+    open_content,
+    release_pages,
+)
+from .splitter import Statement
+from .timeouts import Timeouts
+
+
+class PlannedMigration(NamedTuple):
+    name: str
+    content: MigrationContent
+    # Timeouts the migration's directives ask for
+    timeouts: Timeouts
+    backfill: Optional[Backfill] = None
+    # Runs the migrate function of a .py file instead of statements
+    python: bool = False
+
+
+class Batch(NamedTuple):
+    """Consecutive migrations applied the same way
+
+    Transactional batches are applied in a single transaction while the
+    others are applied in autocommit mode one statement at a time. A
+    backfill or Python migration is always in a batch of its own.
+    """
+
+    transactional: bool
+    migrations: List[PlannedMigration]
+
+
+def plan_migrations(
+    migrations: Sequence[Tuple[str, MigrationContent]],
+    split: Callable[[Buffer], Iterable[Statement]],
+    no_transaction: bool = False,
+) -> List[Batch]:
+    """Works out how each migration should be applied
+
+    A migration's transaction directive decides if it runs in a transaction.
+    Without one it does unless it contains a statement PostgreSQL refuses to
+    run in a transaction block, like CREATE INDEX CONCURRENTLY. Consecutive
+    migrations that can share a transaction are grouped together so only
+    the ones that need it run in autocommit mode. With no_transaction every
+    migration runs in autocommit mode. Backfill migrations commit each chunk
+    on their own so never share a batch. Python migrations have no
+    directives and always run in a transaction of their own.
+
+    Raises ValueError if a migration has invalid directives or a backfill
+    migration doesn't have exactly one statement.
+    """
+
+    batches: List[Batch] = []
+
+    for name, migration_content in migrations:
+        if is_python_migration(name):
+            batches.append(
+                Batch(
+                    True,
+                    [
+                        PlannedMigration(
+                            name, migration_content, Timeouts(), python=True
+                        )
+                    ],
+                )
+            )
+            continue
+
+        with open_content(migration_content) as content:
+            try:
+                directives = parse_directives(content)
+            except ValueError as e:
+                raise ValueError(f"Invalid directive in migration {name}: {e}")
+
+            if directives.backfill is not None:
+                if sum(1 for _ in split(content)) != 1:
+                    raise ValueError(
+                        f"Backfill migration {name} must have exactly one statement"
+                    )
+                transactional = False
+            elif no_transaction:
+                transactional = False
+            elif directives.transaction is not None:
+                transactional = directives.transaction
+            else:
+                transactional = _all_transactional(content, split(content))
+
+        migration = PlannedMigration(
+            name, migration_content, directives.timeouts, directives.backfill
+        )
+
+        if (
+            batches
+            and batches[-1].transactional == transactional
+            and migration.backfill is None
+            and batches[-1].migrations[-1].backfill is None
+            and not batches[-1].migrations[-1].python
+        ):
+            batches[-1].migrations.append(migration)
+        else:
+            batches.append(Batch(transactional, [migration]))
+
+    return batches
+
+
+def _all_transactional(content: Buffer, statements: Iterable[Statement]) -> bool:
+    """Checks every statement can run in a transaction
+
+    Pages of memory mapped content are released as the scan passes them,
+    the same as while applying, so planning a large migration doesn't
+    leave all of it resident.
+    """
+
+    released = 0
+
+    for statement in statements:
+        if not statement.transactional:
+            return False
+
+        end = statement.copy_data[1] if statement.copy_data else statement.end
+        if end - released >= RELEASE_EVERY:
+            release_pages(content, end)
+            released = end
+
+    return True
@@ -0,0 +1,146 @@
+"""Migrations written in Python for data changes SQL can't express well
+
+A Python migration is a .py file in the migrations directory defining a
+migrate function. It's ordered and recorded like any other migration and is
+called with a MigrationContext whose connection is inside the transaction
+the migration is recorded in:
+
+    def migrate(ctx):
+        rows = ctx.stream("SELECT id, name FROM users")
+        ctx.copy_in(
+            "COPY user_slug (user_id, slug) FROM STDIN",
+            ((id, slugify(name)) for id, name in rows),
+        )
+
+The migration shouldn't commit or roll back itself. Raising an exception
+rolls back everything it did.
+"""
+
+from itertools import islice
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+import psycopg
+
+from .file_system import MigrationContent, content_directory, open_content
+
+# Rows fetched from the server at a time by stream
+STREAM_BATCH_SIZE = 10000
+
+
+class MigrationContext:
+    """What a Python migration's migrate function is called with"""
+
+    def __init__(self, conn: psycopg.Connection, directory: Optional[Path]) -> None:
+        # Inside the migration's transaction
+        self.conn = conn
+        # Directory the migration is in, for reading data files next to it
+        self.directory = directory
+        # Queries run through the helpers, recorded as the statement count
+        self.statements = 0
+
+    def execute(self, query: Any, params: Optional[Any] = None) -> psycopg.Cursor:
+        """Runs a query returning the cursor to fetch its results from"""
+
+        self.statements += 1
+        return self.conn.execute(query, params)
+
+    def executemany(self, query: Any, params_seq: Iterable[Any]) -> None:
+        """Runs a query once for each set of parameters
+
+        psycopg sends them all in a pipeline so it takes one round trip
+        rather than one each.
+        """
+
+        self.statements += 1
+        with self.conn.cursor() as cur:
+            cur.executemany(query, params_seq)
+
+    def stream(
+        self,
+        query: Any,
+        params: Optional[Any] = None,
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> Iterator[Tuple]:
+        """Yields the rows of a query through a server side cursor
+
+        Rows are fetched batch_size at a time so results larger than memory
+        can be read.
+        """
+
+        self.statements += 1
+        with self.conn.cursor(name=f"petite_stream_{self.statements}") as cur:
+            cur.itersize = batch_size
+            cur.execute(query, params)
+            yield from cur
+
+    def copy_in(
+        self,
+        statement: Any,
+        rows: Iterable[Sequence[Any]],
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> int:
+        """Streams rows into a COPY ... FROM STDIN statement
+
+        The statement is run once for every batch_size rows since nothing
+        else can use the connection while a COPY is running. This lets rows
+        come from stream on the same connection. Returns the number of rows
+        copied.
+        """
+
+        self.statements += 1
+        rows = iter(rows)
+        copied = 0
+
+        with self.conn.cursor() as cur:
+            while batch := list(islice(rows, batch_size)):
+                with cur.copy(statement) as copy:
+                    for row in batch:
+                        copy.write_row(row)
+
+                copied += cur.rowcount
+
+        return copied
+
+    def copy_out(
+        self, statement: Any, types: Optional[Sequence[str]] = None
+    ) -> Iterator[Tuple]:
+        """Yields the rows of a COPY ... TO STDOUT statement
+
+        Values are strings unless the names of their PostgreSQL types are
+        given to convert them. The connection can't run anything else until
+        every row has been read.
+        """
+
+        self.statements += 1
+        with self.conn.cursor() as cur:
+            with cur.copy(statement) as copy:
+                if types is not None:
+                    copy.set_types(types)
+                yield from copy.rows()
+
+
+def load_migration(
+    name: str, content: MigrationContent
+) -> Callable[[MigrationContext], Any]:
+    """Runs a Python migration's module returning its migrate function
+
+    Raises ValueError if it doesn't define one.
+    """
+
+    with open_content(content) as source:
+        code = bytes(source)
+
+    directory = content_directory(content)
+    filename = str(directory / name) if directory is not None else name
+
+    module = ModuleType(f"petite_migration_{Path(name).stem}")
+    module.__file__ = filename
+    exec(compile(code, filename, "exec"), module.__dict__)
+
+    migrate = getattr(module, "migrate", None)
+    if not callable(migrate):
+        raise ValueError(f"Python migration {name} doesn't define migrate(ctx)")
+
+    return migrate
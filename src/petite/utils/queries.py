@@ -0,0 +1,163 @@
+"""SQL shared by the synchronous and asyncio database classes"""
+
+# Version of the bookkeeping tables, stored in the migration_metadata row.
+# Bump it and add an upgrade whenever the tables change.
+SCHEMA_VERSION = 2
+
+# Each upgrade brings the tables from the version at its index to the next
+SCHEMA_UPGRADES = [
+    # 0 to 1: The original migration table
+    """
+    CREATE TABLE migration (
+        id SERIAL PRIMARY KEY,
+        file_name VARCHAR(255) UNIQUE NOT NULL,
+        run_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # 1 to 2: Checksums, timings, indexes, backfill progress and the
+    # metadata row. Tables made by earlier releases may already have some
+    # of the columns.
+    """
+    ALTER TABLE migration ADD COLUMN IF NOT EXISTS checksum CHAR(64);
+    ALTER TABLE migration ADD COLUMN IF NOT EXISTS duration_ms DOUBLE PRECISION;
+    ALTER TABLE migration ADD COLUMN IF NOT EXISTS statement_count INTEGER;
+    ALTER TABLE migration ADD COLUMN IF NOT EXISTS bytes BIGINT;
+
+    CREATE INDEX IF NOT EXISTS migration_duration_ms_idx
+        ON migration (duration_ms DESC NULLS LAST);
+    -- Orders names bytewise like the migrations directory whatever the
+    -- database's collation, for finding the last applied migration
+    CREATE INDEX IF NOT EXISTS migration_file_name_c_idx
+        ON migration (file_name COLLATE "C");
+
+    -- Timings of each statement of migrations applied without a transaction
+    CREATE TABLE IF NOT EXISTS migration_statement (
+        file_name VARCHAR(255) NOT NULL
+            REFERENCES migration (file_name) ON DELETE CASCADE,
+        statement_index INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        duration_ms DOUBLE PRECISION NOT NULL,
+        bytes BIGINT NOT NULL,
+        PRIMARY KEY (file_name, statement_index)
+    );
+    CREATE INDEX IF NOT EXISTS migration_statement_duration_ms_idx
+        ON migration_statement (duration_ms DESC);
+
+    -- Progress of backfill migrations that haven't finished. Rows are
+    -- removed once the migration is recorded as applied.
+    CREATE TABLE IF NOT EXISTS migration_backfill (
+        file_name VARCHAR(255) PRIMARY KEY,
+        checksum CHAR(64) NOT NULL,
+        last_key TEXT NOT NULL,
+        rows BIGINT NOT NULL,
+        chunks INTEGER NOT NULL,
+        updated_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- A single row holding the schema version
+    CREATE TABLE IF NOT EXISTS migration_metadata (
+        singleton BOOLEAN PRIMARY KEY DEFAULT true CHECK (singleton),
+        schema_version INTEGER NOT NULL,
+        updated_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO migration_metadata (schema_version) VALUES (2)
+    ON CONFLICT DO NOTHING;
+    """,
+]
+
+# Which of the bookkeeping tables exist, used to work out the version of
+# tables made before the metadata row existed
+SCHEMA_TABLES = """
+SELECT
+    to_regclass('migration') IS NOT NULL,
+    to_regclass('migration_metadata') IS NOT NULL
+"""
+
+# No row means the metadata row was deleted so it's treated as version 1
+SCHEMA_VERSION_QUERY = """
+SELECT COALESCE((SELECT schema_version FROM migration_metadata), 1)
+"""
+
+SET_SCHEMA_VERSION = """
+UPDATE migration_metadata SET schema_version = %s, updated_on = CURRENT_TIMESTAMP
+"""
+
+# Serialises upgrades of the bookkeeping tables until the transaction ends
+SCHEMA_LOCK = "SELECT pg_advisory_xact_lock(%s)"
+
+# The schema version along with the whole row of the last applied
+# migration. Names are compared bytewise, the same as the sorted applied
+# migrations and the directory, and served by the C collated index. The
+# migration columns are null when nothing has been applied.
+LAST_APPLIED_MIGRATION = """
+SELECT meta.schema_version, migration.*
+FROM migration_metadata meta
+LEFT JOIN LATERAL (
+    SELECT * FROM migration ORDER BY file_name COLLATE "C" DESC LIMIT 1
+) migration ON true
+"""
+
+# The name of every applied migration. Only the migration table is read so
+# it works with tables made by any version. Names are left unsorted as
+# sorting them bytewise in the database can't use the file_name index, so
+# callers sort them like the migrations directory.
+APPLIED_MIGRATION_NAMES = "SELECT ARRAY(SELECT file_name FROM migration)"
+
+# The schema version along with the names of every applied migration
+APPLIED_MIGRATIONS = """
+SELECT meta.schema_version, ARRAY(SELECT file_name FROM migration)
+FROM migration_metadata meta
+"""
+
+# Key of the advisory lock held while applying migrations so concurrent runs
+# against the same database take turns
+MIGRATION_LOCK_KEY = 0x7065746974650001
+
+TRY_MIGRATION_LOCK = "SELECT pg_try_advisory_lock(%s)"
+MIGRATION_LOCK = "SELECT pg_advisory_lock(%s)"
+MIGRATION_UNLOCK = "SELECT pg_advisory_unlock(%s)"
+
+SET_CONFIG = "SELECT set_config(%s, %s, false)"
+
+# run_on is set to when the migration started rather than when the
+# transaction did so the duration can be worked out on the server without
+# waiting on any results
+START_MIGRATION = """
+INSERT INTO migration (file_name, checksum, run_on)
+VALUES (%s, %s, clock_timestamp())
+"""
+
+FINISH_MIGRATION = """
+UPDATE migration SET
+    duration_ms = EXTRACT(EPOCH FROM clock_timestamp() - run_on) * 1000,
+    statement_count = %s,
+    bytes = %s
+WHERE file_name = %s
+"""
+
+BACKFILL_PROGRESS = """
+SELECT checksum, last_key, rows, chunks FROM migration_backfill
+WHERE file_name = %s
+"""
+
+SAVE_BACKFILL_PROGRESS = """
+INSERT INTO migration_backfill (file_name, checksum, last_key, rows, chunks)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (file_name) DO UPDATE SET
+    last_key = EXCLUDED.last_key,
+    rows = EXCLUDED.rows,
+    chunks = EXCLUDED.chunks,
+    updated_on = CURRENT_TIMESTAMP
+"""
+
+FINISH_BACKFILL = "DELETE FROM migration_backfill WHERE file_name = %s"
+
+# Backfills are only recorded once done so their duration is measured by
+# the client, and only covers this run when resumed
+BACKFILL_DURATION = "UPDATE migration SET duration_ms = %s WHERE file_name = %s"
+
+RECORD_STATEMENT = """
+INSERT INTO migration_statement
+    (file_name, statement_index, kind, duration_ms, bytes)
+VALUES (%s, %s, %s, %s, %s)
+"""
@@ -0,0 +1,285 @@
+"""Single pass PostgreSQL aware splitter for migration files"""
+
+import re
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# Bump whenever a change to this module could change the statements or
+# classifications it produces for the same content. Cached results are
+# keyed on it.
+PARSER_VERSION = 1
+
+# Characters that can start something the splitter has to step over or
+# that ends a statement. Everything between two of these is plain SQL.
+_SPECIAL = re.compile(rb"[;'\"$]|--|/\*")
+_NON_SPACE = re.compile(rb"\S")
+_BLOCK_COMMENT = re.compile(rb"/\*|\*/")
+
+# Bodies of quoted text starting right after the opening quote. Doubled
+# quotes are escapes and E'' strings also allow backslash escapes. Written
+# unrolled so each byte can only be matched one way, otherwise an
+# unterminated quote backtracks exponentially.
+_STRING_BODY = re.compile(rb"[^']*(?:''[^']*)*'")
+_ESCAPE_STRING_BODY = re.compile(rb"[^'\\]*(?:(?:\\.|'')[^'\\]*)*'", re.S)
+_IDENTIFIER_BODY = re.compile(rb'[^"]*(?:""[^"]*)*"')
+
+# A dollar quote tag can't start with a digit so $1 style parameters don't
+# match
+_DOLLAR_TAG = re.compile(rb"\$(?:[A-Za-z_\x80-\xff][A-Za-z0-9_\x80-\xff]*)?\$")
+
+_COPY_FROM_STDIN = re.compile(rb"COPY\b.*\bFROM\s+STDIN\b", re.I | re.S)
+_COPY_DATA_END = re.compile(rb"^\\\.\r?$", re.M)
+
+_KEYWORD = re.compile(rb"[A-Za-z_]+")
+# Only the start of a statement is needed to classify it
+_CLASSIFY_PREFIX = 1024
+
+# Words that can come between CREATE/ALTER/DROP and the type of object
+_OBJECT_MODIFIERS = frozenset(
+    [
+        b"OR",
+        b"REPLACE",
+        b"UNIQUE",
+        b"TEMP",
+        b"TEMPORARY",
+        b"UNLOGGED",
+        b"GLOBAL",
+        b"LOCAL",
+        b"RECURSIVE",
+        b"TRUSTED",
+        b"PROCEDURAL",
+        b"CONSTRAINT",
+        b"DEFAULT",
+    ]
+)
+_TWO_WORD_OBJECTS = frozenset(
+    [b"MATERIALIZED", b"FOREIGN", b"EVENT", b"TEXT", b"ACCESS"]
+)
+
+# Statements PostgreSQL refuses to run inside a transaction block
+_NON_TRANSACTIONAL = re.compile(
+    rb"""
+    (?:CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY
+    |DROP\s+INDEX\s+CONCURRENTLY
+    |REINDEX\b(?:[^;]*\bCONCURRENTLY\b|\s+(?:DATABASE|SYSTEM)\b)
+    |ALTER\s+TABLE\b[^;]*\bDETACH\s+PARTITION\b[^;]*\bCONCURRENTLY\b
+    |VACUUM\b
+    |CREATE\s+DATABASE\b
+    |DROP\s+DATABASE\b
+    |CREATE\s+TABLESPACE\b
+    |DROP\s+TABLESPACE\b
+    |ALTER\s+SYSTEM\b
+    |CREATE\s+SUBSCRIPTION\b
+    |DROP\s+SUBSCRIPTION\b
+    |ALTER\s+DATABASE\b[^;]*\bSET\s+TABLESPACE\b
+    )
+    """,
+    re.I | re.S | re.X,
+)
+
+_IDENTIFIER_CHARS = frozenset(
+    b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$"
+    + bytes(range(0x80, 0x100))
+)
+_WHITESPACE = frozenset(b" \t\n\r\f\v")
+
+
+class Statement(NamedTuple):
+    """Location of a single statement in a migration file
+
+    Offsets are byte offsets into the original content with the end being
+    exclusive and not including the terminating semicolon.
+    """
+
+    start: int
+    end: int
+    # Command the statement runs, like INSERT or CREATE INDEX
+    kind: str
+    # If PostgreSQL allows the statement inside a transaction block
+    transactional: bool = True
+    # Byte range of the data following a COPY ... FROM stdin statement,
+    # excluding the terminating \\. line
+    copy_data: Optional[Tuple[int, int]] = None
+
+
+def split_statements(content: bytes) -> List[Statement]:
+    """Splits migration content into the statements it contains"""
+
+    return list(iter_statements(content))
+
+
+def iter_statements(content: bytes) -> Iterator[Statement]:
+    """Lazily yields the statements in migration content
+
+    Content is scanned once. Semicolons inside strings, quoted identifiers,
+    dollar quoted bodies, comments and COPY data don't end a statement.
+    Statements made up of only whitespace and comments are skipped.
+    """
+
+    length = len(content)
+    pos = 0
+    # Offset of the first non comment byte of the current statement
+    statement_start: Optional[int] = None
+
+    while pos < length:
+        match = _SPECIAL.search(content, pos)
+        special_start = match.start() if match else length
+
+        if statement_start is None:
+            code = _NON_SPACE.search(content, pos, special_start)
+            if code:
+                statement_start = code.start()
+
+        if match is None:
+            break
+
+        token = match.group()
+
+        if token == b";":
+            if statement_start is not None:
+                statement = _make_statement(content, statement_start, special_start)
+                pos = special_start + 1
+
+                if _COPY_FROM_STDIN.match(content, statement.start, statement.end):
+                    statement, pos = _read_copy_data(content, statement, pos)
+
+                yield statement
+                statement_start = None
+            else:
+                pos = special_start + 1
+
+        elif token == b"--":
+            newline = content.find(b"\n", special_start)
+            pos = length if newline == -1 else newline + 1
+
+        elif token == b"/*":
+            pos = _skip_block_comment(content, special_start)
+
+        else:
+            if statement_start is None:
+                statement_start = special_start
+
+            if token == b"$":
+                pos = _skip_dollar_quote(content, special_start)
+            elif token == b'"':
+                pos = _skip_quoted(content, special_start, _IDENTIFIER_BODY)
+            elif _is_escape_string(content, special_start):
+                pos = _skip_quoted(content, special_start, _ESCAPE_STRING_BODY)
+            else:
+                pos = _skip_quoted(content, special_start, _STRING_BODY)
+
+    if statement_start is not None:
+        yield _make_statement(content, statement_start, length)
+
+
+def classify_statement(statement: bytes) -> Tuple[str, bool]:
+    """Works out the kind of a statement and if it can run in a transaction
+
+    Only the leading keywords are looked at so this is cheap but it can't
+    see through things like DO blocks.
+    """
+
+    words = [word.upper() for word in _KEYWORD.findall(statement)[:5]]
+    if not words:
+        return "", True
+
+    kind = [words[0]]
+    if words[0] in (b"CREATE", b"ALTER", b"DROP", b"COMMENT"):
+        objects = [word for word in words[1:] if word not in _OBJECT_MODIFIERS]
+        if objects:
+            kind.append(objects[0])
+            if objects[0] in _TWO_WORD_OBJECTS and len(objects) > 1:
+                kind.append(objects[1])
+
+    return (
+        b" ".join(kind).decode("ascii"),
+        _NON_TRANSACTIONAL.match(statement) is None,
+    )
+
+
+def _make_statement(content: bytes, start: int, end: int) -> Statement:
+    while end > start and content[end - 1] in _WHITESPACE:
+        end -= 1
+
+    kind, transactional = classify_statement(
+        content[start : min(end, start + _CLASSIFY_PREFIX)]
+    )
+
+    return Statement(start, end, kind, transactional)
+
+
+def _read_copy_data(
+    content: bytes, statement: Statement, pos: int
+) -> Tuple[Statement, int]:
+    """Finds the data following a COPY ... FROM stdin statement
+
+    As in psql the data starts on the line after the statement and ends
+    with a line containing only \\.
+    """
+
+    newline = content.find(b"\n", pos)
+    if newline == -1:
+        return statement._replace(copy_data=(len(content), len(content))), len(content)
+
+    data_start = newline + 1
+    data_end = _COPY_DATA_END.search(content, data_start)
+
+    if data_end is None:
+        return statement._replace(copy_data=(data_start, len(content))), len(content)
+
+    return (
+        statement._replace(copy_data=(data_start, data_end.start())),
+        data_end.end(),
+    )
+
+
+def _skip_block_comment(content: bytes, start: int) -> int:
+    """Returns the offset after a possibly nested block comment"""
+
+    depth = 0
+    pos = start
+
+    while True:
+        match = _BLOCK_COMMENT.search(content, pos)
+        if match is None:
+            return len(content)
+
+        depth += 1 if match.group() == b"/*" else -1
+        pos = match.end()
+
+        if depth == 0:
+            return pos
+
+
+def _skip_quoted(content: bytes, start: int, body: "re.Pattern[bytes]") -> int:
+    """Returns the offset after the quoted text opened at start"""
+
+    match = body.match(content, start + 1)
+    return len(content) if match is None else match.end()
+
+
+def _skip_dollar_quote(content: bytes, start: int) -> int:
+    """Returns the offset after a dollar quoted body opened at start
+
+    Dollar signs that don't open a dollar quote, like parameters or ones
+    inside identifiers, are stepped over.
+    """
+
+    if start > 0 and content[start - 1] in _IDENTIFIER_CHARS:
+        return start + 1
+
+    tag = _DOLLAR_TAG.match(content, start)
+    if tag is None:
+        return start + 1
+
+    close = content.find(tag.group(), tag.end())
+    return len(content) if close == -1 else close + len(tag.group())
+
+
+def _is_escape_string(content: bytes, quote: int) -> bool:
+    """Checks if the string opened at quote is an E'' string"""
+
+    return (
+        quote > 0
+        and content[quote - 1] in b"eE"
+        and (quote == 1 or content[quote - 2] not in _IDENTIFIER_CHARS)
+    )
@@ -0,0 +1,187 @@
+"""Collapses old migrations into a single baseline migration"""
+
+import os
+import random
+import re
+import shutil
+import string
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+from .directives import parse_directives
+from .file_system import (
+    ARCHIVE_DIRECTORY,
+    FileSystem,
+    list_migration_files,
+    migration_stem,
+    open_content,
+)
+from .templates import database_uri, drop_database
+
+# Bookkeeping tables that are left out of baselines
+_BOOKKEEPING_TABLES = [
+    "migration",
+    "migration_id_seq",
+    "migration_statement",
+    "migration_backfill",
+    "migration_metadata",
+]
+
+# Settings pg_dump changes for the session that would leak into the
+# migrations applied after the baseline. Timeouts are dropped so petite's
+# own are kept and the empty search path would break later migrations.
+_DROPPED_SETTINGS = re.compile(
+    rb"^(?:SET (?:statement_timeout|lock_timeout|idle_in_transaction_session_timeout"
+    rb"|transaction_timeout) = .*"
+    rb"|SELECT pg_catalog\.set_config\('search_path', '', false\);"
+    # psql meta commands newer versions of pg_dump emit
+    rb"|\\(?:un)?restrict .*)\r?\n",
+    re.M,
+)
+_SETTING = re.compile(rb"^SET (\w+) = .*;\r?$", re.M)
+
+
+def baseline_name(up_to: str) -> str:
+    """Name of the baseline covering migrations up to the given one
+
+    It sorts straight after that migration so it comes before every
+    migration made after it.
+    """
+
+    return f"{migration_stem(up_to)}_baseline.sql"
+
+
+def find_baseline(
+    migrations_directory: Path, files: List[str], covers: str
+) -> Optional[str]:
+    """Finds the baseline in a directory covering migrations up to covers"""
+
+    name = baseline_name(covers)
+    if name not in files:
+        return None
+
+    with open_content(FileSystem(migrations_directory).get_migration(name)) as content:
+        if parse_directives(content).baseline != covers:
+            return None
+
+    return name
+
+
+@contextmanager
+def scratch_database(uri: str) -> Iterator[str]:
+    """Creates a temporary database dropping it afterwards
+
+    Yields the URI of the new database on the same server as uri.
+    """
+
+    name = "petite_squash_" + "".join(random.choices(string.ascii_lowercase, k=12))
+
+    with psycopg.connect(uri, autocommit=True) as conn:
+        conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+
+    try:
+        yield database_uri(uri, name)
+    finally:
+        drop_database(uri, name)
+
+
+def dump_database(uri: str, pg_dump: str, schema_only: bool) -> bytes:
+    """Dumps a database as SQL that can be applied as a migration
+
+    The password is passed to pg_dump in its environment rather than its
+    arguments, which any local user can read. Raises RuntimeError if
+    pg_dump fails.
+    """
+
+    params = conninfo_to_dict(uri)
+    env = dict(os.environ)
+    password = params.pop("password", None)
+    if password is not None:
+        env["PGPASSWORD"] = str(password)
+
+    command = [
+        pg_dump,
+        "--no-owner",
+        "--no-privileges",
+        "--dbname",
+        make_conninfo(**params),
+    ]
+    command += [f"--exclude-table={table}" for table in _BOOKKEEPING_TABLES]
+    if schema_only:
+        command.append("--schema-only")
+
+    try:
+        process = subprocess.run(command, capture_output=True, env=env)
+    except FileNotFoundError:
+        raise RuntimeError(f"{pg_dump} not found, install it or give its path")
+
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode("utf-8", "replace").strip())
+
+    return clean_dump(process.stdout)
+
+
+def clean_dump(dump: bytes) -> bytes:
+    """Stops the settings in a dump from leaking into later migrations
+
+    Settings that would break later migrations are removed and the rest are
+    reset at the end of the dump.
+    """
+
+    dump = _DROPPED_SETTINGS.sub(b"", dump)
+
+    resets = dict.fromkeys(match.group(1) for match in _SETTING.finditer(dump))
+    return dump + b"".join(b"RESET " + name + b";\n" for name in resets)
+
+
+def write_baseline(
+    migrations_directory: Path, up_to: str, count: int, dump: bytes
+) -> Path:
+    """Writes a baseline migration returning its path"""
+
+    path = migrations_directory / baseline_name(up_to)
+
+    header = (
+        f"-- petite: baseline={up_to}\n"
+        f"-- Baseline of {count} migration{'s' if count > 1 else ''} up to {up_to} "
+        f"created by petite squash on {datetime.now():%Y-%m-%d}.\n\n"
+    )
+
+    with open(path, "wb") as f:
+        f.write(header.encode("utf-8"))
+        f.write(dump)
+
+    return path
+
+
+def archive_migrations(migrations_directory: Path, files: List[str]) -> Path:
+    """Moves migrations into the archive directory returning its path"""
+
+    archive = migrations_directory / ARCHIVE_DIRECTORY
+    archive.mkdir(exist_ok=True)
+
+    for file in files:
+        shutil.move(migrations_directory / file, archive / file)
+
+    return archive
+
+
+def squashable_migrations(migrations_directory: Path, up_to: str) -> List[str]:
+    """Gets the migrations a baseline up to the given one would replace
+
+    Raises ValueError if the migration isn't in the directory.
+    """
+
+    files = list_migration_files(migrations_directory)
+
+    try:
+        return files[: files.index(up_to) + 1]
+    except ValueError:
+        raise ValueError(f"Migration {up_to} not found in the migration directory")
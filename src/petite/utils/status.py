@@ -0,0 +1,87 @@
+"""Read-only check of how a database compares to the migrations directory"""
+
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import psycopg
+
+from .errors import (
+    DatabaseConnectionError,
+    DatabaseError,
+    MigrationDirectoryNotFound,
+    MigrationTableNotFound,
+)
+from .file_system import list_migration_files
+from .pending import find_pending
+from .queries import APPLIED_MIGRATION_NAMES
+
+UP_TO_DATE = "up-to-date"
+PENDING = "pending"
+DIVERGED = "diverged"
+
+# Exit codes of the status command, 1 and 2 are left for errors
+EXIT_CODES = {UP_TO_DATE: 0, PENDING: 3, DIVERGED: 4}
+
+
+class Status(NamedTuple):
+    """Where a database is relative to the migrations directory"""
+
+    # One of UP_TO_DATE, PENDING or DIVERGED
+    state: str
+    last_applied: Optional[str]
+    head: Optional[str]
+    applied_count: int
+    # Unapplied migrations after the last applied one
+    pending: List[str]
+    # Unapplied migrations before the last applied one
+    out_of_order: List[str]
+
+
+def get_status(uri: str, migrations_directory: Path, timeout: float) -> Status:
+    """Compares the migrations applied to a database with a directory
+
+    Takes a single query. The database is diverged when its last applied
+    migration isn't in the directory, like after deploying an older version
+    of an app, unless a baseline from squash replaced it.
+    """
+
+    try:
+        conn = psycopg.connect(uri, connect_timeout=max(1, round(timeout)))
+    except psycopg.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+
+    with conn:
+        try:
+            (applied,) = conn.execute(APPLIED_MIGRATION_NAMES).fetchone()  # type: ignore
+        except psycopg.errors.UndefinedTable as e:
+            raise MigrationTableNotFound("Migration table not found") from e
+        except psycopg.Error as e:
+            raise DatabaseError(str(e)) from e
+
+    try:
+        files = list_migration_files(migrations_directory)
+    except (FileNotFoundError, NotADirectoryError) as e:
+        raise MigrationDirectoryNotFound(
+            f"Migrations directory {migrations_directory} not found"
+        ) from e
+    head = files[-1] if files else None
+
+    # Sorted like the directory
+    applied.sort()
+    result = find_pending(migrations_directory, files, applied)
+
+    if result.diverged:
+        state = DIVERGED
+    elif result.pending or result.out_of_order:
+        state = PENDING
+    else:
+        state = UP_TO_DATE
+
+    return Status(
+        state,
+        result.last_applied,
+        head,
+        len(applied),
+        [] if result.diverged else result.pending,
+        [] if result.diverged else result.out_of_order,
+    )
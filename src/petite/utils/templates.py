@@ -0,0 +1,210 @@
+"""Template databases with migrations applied for cloning test databases"""
+
+import hashlib
+import random
+import string
+from pathlib import Path
+from typing import List
+from urllib.parse import urlsplit, urlunsplit
+
+import psycopg
+from psycopg import sql
+
+from .checksum import checksum_files
+from .errors import PetiteError
+from .file_system import MigrationFile, list_migration_files
+from .queries import SCHEMA_VERSION
+
+DEFAULT_PREFIX = "petite_template"
+
+# Only names template_name could give for the prefix so templates of
+# another prefix that starts the same, or has LIKE wildcards, never match
+_TEMPLATES = """
+SELECT datname FROM pg_database
+WHERE datistemplate
+    AND left(datname, length(%(prefix)s) + 1) = %(prefix)s || '_'
+    AND substr(datname, length(%(prefix)s) + 2) ~ '^[0-9a-f]{16}$'
+"""
+
+
+def database_uri(uri: str, name: str) -> str:
+    """Returns uri with its database swapped for name"""
+
+    return urlunsplit(urlsplit(uri)._replace(path=f"/{name}"))
+
+
+def migrations_checksum(migrations_directory: Path) -> str:
+    """Returns a checksum of the name and content of every migration
+
+    Also covers the version of the migration tables so templates made by an
+    older version of petite are rebuilt.
+    """
+
+    files = list_migration_files(migrations_directory)
+    checksums = checksum_files(migrations_directory / file for file in files)
+
+    digest = hashlib.sha256(f"schema {SCHEMA_VERSION}\n".encode())
+    for file in files:
+        digest.update(f"{file} {checksums[file]}\n".encode())
+
+    return digest.hexdigest()
+
+
+def template_name(migrations_directory: Path, prefix: str = DEFAULT_PREFIX) -> str:
+    """Name of the template holding the migrations in a directory"""
+
+    return f"{prefix}_{migrations_checksum(migrations_directory)[:16]}"
+
+
+def ensure_template(
+    uri: str, migrations_directory: Path, prefix: str = DEFAULT_PREFIX
+) -> str:
+    """Makes sure a template with every migration applied exists
+
+    uri is any database on the server the template is made on. Returns the
+    name of the template, which is only built if no template with the same
+    migrations exists. Templates from older versions of the migrations are
+    dropped. Concurrent callers, like pytest-xdist workers, wait for the
+    first to finish building instead of each building their own.
+
+    Raises PetiteError if a migration fails.
+    """
+
+    name = template_name(migrations_directory, prefix)
+
+    try:
+        conn = psycopg.connect(uri, autocommit=True)
+    except psycopg.Error as e:
+        raise PetiteError(f"Could not connect to the database: {e}") from e
+
+    with conn:
+        if name in _templates(conn, prefix):
+            return name
+
+        # Takes turns building templates with the same prefix
+        conn.execute("SELECT pg_advisory_lock(hashtext(%s))", (prefix,))
+
+        try:
+            templates = _templates(conn, prefix)
+            if name not in templates:
+                _build_template(conn, uri, name, migrations_directory)
+
+            for stale in templates:
+                if stale != name:
+                    _drop_template(conn, stale)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", (prefix,))
+
+    return name
+
+
+def _templates(conn: psycopg.Connection, prefix: str) -> List[str]:
+    return [row[0] for row in conn.execute(_TEMPLATES, {"prefix": prefix}).fetchall()]
+
+
+def _build_template(
+    conn: psycopg.Connection, uri: str, name: str, migrations_directory: Path
+) -> None:
+    """Applies migrations to a new database then marks it as a template
+
+    The database is built under another name so a half built one is never
+    mistaken for a template.
+    """
+
+    building = f"{name}_building"
+    conn.execute(
+        sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(
+            sql.Identifier(building)
+        )
+    )
+    conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(building)))
+
+    try:
+        _apply_migrations(database_uri(uri, building), migrations_directory)
+    except BaseException:
+        drop_database(uri, building)
+        raise
+
+    conn.execute(
+        sql.SQL("ALTER DATABASE {} RENAME TO {}").format(
+            sql.Identifier(building), sql.Identifier(name)
+        )
+    )
+    # Cloning fails while anything is connected to the template
+    conn.execute(
+        sql.SQL(
+            "ALTER DATABASE {} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false"
+        ).format(sql.Identifier(name))
+    )
+
+
+def _apply_migrations(uri: str, migrations_directory: Path) -> None:
+    # Imported here so the helpers for other modules don't pull in the planner
+    from .cache import MigrationCache
+    from .migrator import Migrator
+
+    migrations = [
+        (file, MigrationFile(migrations_directory / file))
+        for file in list_migration_files(migrations_directory)
+    ]
+
+    try:
+        conn = psycopg.connect(uri)
+    except psycopg.Error as e:
+        raise PetiteError(f"Could not connect to the database: {e}") from e
+
+    with conn:
+        migrator = Migrator(conn, MigrationCache())
+        migrator.upgrade_schema(create=True)
+        if migrations:
+            migrator.apply_migrations(migrations)
+
+
+def _drop_template(conn: psycopg.Connection, name: str) -> None:
+    """Drops a template leaving it if another run is cloning it"""
+
+    try:
+        conn.execute(
+            sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE false").format(
+                sql.Identifier(name)
+            )
+        )
+        conn.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+    except psycopg.errors.ObjectInUse:
+        conn.execute(
+            sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE true").format(
+                sql.Identifier(name)
+            )
+        )
+
+
+def clone_template(uri: str, template: str, name: str = "") -> str:
+    """Creates a database from a template returning its URI
+
+    Gets a random name if none is given. Cloning copies files instead of
+    replaying migrations so it takes milliseconds.
+    """
+
+    name = name or "petite_test_" + "".join(
+        random.choices(string.ascii_lowercase, k=12)
+    )
+
+    with psycopg.connect(uri, autocommit=True) as conn:
+        conn.execute(
+            sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+                sql.Identifier(name), sql.Identifier(template)
+            )
+        )
+
+    return database_uri(uri, name)
+
+
+def drop_database(uri: str, name: str) -> None:
+    """Drops a database disconnecting anything still connected to it"""
+
+    with psycopg.connect(uri, autocommit=True) as conn:
+        conn.execute(
+            sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(
+                sql.Identifier(name)
+            )
+        )
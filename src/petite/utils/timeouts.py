@@ -0,0 +1,32 @@
+"""Timeout and retry settings for applying migrations"""
+
+import random
+from typing import NamedTuple, Optional
+
+
+class Timeouts(NamedTuple):
+    """PostgreSQL timeouts set while applying migrations
+
+    Values use PostgreSQL's format so can be a number of milliseconds or
+    include units like 5s. None leaves the server's setting in place.
+    """
+
+    lock_timeout: Optional[str] = None
+    statement_timeout: Optional[str] = None
+
+
+class RetryPolicy(NamedTuple):
+    """How often and how long to wait when a lock timeout is hit"""
+
+    retries: int = 0
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """Returns the seconds to wait after the given failed attempt
+
+        Uses exponential backoff with full jitter so many runners waiting on
+        the same lock don't all retry at once.
+        """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
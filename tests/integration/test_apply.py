@@ -1,4 +1,6 @@
+import gzip
 import random
+import threading
 from pathlib import Path
 
 import psycopg
@@ -136,6 +138,52 @@ def test_apply_migrations_fail(new_database: str, tmp_path: Path):
     db_conn.close()
 
 
+@pytest.mark.parametrize("sync_every", [1000, 2])
+def test_apply_pipelined_failure(
+    new_database: str, tmp_path: Path, monkeypatch, sync_every: int
+):
+    # Syncing every few statements means the failure surfaces at a sync
+    # part way through the batch instead of at the commit
+    monkeypatch.setattr("petite.utils.migrator.SYNC_EVERY", sync_every)
+
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT);\n")
+    (mig_path / "2_test.sql").write_text(
+        "INSERT INTO test VALUES (1);\n"
+        "-- Fails at runtime so only the server knows which statement it was\n"
+        "INSERT INTO test\n"
+        "VALUES (1 / 0);\n"
+        "INSERT INTO test VALUES (3);\n"
+    )
+    (mig_path / "3_test.sql").write_text("INSERT INTO test VALUES (4);\n")
+
+    Database(new_database).create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "Error applying migration: 2_test.sql" in result.stdout
+    assert "division by zero" in result.stdout
+    assert "The error is in statement 2 on line 3 of 2_test.sql" in result.stdout
+    assert "Rolling back migrations applied so far" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT count(*) FROM migration").fetchone() == (0,)
+        with pytest.raises(psycopg.errors.UndefinedTable):
+            conn.execute("SELECT * FROM test")
+
+
 def test_apply_no_transaction_success(new_database: str, tmp_path: Path):
     mig_path = tmp_path / "migrations"
     mig_path.mkdir()
@@ -238,3 +286,405 @@ def test_apply_no_transaction_fail(new_database: str, tmp_path: Path):
         )
         assert len(cur.fetchall()) == 1
     conn.close()
+
+
+@pytest.mark.parametrize("no_transaction", [False, True])
+def test_apply_copy(new_database: str, tmp_path: Path, no_transaction: bool):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text(
+        "CREATE TABLE test (id INT, name TEXT);\n"
+        "COPY test (id, name) FROM stdin;\n"
+        "1\tsemi;colon\n"
+        "2\tsecond\n"
+        "\\.\n"
+        "COPY test (id, name) FROM 'test.csv' WITH (FORMAT csv);\n"
+        "INSERT INTO test VALUES (5, 'after');\n"
+    )
+    (mig_path / "test.csv").write_text('3,third\n4,"fourth, with comma"\n')
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ]
+        + (["--no-transaction"] if no_transaction else []),
+        input="y",
+    )
+
+    assert result.exit_code == 0
+    assert "Copied 2 rows" in result.stdout
+    assert "Applied migration 1_test.sql" in result.stdout
+
+    db_conn = psycopg.connect(new_database)
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT id, name FROM test ORDER BY id")
+        assert cur.fetchall() == [
+            (1, "semi;colon"),
+            (2, "second"),
+            (3, "third"),
+            (4, "fourth, with comma"),
+            (5, "after"),
+        ]
+    db_conn.close()
+
+
+def test_apply_compressed(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT, name TEXT);\n")
+    (mig_path / "2_test.sql.gz").write_bytes(
+        gzip.compress(
+            b"COPY test (id, name) FROM stdin;\n1\tfirst\n\\.\n"
+            b"COPY test (id, name) FROM 'test.csv.gz' WITH (FORMAT csv);\n"
+        )
+    )
+    (mig_path / "test.csv.gz").write_bytes(gzip.compress(b"2,second\n3,third\n"))
+    (mig_path / "3_test.sql").write_text("INSERT INTO test VALUES (4, 'after');\n")
+
+    Database(new_database).create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "Applied migration 2_test.sql.gz" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert [row[0] for row in conn.execute("SELECT id FROM test ORDER BY id")] == [
+            1,
+            2,
+            3,
+            4,
+        ]
+        assert conn.execute(
+            "SELECT statement_count FROM migration WHERE file_name = '2_test.sql.gz'"
+        ).fetchone() == (2,)
+
+    result = runner.invoke(
+        app,
+        [
+            "verify",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 0
+
+
+def test_apply_copy_fail(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT);")
+    (mig_path / "2_test.sql").write_text(
+        "INSERT INTO test VALUES (1);\nCOPY test (id) FROM stdin;\nnot a number\n\\.\n"
+    )
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "Applied migration 1_test.sql" in result.stdout
+    assert "Error applying migration: 2_test.sql" in result.stdout
+    assert "Rolling back migrations applied so far" in result.stdout
+
+    db_conn = psycopg.connect(new_database)
+    with db_conn.cursor() as cur:
+        with pytest.raises(psycopg.errors.UndefinedTable):
+            cur.execute("SELECT * FROM test")
+    db_conn.close()
+
+
+@pytest.mark.parametrize("no_transaction", [False, True])
+def test_apply_lock_timeout_retry(
+    new_database: str, tmp_path: Path, no_transaction: bool
+):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("ALTER TABLE test ADD COLUMN name TEXT;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    # Holds a lock on the table for a moment so the first attempts time out
+    locker = psycopg.connect(new_database)
+    locker.execute("CREATE TABLE test (id INT)")
+    locker.commit()
+    locker.execute("LOCK TABLE test IN ACCESS SHARE MODE")
+    release = threading.Timer(0.5, locker.rollback)
+    release.start()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+            "--lock-timeout",
+            "100ms",
+            "--retries",
+            "10",
+            "--retry-delay",
+            "0.1",
+        ]
+        + (["--no-transaction"] if no_transaction else []),
+        input="y\n",
+    )
+
+    release.join()
+    locker.close()
+
+    assert result.exit_code == 0
+    assert "Lock timeout applying migration 1_test.sql" in result.stdout
+    assert "Applied migration 1_test.sql" in result.stdout
+
+    db_conn = psycopg.connect(new_database)
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT name FROM test")
+    db_conn.close()
+
+
+def test_apply_lock_timeout_fail(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("ALTER TABLE test ADD COLUMN name TEXT;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    locker = psycopg.connect(new_database)
+    locker.execute("CREATE TABLE test (id INT)")
+    locker.commit()
+    locker.execute("LOCK TABLE test IN ACCESS SHARE MODE")
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+            "--lock-timeout",
+            "50ms",
+        ],
+    )
+
+    locker.close()
+
+    assert result.exit_code == 1
+    assert "Error applying migration: 1_test.sql" in result.stdout
+    assert "lock timeout" in result.stdout
+
+
+def test_apply_mixed_transactions(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT);")
+    (mig_path / "2_test.sql").write_text("INSERT INTO test VALUES (1);")
+    # Detected as unable to run in a transaction
+    (mig_path / "3_test.sql").write_text(
+        "CREATE INDEX CONCURRENTLY test_id ON test (id);"
+    )
+    (mig_path / "4_test.sql").write_text(
+        "-- petite: transaction=off, lock_timeout=1s\nSELECT 1;"
+    )
+    (mig_path / "5_test.sql").write_text("INSERT INTO test VALUES (2);")
+    (mig_path / "6_test.sql").write_text("INSERT INTO missing VALUES (3);")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 1
+    for applied in range(1, 5):
+        assert f"Applied migration {applied}_test.sql" in result.stdout
+    assert "Error applying migration: 6_test.sql" in result.stdout
+    assert "Rolling back migrations applied in this transaction" in result.stdout
+
+    db_conn = psycopg.connect(new_database)
+    with db_conn.cursor() as cur:
+        # Only the last transaction is rolled back
+        cur.execute("SELECT id FROM test")
+        assert cur.fetchall() == [(1,)]
+
+        cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'test'")
+        assert cur.fetchall() == [("test_id",)]
+
+        cur.execute("SELECT file_name FROM migration ORDER BY file_name")
+        assert [row[0] for row in cur.fetchall()] == [
+            "1_test.sql",
+            "2_test.sql",
+            "3_test.sql",
+            "4_test.sql",
+        ]
+    db_conn.close()
+
+
+def test_apply_out_of_order(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+    (mig_path / "3_test.sql").write_text("ALTER TABLE test ADD COLUMN three INT;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    args = [
+        "apply",
+        "--migrations-directory",
+        str(mig_path),
+        "--postgres-uri",
+        new_database,
+    ]
+
+    assert runner.invoke(app, args).exit_code == 0
+
+    # Merged from a branch after 3_test.sql was applied
+    (mig_path / "2_test.sql").write_text("ALTER TABLE test ADD COLUMN two INT;")
+
+    result = runner.invoke(app, args)
+
+    assert result.exit_code == 1
+    assert "2_test.sql" in result.stdout
+    assert "--allow-out-of-order" in result.stdout
+
+    result = runner.invoke(app, args + ["--allow-out-of-order"])
+
+    assert result.exit_code == 0
+    assert "Applied migration 2_test.sql" in result.stdout
+
+    assert db.get_applied_migrations() == ["1_test.sql", "2_test.sql", "3_test.sql"]
+    assert runner.invoke(app, args).exit_code == 0
+
+
+def test_apply_events(new_database: str, tmp_path: Path):
+    import json
+
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+    (mig_path / "2_test.sql").write_text(
+        "-- petite: transaction=off\nALTER TABLE test ADD COLUMN one INT;"
+    )
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+            "--json",
+            "--metrics-file",
+            str(tmp_path / "petite.prom"),
+        ],
+    )
+
+    assert result.exit_code == 0
+
+    # Nothing but events is printed
+    events = [json.loads(line) for line in result.stdout.splitlines()]
+
+    assert [event["phase"] for event in events if event["event"] == "phase"] == [
+        "connect",
+        "scan",
+        "plan",
+        "lock",
+    ]
+    migrations = [event for event in events if event["event"] == "migration"]
+    assert [event["name"] for event in migrations] == ["1_test.sql", "2_test.sql"]
+    assert all(event["duration_ms"] >= 0 for event in migrations)
+
+    statements = [event for event in events if event["event"] == "statement"]
+    assert statements[-1]["migration"] == "2_test.sql"
+    assert statements[-1]["duration_ms"] >= 0
+
+    assert events[-1]["event"] == "run"
+    assert events[-1]["status"] == "succeeded"
+    assert events[-1]["applied"] == 2
+
+    metrics = (tmp_path / "petite.prom").read_text()
+    assert "petite_apply_success 1" in metrics
+    assert "petite_apply_migrations_applied 2" in metrics
+
+
+def test_apply_events_failure(new_database: str, tmp_path: Path):
+    import json
+
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+            "--json",
+        ],
+    )
+
+    assert result.exit_code == 1
+
+    run = [json.loads(line) for line in result.stdout.splitlines()][-1]
+    assert run["event"] == "run"
+    assert run["status"] == "failed"
+    assert "Migration table not found!" in run["error"]
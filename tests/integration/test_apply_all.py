@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+
+def test_apply_all(database: str, new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+
+    # A second database reachable through discovery and one that doesn't exist
+    second = new_database + "_2"
+    with psycopg.connect(database + "/postgres", autocommit=True) as conn:
+        conn.execute(
+            sql.SQL("CREATE DATABASE {}").format(
+                sql.Identifier(second.rsplit("/", 1)[1])
+            )
+        )
+
+    uris = [new_database, second, database + "/missing_database"]
+    for uri in uris[:2]:
+        Database(uri).create_migration_table()
+
+    uris_file = tmp_path / "uris.txt"
+    uris_file.write_text("\n".join(uris))
+
+    result = runner.invoke(
+        app,
+        [
+            "apply-all",
+            "--migrations-directory",
+            str(mig_path),
+            "--uris-file",
+            str(uris_file),
+            "--workers",
+            "2",
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "2 applied, 1 failed, 0 skipped" in result.stdout
+
+    for uri in uris[:2]:
+        with psycopg.connect(uri) as conn:
+            conn.execute("SELECT * FROM test")
+
+
+def test_apply_all_discover(database: str, new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+
+    Database(new_database).create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply-all",
+            "--migrations-directory",
+            str(mig_path),
+            "--discover-uri",
+            new_database,
+            "--discover-query",
+            f"SELECT '{new_database}'",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "1 applied, 0 failed, 0 skipped" in result.stdout
+    assert "1 applied" in result.stdout
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import psycopg
+import pytest
+
+from petite.utils import AsyncDatabase
+from petite.utils.errors import MigrationError, MigrationTableNotFound
+from petite.utils.queries import MIGRATION_LOCK_KEY
+
+from . import database, new_database
+
+
+async def apply(uri: str, migrations, **kwargs):
+    async with await AsyncDatabase.connect(uri) as db:
+        await db.create_migration_table()
+        applied = await db.apply_migrations(migrations, **kwargs)
+
+        return applied, await db.get_last_applied_migration()
+
+
+def test_async_apply(new_database: str):
+    applied, last = asyncio.run(
+        apply(
+            new_database,
+            [
+                ("1_test.sql", b"CREATE TABLE test (id INT);"),
+                ("2_test.sql", b"COPY test FROM stdin;\n1\n2\n\\.\n"),
+                ("3_test.sql", b"CREATE INDEX CONCURRENTLY test_id ON test (id);"),
+            ],
+        )
+    )
+
+    assert applied == ["1_test.sql", "2_test.sql", "3_test.sql"]
+    assert last is not None and last[1] == "3_test.sql"
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT count(*) FROM test").fetchone() == (2,)
+
+
+@pytest.mark.parametrize("no_transaction", [False, True])
+def test_async_apply_fail(new_database: str, no_transaction: bool):
+    with pytest.raises(MigrationError) as exc_info:
+        asyncio.run(
+            apply(
+                new_database,
+                [
+                    ("1_test.sql", b"CREATE TABLE test (id INT);"),
+                    ("2_test.sql", b"SELECT 1;\nINSERT INTO missing VALUES (1);"),
+                ],
+                no_transaction=no_transaction,
+            )
+        )
+
+    error = exc_info.value
+    assert error.migration == "2_test.sql"
+    assert error.statement_index == 1
+    assert error.rolled_back is not no_transaction
+    assert error.applied == (["1_test.sql"] if no_transaction else [])
+    assert isinstance(error.__cause__, psycopg.errors.UndefinedTable)
+
+
+def test_async_table_not_found(new_database: str):
+    async def last_applied():
+        async with await AsyncDatabase.connect(new_database) as db:
+            return await db.get_last_applied_migration()
+
+    with pytest.raises(MigrationTableNotFound):
+        asyncio.run(last_applied())
+
+
+def test_async_migration_lock(new_database: str):
+    async def locked():
+        async with await AsyncDatabase.connect(new_database) as db:
+            async with db.migration_lock():
+                with psycopg.connect(new_database) as other:
+                    return other.execute(
+                        "SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,)
+                    ).fetchone()
+
+    assert asyncio.run(locked()) == (False,)
+
+
+def test_async_apply_cancelled(new_database: str):
+    async def cancelled():
+        async with await AsyncDatabase.connect(new_database) as db:
+            await db.create_migration_table()
+
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    db.apply_migrations([("1_test.sql", b"SELECT pg_sleep(60);")]),
+                    0.5,
+                )
+
+            # The connection is free again once the call is cancelled
+            return await db.get_last_applied_migration()
+
+    start = time.perf_counter()
+    assert asyncio.run(cancelled()) is None
+
+    # The query was cancelled on the server rather than left to finish
+    assert time.perf_counter() - start < 30
@@ -0,0 +1,128 @@
+import asyncio
+from pathlib import Path
+
+import psycopg
+from typer.testing import CliRunner
+
+from petite import app
+from petite.utils import AsyncDatabase
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+BACKFILL = """-- petite: backfill=test, batch_size=10
+UPDATE test SET copy = value
+WHERE id BETWEEN $1 AND $2 AND ($2::int < 50 OR NOT EXISTS (SELECT FROM stop));
+"""
+
+
+def apply(uri: str, mig_path: Path):
+    return runner.invoke(
+        app,
+        ["apply", "--migrations-directory", str(mig_path), "--postgres-uri", uri],
+    )
+
+
+def setup_table(uri: str, mig_path: Path) -> None:
+    mig_path.mkdir()
+    (mig_path / "1_test.sql").write_text(
+        "CREATE TABLE test (id INT PRIMARY KEY, value INT, copy INT);\n"
+        # Gaps in the key don't make empty chunks
+        "INSERT INTO test SELECT n * 2, n, NULL FROM generate_series(1, 50) n;\n"
+        "CREATE TABLE stop ();\n"
+    )
+    (mig_path / "2_test.sql").write_text(BACKFILL)
+
+    Database(uri).create_migration_table()
+
+
+def test_backfill(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_table(new_database, mig_path)
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 0
+    assert "Backfilled 50 rows in 5 chunks of 2_test.sql" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT count(*) FROM test WHERE copy = value"
+        ).fetchone() == (50,)
+        assert conn.execute(
+            "SELECT statement_count FROM migration WHERE file_name = '2_test.sql'"
+        ).fetchone() == (5,)
+        assert conn.execute("SELECT count(*) FROM migration_backfill").fetchone() == (
+            0,
+        )
+
+
+def test_backfill_resume(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_table(new_database, mig_path)
+    (mig_path / "2_test.sql").write_text(
+        BACKFILL.replace(
+            "NOT EXISTS (SELECT FROM stop)", "1 / (SELECT count(*) FROM stop) > 0"
+        )
+    )
+
+    result = apply(new_database, mig_path)
+
+    # Chunks ending at key 50 or later divide by zero until stop has a row
+    assert result.exit_code == 1
+    assert "Chunks up to key 40 are committed" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT count(*) FROM test WHERE copy = value"
+        ).fetchone() == (20,)
+        assert conn.execute("SELECT max(file_name) FROM migration").fetchone() == (
+            "1_test.sql",
+        )
+        conn.execute("INSERT INTO stop DEFAULT VALUES")
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 0
+    assert "Resuming backfill 2_test.sql after key 40 with 20 rows" in result.stdout
+    assert "Backfilled 50 rows in 5 chunks" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT count(*) FROM test WHERE copy = value"
+        ).fetchone() == (50,)
+
+
+def test_backfill_changed(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_table(new_database, mig_path)
+
+    with psycopg.connect(new_database) as conn:
+        conn.execute(
+            "INSERT INTO migration_backfill (file_name, checksum, last_key, rows, chunks) "
+            "VALUES ('2_test.sql', 'old', '10', 5, 1)"
+        )
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 1
+    assert "changed since it was started" in result.stdout
+
+
+def test_async_backfill(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_table(new_database, mig_path)
+
+    async def run():
+        async with await AsyncDatabase.connect(new_database) as db:
+            return await db.apply_migrations(
+                [(path.name, path.read_bytes()) for path in sorted(mig_path.iterdir())]
+            )
+
+    assert asyncio.run(run()) == ["1_test.sql", "2_test.sql"]
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT count(*) FROM test WHERE copy = value"
+        ).fetchone() == (50,)
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import psycopg
+from typer.testing import CliRunner
+
+from petite import app
+from petite.utils.queries import MIGRATION_LOCK_KEY
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+SRC_PATH = Path(__file__).parents[2] / "src"
+
+
+def test_concurrent_apply(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (); SELECT pg_sleep(0.2);")
+    (mig_path / "2_test.sql").write_text("ALTER TABLE test ADD COLUMN id INT;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    runs = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "petite",
+                "apply",
+                "--migrations-directory",
+                str(mig_path),
+            ],
+            env={
+                **os.environ,
+                "PYTHONPATH": str(SRC_PATH),
+                "POSTGRES_URI": new_database,
+            },
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        for _ in range(5)
+    ]
+    outputs = [run.communicate()[0] for run in runs]
+
+    assert [run.returncode for run in runs] == [0] * 5, outputs
+    assert sum("Successfully applied 2 migrations" in out for out in outputs) == 1
+
+    with psycopg.connect(new_database) as conn:
+        rows = conn.execute("SELECT file_name FROM migration").fetchall()
+        assert sorted(rows) == [("1_test.sql",), ("2_test.sql",)]
+
+
+def test_apply_rechecks_after_waiting(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test ();")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    # Stands in for another run that applies the migration while holding the
+    # lock
+    other = psycopg.connect(new_database, autocommit=True)
+    other.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+
+    def finish():
+        other.execute("CREATE TABLE test ()")
+        other.execute("INSERT INTO migration (file_name) VALUES ('1_test.sql')")
+        other.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+
+    timer = threading.Timer(0.5, finish)
+    timer.start()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    timer.join()
+    other.close()
+
+    assert result.exit_code == 0
+    assert "Waiting for another run" in result.stdout
+    assert "Another run applied 1 of the outstanding migrations" in result.stdout
+    assert "Successfully applied" not in result.stdout
+
+
+def test_apply_up_to_date_doesnt_wait(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test ();")
+
+    db = Database(new_database)
+    db.create_migration_table()
+    db.apply_migrations([("1_test.sql", b"CREATE TABLE test ();")])
+
+    other = psycopg.connect(new_database, autocommit=True)
+    other.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    other.close()
+
+    assert result.exit_code == 0
+    assert "with 0 outstanding" in result.stdout
+    assert "Waiting" not in result.stdout
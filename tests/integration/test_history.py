@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import psycopg
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+
+def test_history(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+    (mig_path / "2_test.sql").write_text("SELECT pg_sleep(0.2);\nSELECT 1;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+            "--no-transaction",
+        ],
+        input="y",
+    )
+    assert result.exit_code == 0
+
+    db_conn = psycopg.connect(new_database)
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "SELECT file_name, duration_ms, statement_count, bytes FROM migration ORDER BY file_name"
+        )
+        first, second = cur.fetchall()
+
+        assert first[2:] == (1, len("CREATE TABLE test();"))
+        assert second[1] >= 200
+        assert second[2:] == (2, len("SELECT pg_sleep(0.2);\nSELECT 1;"))
+
+        cur.execute(
+            "SELECT file_name, statement_index, kind FROM migration_statement ORDER BY file_name, statement_index"
+        )
+        assert cur.fetchall() == [
+            ("1_test.sql", 0, "CREATE TABLE"),
+            ("2_test.sql", 0, "SELECT"),
+            ("2_test.sql", 1, "SELECT"),
+        ]
+    db_conn.close()
+
+    result = runner.invoke(
+        app, ["history", "--postgres-uri", new_database, "--compare", new_database]
+    )
+
+    assert result.exit_code == 0
+    # Slowest migration is listed first
+    assert result.stdout.index("2_test.sql") < result.stdout.index("1_test.sql")
+    assert "Compare 1" in result.stdout
+
+    result = runner.invoke(
+        app, ["history", "--postgres-uri", new_database, "--statements", "--limit", "1"]
+    )
+
+    assert result.exit_code == 0
+    assert "2_test.sql" in result.stdout
+    assert "1_test.sql" not in result.stdout
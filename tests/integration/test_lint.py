@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+
+def test_lint_outstanding(new_database: str, tmp_path: Path):
+    (tmp_path / "1_test.sql").write_text(
+        "CREATE TABLE test (id INT);\nCREATE INDEX ON test (id);\n"
+    )
+    (tmp_path / "2_test.sql").write_text(
+        "-- petite: lock_timeout=5s\nALTER TABLE test ALTER COLUMN id TYPE BIGINT;\n"
+    )
+
+    db = Database(new_database)
+    db.create_migration_table()
+    db.apply_migrations([("1_test.sql", (tmp_path / "1_test.sql").read_bytes())])
+
+    result = runner.invoke(
+        app,
+        [
+            "lint",
+            "--migrations-directory",
+            str(tmp_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "Linted 1 migration with 1 error" in result.stdout
+    assert "2_test.sql:2 alter-column-type" in result.stdout
@@ -42,3 +42,20 @@ def test_new_migration(tmp_path: Path):
     files = list(mig_path.glob("*_test.sql"))
     assert len(files) == 1
     assert "_test.sql" in files[0].name
+
+
+def test_new_compressed_migration(tmp_path: Path):
+    import gzip
+
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    result = runner.invoke(
+        app,
+        ["new", "test", "--migrations-directory", str(mig_path), "--compressed"],
+    )
+
+    assert result.exit_code == 0
+
+    (file,) = mig_path.glob("*_test.sql.gz")
+    assert gzip.decompress(file.read_bytes()) == b"-- Write migration code below\n"
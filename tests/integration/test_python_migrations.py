@@ -0,0 +1,132 @@
+import asyncio
+from pathlib import Path
+
+import psycopg
+import pytest
+from typer.testing import CliRunner
+
+from petite import app
+from petite.utils import AsyncDatabase
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+MIGRATION = """
+def migrate(ctx):
+    ctx.executemany(
+        "INSERT INTO source (id, name) VALUES (%s, %s)",
+        [(n, f"name {n}") for n in range(1, 101)],
+    )
+    rows = ctx.stream("SELECT id, upper(name) FROM source ORDER BY id", batch_size=7)
+    # Batches of rows are fetched between the COPY statements
+    copied = ctx.copy_in("COPY target (id, name) FROM STDIN", rows, batch_size=30)
+    assert copied == 100
+
+    exported = list(ctx.copy_out("COPY target (id) TO STDOUT", types=["int4"]))
+    assert [row[0] for row in exported] == list(range(1, 101))
+
+    (ctx.directory / "exported.txt").write_text(str(len(exported)))
+"""
+
+
+def apply(uri: str, mig_path: Path):
+    return runner.invoke(
+        app,
+        ["apply", "--migrations-directory", str(mig_path), "--postgres-uri", uri],
+    )
+
+
+def setup_migrations(uri: str, mig_path: Path, python: str) -> None:
+    mig_path.mkdir()
+    (mig_path / "1_test.sql").write_text(
+        "CREATE TABLE source (id INT PRIMARY KEY, name TEXT);\n"
+        "CREATE TABLE target (id INT PRIMARY KEY, name TEXT);\n"
+    )
+    (mig_path / "2_test.py").write_text(python)
+    (mig_path / "3_test.sql").write_text("CREATE TABLE after ();\n")
+
+    Database(uri).create_migration_table()
+
+
+def test_python_migration(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_migrations(new_database, mig_path, MIGRATION)
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 0
+    assert "Applied migration 2_test.py" in result.stdout
+    assert (mig_path / "exported.txt").read_text() == "100"
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT name FROM target WHERE id = 5").fetchone() == (
+            "NAME 5",
+        )
+        assert conn.execute(
+            "SELECT file_name, statement_count FROM migration ORDER BY file_name"
+        ).fetchall() == [("1_test.sql", 2), ("2_test.py", 4), ("3_test.sql", 1)]
+
+
+def test_python_migration_rolls_back(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_migrations(
+        new_database,
+        mig_path,
+        "def migrate(ctx):\n"
+        "    ctx.execute('INSERT INTO source VALUES (1, %s)', ('a',))\n"
+        "    raise RuntimeError('stop here')\n",
+    )
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 1
+    assert "RuntimeError: stop here" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT count(*) FROM source").fetchone() == (0,)
+        assert conn.execute("SELECT file_name FROM migration").fetchall() == [
+            ("1_test.sql",)
+        ]
+
+
+def test_python_migration_helper_modules(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    setup_migrations(new_database, mig_path, "def migrate(ctx):\n    pass\n")
+    # Would fail if run as migrations
+    (mig_path / "__init__.py").write_text("")
+    (mig_path / "helpers.py").write_text("raise RuntimeError('not a migration')\n")
+
+    result = apply(new_database, mig_path)
+
+    assert result.exit_code == 0
+    assert "helpers.py" not in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT file_name FROM migration ORDER BY file_name"
+        ).fetchall() == [("1_test.sql",), ("2_test.py",), ("3_test.sql",)]
+
+
+def test_python_migration_async(new_database: str):
+    async def run():
+        async with await AsyncDatabase.connect(new_database) as db:
+            return await db.apply_migrations(
+                [
+                    ("1_test.sql", b"CREATE TABLE test (id INT);"),
+                    (
+                        "2_test.py",
+                        b"def migrate(ctx):\n    ctx.execute('INSERT INTO test VALUES (1)')\n",
+                    ),
+                ]
+            )
+
+    Database(new_database).create_migration_table()
+
+    assert asyncio.run(run()) == ["1_test.sql", "2_test.py"]
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT id FROM test").fetchall() == [(1,)]
+        assert conn.execute(
+            "SELECT file_name FROM migration ORDER BY file_name"
+        ).fetchall() == [("1_test.sql",), ("2_test.py",)]
@@ -0,0 +1,172 @@
+from pathlib import Path
+
+import psycopg
+import pytest
+from typer.testing import CliRunner
+
+from petite import app
+from petite.utils.queries import SCHEMA_VERSION
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+# Migration tables as created by earlier releases
+LEGACY_TABLES = [
+    """
+    CREATE TABLE migration (
+        id SERIAL PRIMARY KEY,
+        file_name VARCHAR(255) UNIQUE NOT NULL,
+        run_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    CREATE TABLE migration (
+        id SERIAL PRIMARY KEY,
+        file_name VARCHAR(255) UNIQUE NOT NULL,
+        run_on TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        checksum CHAR(64)
+    );
+    """,
+]
+
+
+@pytest.mark.parametrize("legacy_table", LEGACY_TABLES)
+def test_apply_upgrades_legacy_table(
+    new_database: str, tmp_path: Path, legacy_table: str
+):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE one ();")
+    (mig_path / "2_test.sql").write_text("CREATE TABLE two ();")
+
+    with psycopg.connect(new_database) as conn:
+        conn.execute(legacy_table)
+        conn.execute("CREATE TABLE one ()")
+        conn.execute("INSERT INTO migration (file_name) VALUES ('1_test.sql')")
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert f"Upgraded migration table from version 1 to {SCHEMA_VERSION}" in (
+        result.stdout
+    )
+    assert "Found last applied migration 1_test.sql" in result.stdout
+    assert "Successfully applied 1 migration" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT schema_version FROM migration_metadata"
+        ).fetchall() == [(SCHEMA_VERSION,)]
+
+        indexes = {
+            row[0]
+            for row in conn.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename LIKE 'migration%'"
+            )
+        }
+        assert "migration_duration_ms_idx" in indexes
+
+
+def test_setup_upgrades_legacy_table(new_database: str, tmp_path: Path):
+    with psycopg.connect(new_database) as conn:
+        conn.execute(LEGACY_TABLES[0])
+
+    result = runner.invoke(
+        app,
+        [
+            "setup",
+            "--migrations-directory",
+            str(tmp_path / "migrations"),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert f"Upgraded migration table from version 1 to {SCHEMA_VERSION}" in (
+        result.stdout
+    )
+
+
+def test_create_migration_table(new_database: str):
+    Database(new_database).create_migration_table()
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT schema_version FROM migration_metadata"
+        ).fetchall() == [(SCHEMA_VERSION,)]
+        # Made at the current version directly rather than through upgrades
+        # that add then drop columns
+        assert conn.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = 'migration_metadata' ORDER BY ordinal_position"
+        ).fetchall() == [("singleton",), ("schema_version",), ("updated_on",)]
+
+
+def test_last_applied_row_deleted(new_database: str):
+    db = Database(new_database)
+    db.create_migration_table()
+    db.apply_migrations([("1_test.sql", b"SELECT 1;"), ("2_test.sql", b"SELECT 2;")])
+
+    # Deleting a migration's row so it runs again makes the one before it last
+    with psycopg.connect(new_database) as conn:
+        conn.execute("DELETE FROM migration WHERE file_name = '2_test.sql'")
+
+    last = db.get_last_applied_migration()
+    assert last is not None and last[1] == "1_test.sql"
+
+
+def test_last_applied_bytewise(new_database: str):
+    db = Database(new_database)
+    db.create_migration_table()
+
+    with psycopg.connect(new_database) as conn:
+        try:
+            # Sorts 1_a.sql after 1_B.sql unlike the directory
+            conn.execute(
+                "ALTER TABLE migration ALTER COLUMN file_name "
+                'TYPE VARCHAR(255) COLLATE "unicode"'
+            )
+        except (psycopg.errors.UndefinedObject, psycopg.errors.FeatureNotSupported):
+            pytest.skip("Needs the ICU unicode collation")
+
+    db.apply_migrations([("1_B.sql", b"SELECT 1;"), ("1_a.sql", b"SELECT 2;")])
+
+    assert db.get_applied_migrations()[-1] == "1_a.sql"
+    last = db.get_last_applied_migration()
+    assert last is not None and last[1] == "1_a.sql"
+
+
+def test_newer_schema(new_database: str, tmp_path: Path):
+    db = Database(new_database)
+    db.create_migration_table()
+
+    with psycopg.connect(new_database) as conn:
+        conn.execute(
+            "UPDATE migration_metadata SET schema_version = %s", (SCHEMA_VERSION + 1,)
+        )
+
+    result = runner.invoke(
+        app,
+        [
+            "setup",
+            "--migrations-directory",
+            str(tmp_path / "migrations"),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+
+    assert result.exit_code == 1
+    assert "newer version of petite" in result.stdout
@@ -54,7 +54,7 @@ def test_setup(new_database: str, tmp_path: Path):
 
     assert result.exit_code == 0
     assert "Connected to the database" in result.stdout
-    assert "Created migration table" in result.stdout
+    assert "Migration table is up to date" in result.stdout
     assert "Found migrations directory" in result.stdout
 
     # Will raise an exception if the table doesn't exist
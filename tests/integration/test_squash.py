@@ -0,0 +1,173 @@
+import shutil
+from pathlib import Path
+
+import psycopg
+import pytest
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("pg_dump") is None, reason="pg_dump is needed to squash"
+)
+
+
+def invoke(*args: str):
+    return runner.invoke(app, list(args))
+
+
+@pytest.fixture
+def migrations(tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT);")
+    (mig_path / "2_test.sql").write_text("INSERT INTO test VALUES (1);")
+    (mig_path / "3_test.sql").write_text("ALTER TABLE test ADD COLUMN name TEXT;")
+
+    return mig_path
+
+
+def apply(uri: str, mig_path: Path):
+    return invoke(
+        "apply", "--postgres-uri", uri, "--migrations-directory", str(mig_path)
+    )
+
+
+def squash(database: str, mig_path: Path, *args: str):
+    return invoke(
+        "squash",
+        "--migrations-directory",
+        str(mig_path),
+        "--scratch-uri",
+        database + "/postgres",
+        *args,
+    )
+
+
+def test_squash(database: str, migrations: Path):
+    result = squash(database, migrations, "2_test.sql")
+
+    assert result.exit_code == 0
+    assert "Squashed 2 migrations" in result.stdout
+
+    assert sorted(path.name for path in migrations.iterdir()) == [
+        "2_test_baseline.sql",
+        "3_test.sql",
+        "archive",
+    ]
+    assert sorted(path.name for path in (migrations / "archive").iterdir()) == [
+        "1_test.sql",
+        "2_test.sql",
+    ]
+
+    baseline = (migrations / "2_test_baseline.sql").read_text()
+    assert baseline.startswith("-- petite: baseline=2_test.sql\n")
+    assert "CREATE TABLE public.test" in baseline
+    assert "migration_metadata" not in baseline
+
+    # The scratch database is dropped
+    with psycopg.connect(database + "/postgres") as conn:
+        assert not conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname LIKE 'petite_squash_%'"
+        ).fetchall()
+
+
+def test_squash_fresh_database(database: str, new_database: str, migrations: Path):
+    squash(database, migrations, "2_test.sql")
+
+    db = Database(new_database)
+    db.create_migration_table()
+    result = apply(new_database, migrations)
+
+    assert result.exit_code == 0
+    assert "Successfully applied 2 migrations" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT id, name FROM test").fetchall() == [(1, None)]
+
+
+def test_squash_schema_only(database: str, new_database: str, migrations: Path):
+    squash(database, migrations, "2_test.sql", "--schema-only")
+
+    db = Database(new_database)
+    db.create_migration_table()
+    apply(new_database, migrations)
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute("SELECT * FROM test").fetchall() == []
+
+
+def test_squash_existing_database(database: str, new_database: str, migrations: Path):
+    db = Database(new_database)
+    db.create_migration_table()
+    apply(new_database, migrations)
+    (migrations / "4_test.sql").write_text("ALTER TABLE test ADD COLUMN age INT;")
+
+    squash(database, migrations, "3_test.sql")
+
+    result = invoke(
+        "status",
+        "--postgres-uri",
+        new_database,
+        "--migrations-directory",
+        str(migrations),
+    )
+    assert result.exit_code == 3
+    assert "4_test.sql" in result.stdout
+
+    result = apply(new_database, migrations)
+
+    assert result.exit_code == 0
+    assert "Recorded baseline 3_test_baseline.sql" in result.stdout
+    assert "Successfully applied 1 migration" in result.stdout
+
+    with psycopg.connect(new_database) as conn:
+        assert conn.execute(
+            "SELECT file_name, statement_count FROM migration ORDER BY file_name"
+        ).fetchall()[-2:] == [("3_test_baseline.sql", 0), ("4_test.sql", 1)]
+
+    result = invoke(
+        "verify",
+        "--postgres-uri",
+        new_database,
+        "--migrations-directory",
+        str(migrations),
+    )
+    assert result.exit_code == 0
+
+
+def test_squash_database_behind_baseline(
+    database: str, new_database: str, migrations: Path
+):
+    db = Database(new_database)
+    db.create_migration_table()
+    invoke(
+        "apply",
+        "--postgres-uri",
+        new_database,
+        "--migrations-directory",
+        str(migrations),
+        "1",
+    )
+
+    squash(database, migrations, "2_test.sql")
+    result = apply(new_database, migrations)
+
+    assert result.exit_code == 1
+    assert "squashed into a baseline" in result.stdout
+
+    # Catching up from the archive then lets it continue from the baseline
+    assert apply(new_database, migrations / "archive").exit_code == 0
+    assert apply(new_database, migrations).exit_code == 0
+
+
+def test_squash_unknown_migration(database: str, migrations: Path):
+    result = squash(database, migrations, "9_test.sql")
+
+    assert result.exit_code == 1
+    assert "not found" in result.stdout
@@ -0,0 +1,125 @@
+import json
+from pathlib import Path
+
+import psycopg
+import pytest
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+
+def status(uri: str, mig_path: Path, *args: str):
+    return runner.invoke(
+        app,
+        [
+            "status",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            uri,
+            *args,
+        ],
+    )
+
+
+@pytest.fixture
+def migrations(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test ();")
+    (mig_path / "2_test.sql").write_text("ALTER TABLE test ADD COLUMN id INT;")
+
+    db = Database(new_database)
+    db.create_migration_table()
+    db.apply_migrations([("1_test.sql", b"CREATE TABLE test ();")])
+
+    return mig_path
+
+
+def test_status_pending(new_database: str, migrations: Path):
+    result = status(new_database, migrations)
+
+    assert result.exit_code == 3
+    assert "Outstanding 1 migration" in result.stdout
+    assert "2_test.sql" in result.stdout
+
+
+def test_status_up_to_date(new_database: str, migrations: Path):
+    (migrations / "2_test.sql").unlink()
+
+    result = status(new_database, migrations)
+
+    assert result.exit_code == 0
+    assert "Up to date with 1 migration applied" in result.stdout
+
+
+def test_status_diverged(new_database: str, migrations: Path):
+    (migrations / "1_test.sql").rename(migrations / "0_test.sql")
+    (migrations / "2_test.sql").unlink()
+
+    result = status(new_database, migrations, "--json")
+
+    assert result.exit_code == 4
+    assert json.loads(result.stdout) == {
+        "state": "diverged",
+        "last_applied": "1_test.sql",
+        "head": "0_test.sql",
+        "applied_count": 1,
+        "pending": [],
+        "out_of_order": [],
+    }
+
+
+def test_status_out_of_order(new_database: str, migrations: Path):
+    (migrations / "0_test.sql").write_text("SELECT 1;")
+
+    result = status(new_database, migrations, "--json")
+
+    assert result.exit_code == 3
+    assert json.loads(result.stdout)["out_of_order"] == ["0_test.sql"]
+    assert json.loads(result.stdout)["pending"] == ["2_test.sql"]
+
+
+def test_status_json(new_database: str, migrations: Path):
+    result = status(new_database, migrations, "--json")
+
+    assert result.exit_code == 3
+    assert json.loads(result.stdout)["pending"] == ["2_test.sql"]
+
+
+def test_status_no_table(new_database: str, tmp_path: Path):
+    result = status(new_database, tmp_path, "--json")
+
+    assert result.exit_code == 1
+    assert json.loads(result.stdout)["state"] == "error"
+
+
+def test_status_query_error(new_database: str, migrations: Path):
+    # Holds a lock the status query has to wait for past its timeout
+    with psycopg.connect(new_database) as conn:
+        conn.execute("LOCK TABLE migration IN ACCESS EXCLUSIVE MODE")
+
+        result = status(
+            new_database + "?options=-c%20statement_timeout%3D100",
+            migrations,
+            "--json",
+        )
+
+    assert result.exit_code == 1
+    output = json.loads(result.stdout)
+    assert output["state"] == "error"
+    assert "statement timeout" in output["error"]
+
+
+def test_status_no_directory(new_database: str, migrations: Path):
+    result = status(new_database, migrations / "missing", "--json")
+
+    assert result.exit_code == 1
+    output = json.loads(result.stdout)
+    assert output["state"] == "error"
+    assert "missing not found" in output["error"]
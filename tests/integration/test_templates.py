@@ -0,0 +1,209 @@
+import asyncio
+from pathlib import Path
+
+import psycopg
+import pytest
+from typer.testing import CliRunner
+
+from petite import app
+from petite.utils.errors import MigrationError
+from petite.utils.templates import clone_template, drop_database, ensure_template
+
+from . import database
+
+pytest_plugins = ["pytester"]
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def migrations(tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test (id INT);")
+    (mig_path / "2_test.sql").write_text("INSERT INTO test VALUES (1);")
+
+    return mig_path
+
+
+@pytest.fixture
+def server(database: str):
+    uri = database + "/postgres"
+
+    yield uri
+
+    # Leaves the server clean for other tests
+    with psycopg.connect(uri, autocommit=True) as conn:
+        for (name,) in conn.execute(
+            "SELECT datname FROM pg_database WHERE datname LIKE 'test_template_%'"
+        ).fetchall():
+            conn.execute(f'ALTER DATABASE "{name}" WITH IS_TEMPLATE false')
+            conn.execute(f'DROP DATABASE "{name}"')
+
+
+def template_oid(uri: str, name: str):
+    with psycopg.connect(uri) as conn:
+        row = conn.execute(
+            "SELECT oid FROM pg_database WHERE datname = %s AND datistemplate", (name,)
+        ).fetchone()
+
+    return row[0] if row else None
+
+
+def test_ensure_template(server: str, migrations: Path):
+    name = ensure_template(server, migrations, "test_template")
+    oid = template_oid(server, name)
+    assert oid is not None
+
+    # Reused while the migrations are unchanged
+    assert ensure_template(server, migrations, "test_template") == name
+    assert template_oid(server, name) == oid
+
+    uri = clone_template(server, name, "test_template_clone")
+    try:
+        with psycopg.connect(uri) as conn:
+            assert conn.execute("SELECT id FROM test").fetchall() == [(1,)]
+            assert conn.execute("SELECT count(*) FROM migration").fetchone() == (2,)
+    finally:
+        drop_database(server, "test_template_clone")
+
+
+def test_ensure_template_rebuilds(server: str, migrations: Path):
+    old = ensure_template(server, migrations, "test_template")
+
+    (migrations / "2_test.sql").write_text("INSERT INTO test VALUES (2);")
+    new = ensure_template(server, migrations, "test_template")
+
+    assert new != old
+    assert template_oid(server, old) is None
+
+    uri = clone_template(server, new, "test_template_clone")
+    try:
+        with psycopg.connect(uri) as conn:
+            assert conn.execute("SELECT id FROM test").fetchall() == [(2,)]
+    finally:
+        drop_database(server, "test_template_clone")
+
+
+def test_ensure_template_failure(server: str, migrations: Path):
+    (migrations / "3_test.sql").write_text("SELECT * FROM missing;")
+
+    with pytest.raises(MigrationError):
+        ensure_template(server, migrations, "test_template")
+
+    with psycopg.connect(server) as conn:
+        assert not conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname LIKE 'test_template_%'"
+        ).fetchall()
+
+
+def test_ensure_template_in_event_loop(server: str, migrations: Path):
+    # Like the pytest plugin under pytest-asyncio or anyio
+    async def build():
+        return ensure_template(server, migrations, "test_template")
+
+    name = asyncio.run(build())
+
+    assert template_oid(server, name) is not None
+
+
+def test_ensure_template_overlapping_prefixes(server: str, migrations: Path):
+    # Matched test_template_a's templates when _ was a LIKE wildcard
+    wildcard = ensure_template(server, migrations, "test_templateXa")
+    # Starts with test_template_a_ so matched when only the prefix was checked
+    longer = ensure_template(server, migrations, "test_template_a_b")
+
+    (migrations / "2_test.sql").write_text("INSERT INTO test VALUES (2);")
+    ensure_template(server, migrations, "test_template_a")
+    (migrations / "2_test.sql").write_text("INSERT INTO test VALUES (3);")
+    ensure_template(server, migrations, "test_template_a")
+
+    # Cleaning up test_template_a's stale templates leaves the others alone
+    assert template_oid(server, wildcard) is not None
+    assert template_oid(server, longer) is not None
+
+
+def test_ensure_template_python_migrations(server: str, migrations: Path):
+    (migrations / "3_test.py").write_text(
+        "def migrate(ctx):\n"
+        "    ctx.executemany('INSERT INTO test VALUES (%s)', [(2,), (3,)])\n"
+    )
+    (migrations / "4_test.sql").write_text("DELETE FROM test WHERE id = 3;")
+
+    name = ensure_template(server, migrations, "test_template")
+
+    uri = clone_template(server, name, "test_template_clone")
+    try:
+        with psycopg.connect(uri) as conn:
+            assert conn.execute("SELECT id FROM test ORDER BY id").fetchall() == [
+                (1,),
+                (2,),
+            ]
+            assert conn.execute("SELECT count(*) FROM migration").fetchone() == (4,)
+    finally:
+        drop_database(server, "test_template_clone")
+
+
+def test_template_command(server: str, migrations: Path):
+    result = runner.invoke(
+        app,
+        [
+            "template",
+            "--postgres-uri",
+            server,
+            "--migrations-directory",
+            str(migrations),
+            "--prefix",
+            "test_template",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "is up to date" in result.stdout
+
+
+def test_pytest_plugin(pytester: pytest.Pytester, server: str, migrations: Path):
+    pytester.makeini(f"""
+        [pytest]
+        petite_uri = {server}
+        petite_migrations_directory = {migrations}
+        petite_template_prefix = test_template
+        """)
+    pytester.makepyfile("""
+        import psycopg
+
+        def test_first(petite_database):
+            with psycopg.connect(petite_database) as conn:
+                conn.execute("INSERT INTO test VALUES (2)")
+
+        def test_isolated(petite_database):
+            with psycopg.connect(petite_database) as conn:
+                assert conn.execute("SELECT id FROM test").fetchall() == [(1,)]
+        """)
+
+    result = pytester.runpytest("-p", "petite.pytest_plugin")
+
+    result.assert_outcomes(passed=2)
+
+    # Test databases are dropped after each test
+    with psycopg.connect(server) as conn:
+        assert not conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname LIKE 'petite_test_%'"
+        ).fetchall()
+
+
+def test_pytest_plugin_not_configured(
+    pytester: pytest.Pytester, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.delenv("PETITE_TEST_URI", raising=False)
+
+    pytester.makepyfile("""
+        def test_database(petite_database):
+            pass
+        """)
+
+    result = pytester.runpytest("-p", "petite.pytest_plugin")
+
+    result.assert_outcomes(errors=1)
+    result.stdout.fnmatch_lines(["*petite needs --petite-uri*"])
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from petite import app
+
+from . import Database, database, new_database
+
+runner = CliRunner()
+
+
+def test_verify(new_database: str, tmp_path: Path):
+    mig_path = tmp_path / "migrations"
+    mig_path.mkdir()
+
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test();")
+    (mig_path / "2_test.sql").write_text("ALTER TABLE test ADD COLUMN a INT;")
+
+    # Tested elsewhere
+    db = Database(new_database)
+    db.create_migration_table()
+
+    result = runner.invoke(
+        app,
+        [
+            "apply",
+            "--migrations-directory",
+            str(mig_path),
+            "--postgres-uri",
+            new_database,
+        ],
+    )
+    assert result.exit_code == 0
+
+    verify_args = [
+        "verify",
+        "--migrations-directory",
+        str(mig_path),
+        "--postgres-uri",
+        new_database,
+    ]
+
+    result = runner.invoke(app, verify_args)
+
+    assert result.exit_code == 0
+    assert "Verified" in result.stdout
+
+    # Editing an applied migration and adding a new one
+    (mig_path / "1_test.sql").write_text("CREATE TABLE test(id INT);")
+    (mig_path / "3_test.sql").write_text("ALTER TABLE test ADD COLUMN b INT;")
+    (mig_path / "2_test.sql").unlink()
+
+    result = runner.invoke(app, verify_args)
+
+    assert result.exit_code == 1
+    assert "Modified migration 1_test.sql" in result.stdout
+    assert "Missing migration 2_test.sql" in result.stdout
+    assert "Unknown migration 3_test.sql" in result.stdout
+    assert "Drift detected" in result.stdout
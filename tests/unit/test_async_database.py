@@ -0,0 +1,25 @@
+import asyncio
+
+import psycopg
+import pytest
+from pytest_mock import MockerFixture
+
+from petite.utils.async_database import AsyncDatabase
+from petite.utils.errors import DatabaseConnectionError, InvalidMigration
+
+
+def test_connect_fail(mocker: MockerFixture):
+    mocker.patch(
+        "petite.utils.async_database.psycopg.connect",
+        side_effect=psycopg.OperationalError("connection refused"),
+    )
+
+    with pytest.raises(DatabaseConnectionError, match="connection refused"):
+        asyncio.run(AsyncDatabase.connect("fake_uri"))
+
+
+def test_apply_migrations_invalid_directive(mocker: MockerFixture):
+    db = AsyncDatabase(mocker.MagicMock())
+
+    with pytest.raises(InvalidMigration, match="1.sql"):
+        asyncio.run(db.apply_migrations([("1.sql", b"-- petite: transaction=maybe\n")]))
@@ -0,0 +1,20 @@
+from petite.utils.backfill import Backfill, chunk_query, throttle_delay
+
+
+def test_chunk_query():
+    backfill = Backfill("app.users", "user_id")
+
+    assert chunk_query(backfill, resuming=False).as_string(None) == (
+        'SELECT min("user_id")::text, max("user_id")::text, count(*) FROM ('
+        'SELECT "user_id" FROM "app"."users" ORDER BY "user_id" LIMIT %s) chunk'
+    )
+    assert 'WHERE "user_id" > %s ORDER BY' in chunk_query(
+        backfill, resuming=True
+    ).as_string(None)
+
+
+def test_throttle_delay():
+    assert throttle_delay(1000, 0.2, None) == 0
+    assert throttle_delay(1000, 0.2, 1000) == 0.8
+    # Already slower than the rate
+    assert throttle_delay(1000, 2.0, 1000) == 0
@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+
+from petite.utils.cache import MigrationCache
+from petite.utils.splitter import split_statements
+
+CONTENT = b"CREATE TABLE a();\nCOPY a FROM stdin;\n1\n\\.\nCREATE INDEX CONCURRENTLY ON a (b);"
+
+
+def test_split_cached(tmp_path: Path, mocker: MockerFixture):
+    cache = MigrationCache(tmp_path)
+
+    assert cache.split(CONTENT) == split_statements(CONTENT)
+
+    # Second split should be served from the cache without parsing
+    mock_split = mocker.patch("petite.utils.cache.split_statements")
+    assert cache.split(CONTENT) == split_statements(CONTENT)
+    mock_split.assert_not_called()
+
+
+def test_split_content_changed(tmp_path: Path):
+    cache = MigrationCache(tmp_path)
+
+    cache.split(CONTENT)
+    changed = CONTENT + b"\nSELECT 1;"
+
+    assert cache.split(changed) == split_statements(changed)
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def test_corrupt_entry_is_miss(tmp_path: Path):
+    cache = MigrationCache(tmp_path)
+
+    (tmp_path / f"{cache.key(CONTENT)}.json").write_text("{not json")
+
+    assert cache.get(cache.key(CONTENT)) is None
+    assert cache.split(CONTENT) == split_statements(CONTENT)
+
+
+def test_evict_least_recently_used(tmp_path: Path):
+    cache = MigrationCache(tmp_path, max_size=10**9)
+    contents = [f"SELECT {i};".encode() for i in range(3)]
+
+    for i, content in enumerate(contents):
+        cache.split(content)
+        entry = tmp_path / f"{cache.key(content)}.json"
+        os.utime(entry, (i, i))
+
+    entry_size = (tmp_path / f"{cache.key(contents[0])}.json").stat().st_size
+    cache.max_size = entry_size * 2
+    cache.evict()
+
+    assert cache.get(cache.key(contents[0])) is None
+    assert cache.get(cache.key(contents[1])) is not None
+    assert cache.get(cache.key(contents[2])) is not None
+
+
+def test_clear(tmp_path: Path):
+    cache = MigrationCache(tmp_path / "cache")
+
+    assert cache.clear() == 0
+
+    cache.split(b"SELECT 1;")
+    cache.split(b"SELECT 2;")
+
+    assert cache.clear() == 2
+    assert list((tmp_path / "cache").iterdir()) == []
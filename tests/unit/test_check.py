@@ -0,0 +1,103 @@
+from pathlib import Path
+
+from petite.utils import check
+from petite.utils.cache import MigrationCache
+from petite.utils.check import Problem, check_content, check_files, check_python
+
+
+def test_check_content_valid():
+    content = (
+        b"-- petite: transaction=off\n"
+        b"CREATE TABLE t (id int);\n"
+        b"COPY t FROM stdin;\n1\nnot sql\n\\.\n"
+        b"CREATE FUNCTION f() RETURNS int AS $$ SELEC; $$ LANGUAGE sql;\n"
+    )
+
+    assert check_content(content) == []
+
+
+def test_check_content_positions():
+    content = b"CREATE TABLE t (id int);\n\nSELECT 1; SELECT 1 1;\nSELECT (1\n"
+
+    problems = check_content(content)
+
+    assert [(problem.line, problem.column) for problem in problems] == [
+        (3, 20),
+        (4, 9),
+    ]
+
+
+def test_check_content_multiline_statement():
+    (problem,) = check_content(b"SELECT 1;\nSELECT *\nFROM t\nWHERE;\n")
+
+    assert problem.line == 4
+
+
+def test_check_content_after_multiline_statement():
+    content = b"CREATE TABLE a (\n  id int,\n  name text\n);\n\nSELECT FROM WHERE (;\n"
+
+    (problem,) = check_content(content)
+
+    assert problem.line == 6
+
+
+def test_check_content_after_copy_data():
+    (problem,) = check_content(b"COPY t FROM stdin;\n1\n2\n\\.\nSELECT (1;\n")
+
+    assert (problem.line, problem.column) == (5, 9)
+
+
+def test_check_content_directive():
+    (problem,) = check_content(b"-- petite: transaction=maybe\nSELECT 1;\n")
+
+    assert problem == Problem(1, 1, "Invalid value for transaction: 'maybe'")
+
+
+def test_check_content_unterminated_string():
+    (problem,) = check_content(b"SELECT 1;\nSELECT 'abc;\n")
+
+    assert problem.line == 2
+
+
+def test_check_python():
+    assert check_python(b"def migrate(ctx):\n    ctx.execute('SELECT 1')\n") == []
+
+    (problem,) = check_python(b"def migrate(ctx):\n    return (\n")
+
+    assert problem.line == 2
+
+
+def test_check_files_cache(tmp_path: Path, mocker):
+    (tmp_path / "1_test.sql").write_text("SELECT 1;")
+    (tmp_path / "2_test.sql").write_text("SELECT (1;")
+    paths = sorted(tmp_path.glob("*.sql"))
+    cache = MigrationCache(tmp_path / "cache")
+
+    first = check_files(paths, 1, cache)
+    assert first["1_test.sql"] == []
+    assert len(first["2_test.sql"]) == 1
+
+    # Unchanged files aren't parsed again
+    spy = mocker.spy(check, "check_file")
+    (tmp_path / "1_test.sql").write_text("SELECT 2;")
+
+    assert check_files(paths, 1, cache) == first
+    assert spy.call_args_list == [mocker.call(paths[0])]
+
+
+def test_check_files_process_pool(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(check, "SERIAL_THRESHOLD", 2)
+    for i in range(5):
+        (tmp_path / f"{i}_test.sql").write_text("SELECT 1;" if i % 2 else "SELEC 1;")
+    paths = sorted(tmp_path.glob("*.sql"))
+
+    results = check_files(paths, 2)
+
+    assert list(results) == [path.name for path in paths]
+    assert [bool(problems) for problems in results.values()] == [
+        True,
+        False,
+        True,
+        False,
+        True,
+    ]
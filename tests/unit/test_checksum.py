@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from petite.utils.checksum import checksum, checksum_files, find_drift
+
+
+def test_checksum_files(tmp_path: Path):
+    contents = {f"{i}_test.sql": f"SELECT {i};".encode() * (i * 1000) for i in range(5)}
+    for name, content in contents.items():
+        (tmp_path / name).write_bytes(content)
+
+    assert checksum_files((tmp_path / name for name in contents), workers=2) == {
+        name: checksum(content) for name, content in contents.items()
+    }
+
+
+def test_find_drift():
+    drift = find_drift(
+        {"1.sql": "a", "2.sql": "changed", "3.sql": "c", "5.sql": "e"},
+        {"1.sql": "a", "2.sql": "b", "3.sql": None, "4.sql": "d"},
+    )
+
+    assert drift.modified == ["2.sql"]
+    assert drift.missing == ["4.sql"]
+    assert drift.unknown == ["5.sql"]
+    assert drift.unchecked == ["3.sql"]
+
+
+def test_find_drift_clean():
+    assert find_drift({"1.sql": "a"}, {"1.sql": "a"}) == ([], [], [], [])
@@ -0,0 +1,53 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from petite.utils import copy_data
+from petite.utils.copy_data import iter_content_chunks, iter_file_chunks, sidecar_copy
+
+
+def test_sidecar_copy(tmp_path: Path):
+    (tmp_path / "data.csv").write_text("1,a\n")
+
+    assert sidecar_copy(
+        b"COPY test (id, name) FROM 'data.csv' WITH (FORMAT csv)", tmp_path
+    ) == (b"COPY test (id, name) FROM STDIN WITH (FORMAT csv)", tmp_path / "data.csv")
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        b"COPY test FROM stdin",
+        b"COPY test TO stdout",
+        # Absolute paths are left for the server to read
+        b"COPY test FROM '/var/lib/data.csv'",
+    ],
+)
+def test_sidecar_copy_not_sidecar(tmp_path: Path, statement):
+    assert sidecar_copy(statement, tmp_path) is None
+
+
+def test_sidecar_copy_missing_file(tmp_path: Path):
+    with pytest.raises(FileNotFoundError):
+        sidecar_copy(b"COPY test FROM 'missing.csv'", tmp_path)
+
+
+def test_sidecar_copy_in_memory():
+    with pytest.raises(ValueError):
+        sidecar_copy(b"COPY test FROM 'data.csv'", None)
+
+
+def test_iter_content_chunks(monkeypatch):
+    monkeypatch.setattr(copy_data, "CHUNK_SIZE", 4)
+
+    content = b"COPY;0123456789\\."
+
+    assert list(iter_content_chunks(content, 5, 15)) == [b"0123", b"4567", b"89"]
+
+
+def test_iter_file_chunks_compressed(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(copy_data, "CHUNK_SIZE", 4)
+    (tmp_path / "data.csv.gz").write_bytes(gzip.compress(b"1,a\n2,b\n"))
+
+    assert b"".join(iter_file_chunks(tmp_path / "data.csv.gz")) == b"1,a\n2,b\n"
@@ -1,14 +1,18 @@
+import psycopg
 import pytest
 import typer
 from pytest_mock import MockerFixture
 
+from petite.utils.checksum import checksum
+from petite.utils.file_system import MigrationFile
+from petite.utils.timeouts import RetryPolicy
+
 from . import Database
 
 
 def test_apply_migrations(mocker: MockerFixture):
     mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
-    mock_cursor = mocker.MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_cursor = mock_conn.cursor.return_value
 
     db = Database("fake_uri")
 
@@ -16,32 +20,152 @@ def test_apply_migrations(mocker: MockerFixture):
 
     mock_cursor.execute.assert_has_calls(
         [
-            mocker.call(mocker.ANY, ("1.sql",)),
-            mocker.call(b"A"),
-            mocker.call(mocker.ANY, ("2.sql",)),
-            mocker.call(b"B"),
+            mocker.call(mocker.ANY, ("1.sql", checksum(b"A"))),
+            mocker.call(b"A", None),
+            mocker.call(mocker.ANY, (1, 1, "1.sql")),
+            mocker.call(mocker.ANY, ("2.sql", checksum(b"B"))),
+            mocker.call(b"B", None),
+            mocker.call(mocker.ANY, (1, 1, "2.sql")),
         ]
     )
+    mock_conn.pipeline.assert_called_once()
+    mock_conn.commit.assert_called_once()
 
 
 def test_apply_migrations_fail(mocker: MockerFixture):
     mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
-    mock_cursor = mocker.MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_cursor = mock_conn.cursor.return_value
 
     # Mock the execute method of the cursor
-    mock_cursor.execute = [mocker.MagicMock(), Exception]
+    mock_cursor.execute.side_effect = [None, Exception]
 
     db = Database("fake_uri")
 
     with pytest.raises(typer.Exit):
         db.apply_migrations([("1.sql", b"A"), ("2.sql", b"B")])
 
+    mock_conn.rollback.assert_called_once()
+
+
+def test_apply_migrations_fail_pipelined(mocker: MockerFixture, capsys):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+
+    # Each statement gets its own cursor. In a pipeline the error surfaces on
+    # a later call, here the last one, but the failing statement is the
+    # first cursor that never received a result.
+    cursors = [mocker.MagicMock() for _ in range(5)]
+    cursors[3].pgresult = None
+    cursors[4].pgresult = None
+    cursors[4].execute.side_effect = Exception("syntax error")
+    mock_conn.cursor.side_effect = cursors
+
+    db = Database("fake_uri")
+
+    with pytest.raises(typer.Exit):
+        db.apply_migrations([("1.sql", b"A"), ("2.sql", b"B")])
+
+    output = capsys.readouterr().out
+    assert "Applied migration 1.sql" in output
+    assert "Error applying migration: 2.sql" in output
+    assert "syntax error" in output
+    for cur in cursors:
+        cur.close.assert_called_once()
+
+
+def test_apply_migrations_lock_timeout_retry(mocker: MockerFixture, capsys):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+    mock_cursor = mock_conn.cursor.return_value
+    mock_sleep = mocker.patch("petite.utils.migrator.time.sleep")
+
+    mock_cursor.execute.side_effect = [
+        None,
+        psycopg.errors.LockNotAvailable("lock timeout"),
+        None,
+        None,
+        None,
+    ]
+
+    db = Database("fake_uri")
+
+    db.apply_migrations([("1.sql", b"A")], retry=RetryPolicy(1))
+
+    # The whole transaction is rolled back and run again
+    mock_conn.rollback.assert_called_once()
+    mock_conn.commit.assert_called_once()
+    mock_sleep.assert_called_once()
+    assert "Lock timeout applying migration 1.sql" in capsys.readouterr().out
+
+
+def test_apply_migrations_lock_timeout_retries_exhausted(mocker: MockerFixture):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+    mock_cursor = mock_conn.cursor.return_value
+    mock_sleep = mocker.patch("petite.utils.migrator.time.sleep")
+
+    mock_cursor.execute.side_effect = psycopg.errors.LockNotAvailable("lock timeout")
+
+    db = Database("fake_uri")
+
+    with pytest.raises(typer.Exit):
+        db.apply_migrations([("1.sql", b"A")], retry=RetryPolicy(2))
+
+    assert mock_sleep.call_count == 2
+    assert mock_conn.rollback.call_count == 3
+    mock_conn.commit.assert_not_called()
+
+
+def test_apply_migrations_no_transaction_lock_timeout_retry(mocker: MockerFixture):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+    mock_cursor = mock_conn.cursor.return_value
+    mock_sleep = mocker.patch("petite.utils.migrator.time.sleep")
+
+    mock_cursor.execute.side_effect = [
+        None,
+        None,
+        psycopg.errors.LockNotAvailable("lock timeout"),
+        None,
+        None,
+    ]
+
+    db = Database("fake_uri")
+
+    db.apply_migrations(
+        [("1.sql", b"SELECT 1;\nSELECT 2;")], no_transaction=True, retry=RetryPolicy(1)
+    )
+
+    # Only the statement that timed out is run again
+    mock_cursor.execute.assert_has_calls(
+        [
+            mocker.call(mocker.ANY, ("1.sql", mocker.ANY)),
+            mocker.call(b"SELECT 1", None),
+            mocker.call(b"SELECT 2", None),
+            mocker.call(b"SELECT 2", None),
+        ]
+    )
+    mock_sleep.assert_called_once()
+    mock_conn.rollback.assert_not_called()
+
+
+def test_apply_migrations_directive_timeouts(mocker: MockerFixture):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+    mock_cursor = mock_conn.cursor.return_value
+
+    db = Database("fake_uri")
+
+    db.apply_migrations(
+        [("1.sql", b"-- petite: lock_timeout=1s\nA;"), ("2.sql", b"B;")]
+    )
+
+    # The migration's timeout is reset to the session's after it
+    calls = mock_cursor.execute.call_args_list
+    assert calls[1] == mocker.call(mocker.ANY, ("lock_timeout", "1s"))
+    assert calls[2] == mocker.call(b"A", None)
+    assert calls[3] == mocker.call(mocker.ANY, ("lock_timeout", None))
+    mock_conn.pipeline.assert_called_once()
+
 
 def test_apply_migrations_no_transaction(mocker: MockerFixture):
     mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
-    mock_cursor = mocker.MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+    mock_cursor = mock_conn.cursor.return_value
 
     db = Database("fake_uri")
 
@@ -57,10 +181,46 @@ def test_apply_migrations_no_transaction(mocker: MockerFixture):
 
     mock_cursor.execute.assert_has_calls(
         [
-            mocker.call(mocker.ANY, ("1.sql",)),
-            mocker.call(b"CREATE USER new_test WITH PASSWORD ''"),
-            mocker.call(b"CREATE DATABASE new_test OWNER new_test"),
-            mocker.call(b"GRANT ALL PRIVILEGES ON DATABASE new_test TO new_test"),
+            mocker.call(mocker.ANY, ("1.sql", mocker.ANY)),
+            mocker.call(b"CREATE USER new_test WITH PASSWORD ''", None),
+            mocker.call(b"CREATE DATABASE new_test OWNER new_test", None),
+            mocker.call(b"GRANT ALL PRIVILEGES ON DATABASE new_test TO new_test", None),
         ]
     )
     assert mock_conn.autocommit is True
+    mock_conn.pipeline.assert_not_called()
+
+    # Timings of each statement are recorded together
+    mock_cursor.executemany.assert_called_once()
+    recorded = mock_cursor.executemany.call_args[0][1]
+    assert [row[:3] for row in recorded] == [
+        ("1.sql", 0, "CREATE USER"),
+        ("1.sql", 1, "CREATE DATABASE"),
+        ("1.sql", 2, "GRANT"),
+    ]
+
+
+def test_apply_migrations_from_files(mocker: MockerFixture, tmp_path):
+    mock_conn = mocker.patch("petite.utils.database.psycopg.connect").return_value
+    mock_cursor = mock_conn.cursor.return_value
+    mock_pipeline = mock_conn.pipeline.return_value.__enter__.return_value
+    mocker.patch("petite.utils.migrator.SYNC_EVERY", 2)
+
+    (tmp_path / "1.sql").write_bytes(b"SELECT 1;\nSELECT 2;\nSELECT 3;")
+
+    db = Database("fake_uri")
+
+    db.apply_migrations([("1.sql", MigrationFile(tmp_path / "1.sql"))])
+
+    mock_cursor.execute.assert_has_calls(
+        [
+            mocker.call(
+                mocker.ANY, ("1.sql", checksum(b"SELECT 1;\nSELECT 2;\nSELECT 3;"))
+            ),
+            mocker.call(b"SELECT 1", None),
+            mocker.call(b"SELECT 2", None),
+            mocker.call(b"SELECT 3", None),
+        ]
+    )
+    # Synced every two statements so cursors don't pile up
+    assert mock_pipeline.sync.call_count == 2
@@ -0,0 +1,57 @@
+import pytest
+
+from petite.utils.backfill import Backfill
+from petite.utils.directives import Directives, parse_directives
+from petite.utils.timeouts import Timeouts
+
+
+@pytest.mark.parametrize(
+    "content,expected",
+    [
+        (b"CREATE TABLE test();", Directives()),
+        (b"-- petite: transaction=off\nCREATE INDEX;", Directives(transaction=False)),
+        (b"-- PETITE: Transaction=ON\n", Directives(transaction=True)),
+        (
+            b"-- A description\n\n-- petite: lock_timeout=5s, statement_timeout=1min\n",
+            Directives(timeouts=Timeouts("5s", "1min")),
+        ),
+        (
+            b"-- petite: transaction=off\n-- petite: lock_timeout=100ms\n",
+            Directives(False, Timeouts(lock_timeout="100ms")),
+        ),
+        (
+            b"-- petite: baseline=1_init.sql\n-- Baseline of 1 migration\n",
+            Directives(baseline="1_init.sql"),
+        ),
+        (
+            b"-- petite: backfill=users\n",
+            Directives(backfill=Backfill("users")),
+        ),
+        (
+            b"-- petite: backfill=app.users, key=user_id, batch_size=500, "
+            b"rows_per_second=1e4, transaction=off\n",
+            Directives(False, backfill=Backfill("app.users", "user_id", 500, 1e4)),
+        ),
+        # Only the header before the first statement is read
+        (b"SELECT 1;\n-- petite: transaction=off\n", Directives()),
+    ],
+)
+def test_parse_directives(content, expected):
+    assert parse_directives(content) == expected
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"-- petite: transaction=maybe\n",
+        b"-- petite: unknown=1\n",
+        b"-- petite: transaction off\n",
+        b"-- petite: batch_size=100\n",
+        b"-- petite: backfill=users, batch_size=0\n",
+        b"-- petite: backfill=users, rows_per_second=fast\n",
+        b"-- petite: backfill=users, transaction=on\n",
+    ],
+)
+def test_parse_directives_invalid(content):
+    with pytest.raises(ValueError):
+        parse_directives(content)
@@ -0,0 +1,175 @@
+import json
+
+import pytest
+import typer
+from rich import print
+
+from petite.utils.events import (
+    MIGRATION,
+    PHASE,
+    STATEMENT,
+    EventLog,
+    JsonLinesSink,
+    PrometheusSink,
+    SpanSink,
+    record_run,
+)
+from petite.utils.exits import fail
+
+
+class ListSink:
+    def __init__(self):
+        self.events = []
+        self.closed = False
+
+    def write(self, event):
+        self.events.append(event)
+
+    def close(self):
+        self.closed = True
+
+
+def test_event_log_disabled():
+    events = EventLog()
+
+    with events.timed(PHASE, phase="scan") as fields:
+        fields["files"] = 1
+
+    assert not events.enabled
+
+
+def test_event_log_timed():
+    sink = ListSink()
+    events = EventLog([sink])
+
+    with events.timed(PHASE, phase="scan") as fields:
+        fields["files"] = 2
+
+    [event] = sink.events
+    assert event["event"] == PHASE
+    assert event["files"] == 2
+    assert event["duration_ms"] >= 0
+
+
+def test_json_lines_sink(tmp_path):
+    with open(tmp_path / "events", "w") as file:
+        EventLog([JsonLinesSink(file)]).emit(PHASE, phase="scan")
+
+    assert json.loads((tmp_path / "events").read_text()) == {
+        "event": PHASE,
+        "phase": "scan",
+    }
+
+
+def test_record_run_failure(capsys):
+    sink = ListSink()
+
+    with pytest.raises(typer.Exit):
+        with record_run(EventLog([sink]), "apply", quiet=True) as run:
+            run["applied"] = 0
+            fail("[bold red]Error[/] applying migration: [b]1.sql[/]!")
+
+    assert capsys.readouterr().out == ""
+    assert sink.closed
+
+    [event] = sink.events
+    assert event["status"] == "failed"
+    assert event["applied"] == 0
+    assert event["error"] == "Error applying migration: 1.sql!"
+
+
+def test_record_run_exception():
+    sink = ListSink()
+
+    with pytest.raises(ValueError):
+        with record_run(EventLog([sink]), "apply"):
+            raise ValueError("Bad value")
+
+    assert sink.events[0]["status"] == "failed"
+    assert sink.events[0]["error"] == "Bad value"
+
+
+def test_record_run_success(capsys):
+    sink = ListSink()
+
+    with record_run(EventLog([sink]), "apply"):
+        print("Shown")
+
+    assert "Shown" in capsys.readouterr().out
+    assert sink.events[0]["status"] == "succeeded"
+    assert "error" not in sink.events[0]
+
+
+def run_events():
+    return [
+        {"event": PHASE, "phase": "scan", "start": 10.0, "duration_ms": 1.0},
+        {
+            "event": MIGRATION,
+            "name": '1_"a".sql',
+            "status": "applied",
+            "start": 10.1,
+            "duration_ms": 500.0,
+            "bytes": 20,
+        },
+        {
+            "event": STATEMENT,
+            "migration": '1_"a".sql',
+            "index": 0,
+            "kind": "CREATE TABLE",
+            "start": 10.1,
+            "duration_ms": 400.0,
+            "bytes": 20,
+        },
+        {
+            "event": "run",
+            "command": "apply",
+            "status": "succeeded",
+            "start": 10.0,
+            "duration_ms": 1000.0,
+        },
+    ]
+
+
+def test_prometheus_sink(tmp_path):
+    path = tmp_path / "petite.prom"
+    events = EventLog([PrometheusSink(path)])
+    for event in run_events():
+        events.emit(**event)
+    events.close()
+
+    metrics = path.read_text().splitlines()
+
+    assert "petite_apply_success 1" in metrics
+    assert "petite_apply_last_run_timestamp_seconds 11.0" in metrics
+    assert "petite_apply_migrations_applied 1" in metrics
+    assert 'petite_apply_phase_duration_seconds{phase="scan"} 0.001' in metrics
+    assert 'petite_migration_duration_seconds{migration="1_\\"a\\".sql"} 0.5' in metrics
+    assert "# TYPE petite_migration_bytes gauge" in metrics
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_span_sink(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    events = EventLog([SpanSink(path)])
+    for event in run_events():
+        events.emit(**event)
+    events.close()
+
+    [request] = [json.loads(line) for line in path.read_text().splitlines()]
+    spans = {
+        span["name"]: span
+        for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+
+    root = spans["petite apply"]
+    assert root["parentSpanId"] == ""
+    assert spans["scan"]["parentSpanId"] == root["spanId"]
+    assert spans['migration 1_"a".sql']["parentSpanId"] == root["spanId"]
+    assert (
+        spans["CREATE TABLE"]["parentSpanId"] == spans['migration 1_"a".sql']["spanId"]
+    )
+    assert spans["CREATE TABLE"]["startTimeUnixNano"] == "10100000000"
+    assert spans["CREATE TABLE"]["endTimeUnixNano"] == "10500000000"
+    assert {"key": "petite.bytes", "value": {"intValue": "20"}} in spans[
+        "CREATE TABLE"
+    ]["attributes"]
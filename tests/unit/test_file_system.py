@@ -0,0 +1,122 @@
+import gzip
+import mmap
+from pathlib import Path
+
+import pytest
+import typer
+
+from petite.utils.checksum import checksum
+from petite.utils.compression import open_decompressed
+from petite.utils.file_system import (
+    FileSystem,
+    MigrationFile,
+    content_checksum,
+    list_migration_files,
+    open_content,
+)
+
+
+def test_get_migration_is_lazy(tmp_path: Path):
+    (tmp_path / "1_test.sql").write_bytes(b"SELECT 1;")
+
+    migration = FileSystem(tmp_path).get_migration("1_test.sql")
+    assert isinstance(migration, MigrationFile)
+
+    # Changes before opening are seen since nothing was read yet
+    (tmp_path / "1_test.sql").write_bytes(b"SELECT 2;")
+
+    with migration.open() as content:
+        assert isinstance(content, mmap.mmap)
+        assert content[:] == b"SELECT 2;"
+
+    assert migration.checksum() == checksum(b"SELECT 2;")
+
+
+def test_open_empty_migration(tmp_path: Path):
+    (tmp_path / "1_test.sql").write_bytes(b"")
+
+    with MigrationFile(tmp_path / "1_test.sql").open() as content:
+        assert content == b""
+
+
+def test_in_memory_content():
+    with open_content(b"SELECT 1;") as content:
+        assert content == b"SELECT 1;"
+
+    assert content_checksum(b"SELECT 1;") == checksum(b"SELECT 1;")
+
+
+def test_list_migration_files(tmp_path: Path):
+    (tmp_path / "2_b.sql").write_text("")
+    (tmp_path / "1_a.sql").write_text("")
+    (tmp_path / "3_c.py").write_text("")
+    (tmp_path / "4_d.sql.gz").write_text("")
+    (tmp_path / "5_e.sql.zst").write_text("")
+    (tmp_path / "notes.txt").write_text("")
+    (tmp_path / "dir.sql").mkdir()
+    # Modules that live next to Python migrations aren't migrations
+    (tmp_path / "__init__.py").write_text("")
+    (tmp_path / "conftest.py").write_text("")
+    (tmp_path / "helpers.py").write_text("def shared(): pass\n")
+    (tmp_path / "_1_private.py").write_text("")
+
+    assert list_migration_files(tmp_path) == [
+        "1_a.sql",
+        "2_b.sql",
+        "3_c.py",
+        "4_d.sql.gz",
+        "5_e.sql.zst",
+    ]
+
+
+def test_compressed_migration(tmp_path: Path):
+    (tmp_path / "1_test.sql.gz").write_bytes(gzip.compress(b"SELECT 1;"))
+
+    migration = MigrationFile(tmp_path / "1_test.sql.gz")
+
+    with migration.open() as content:
+        assert content[:] == b"SELECT 1;"
+
+    # The same as the uncompressed migration so recompressing changes nothing
+    assert migration.checksum() == checksum(b"SELECT 1;")
+
+
+def test_compressed_migration_decompressed_once(tmp_path: Path, mocker):
+    (tmp_path / "1_test.sql.gz").write_bytes(gzip.compress(b"SELECT 1;"))
+    decompress = mocker.patch(
+        "petite.utils.file_system.open_decompressed", wraps=open_decompressed
+    )
+
+    migration = MigrationFile(tmp_path / "1_test.sql.gz")
+
+    # Planning, hashing, applying and explaining errors all reuse one copy
+    for _ in range(3):
+        with migration.open() as content:
+            assert content[:] == b"SELECT 1;"
+    assert migration.checksum() == checksum(b"SELECT 1;")
+
+    assert decompress.call_count == 1
+
+    migration.close()
+    with migration.open() as content:
+        assert content[:] == b"SELECT 1;"
+
+    assert decompress.call_count == 2
+
+
+def test_zstd_compressed_migration(tmp_path: Path):
+    zstandard = pytest.importorskip("zstandard")
+    (tmp_path / "1_test.sql.zst").write_bytes(
+        zstandard.ZstdCompressor().compress(b"SELECT 1;")
+    )
+
+    with MigrationFile(tmp_path / "1_test.sql.zst").open() as content:
+        assert content[:] == b"SELECT 1;"
+
+
+def test_zstd_unavailable(tmp_path: Path, mocker):
+    mocker.patch("petite.utils.file_system.zstd_available", return_value=False)
+    (tmp_path / "1_test.sql.zst").write_bytes(b"")
+
+    with pytest.raises(typer.Exit):
+        FileSystem(tmp_path).get_migration_files()
@@ -0,0 +1,197 @@
+import pytest
+
+from petite.utils.lint import (
+    ACCESS_EXCLUSIVE,
+    ROW_EXCLUSIVE,
+    SHARE,
+    SHARE_ROW_EXCLUSIVE,
+    SHARE_UPDATE_EXCLUSIVE,
+    WARNING,
+    Linter,
+)
+
+# Keeps missing-lock-timeout out of results that aren't about it
+HEADER = b"-- petite: lock_timeout=5s\n"
+
+
+def lint(content: bytes, linter: Linter = None):
+    return (linter or Linter()).lint("1_test.sql", HEADER + content)
+
+
+@pytest.mark.parametrize(
+    "statement, lock, rewrite, rules",
+    [
+        (
+            b"ALTER TABLE t ALTER COLUMN a TYPE bigint",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["alter-column-type"],
+        ),
+        (
+            b"ALTER TABLE t ADD COLUMN a uuid DEFAULT gen_random_uuid()",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["volatile-default"],
+        ),
+        (
+            b"ALTER TABLE t ADD COLUMN a bigserial",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["volatile-default"],
+        ),
+        # Non volatile defaults are stored once instead of written to every row
+        (
+            b"ALTER TABLE t ADD COLUMN a timestamptz DEFAULT now()",
+            ACCESS_EXCLUSIVE,
+            False,
+            [],
+        ),
+        (b"CREATE INDEX i ON t (a)", SHARE, False, ["create-index"]),
+        (
+            b"CREATE UNIQUE INDEX CONCURRENTLY i ON t (a)",
+            SHARE_UPDATE_EXCLUSIVE,
+            False,
+            [],
+        ),
+        (
+            b"ALTER TABLE t ALTER COLUMN a SET NOT NULL",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["set-not-null"],
+        ),
+        (
+            b"ALTER TABLE t ADD CONSTRAINT c CHECK (a > 0)",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["constraint-not-valid"],
+        ),
+        (
+            b"ALTER TABLE t ADD CONSTRAINT fk FOREIGN KEY (a) REFERENCES u (id)",
+            SHARE_ROW_EXCLUSIVE,
+            True,
+            ["constraint-not-valid"],
+        ),
+        (
+            b"ALTER TABLE t ADD CONSTRAINT fk FOREIGN KEY (a) REFERENCES u (id) NOT VALID",
+            SHARE_ROW_EXCLUSIVE,
+            False,
+            [],
+        ),
+        (b"ALTER TABLE t VALIDATE CONSTRAINT fk", SHARE_UPDATE_EXCLUSIVE, False, []),
+        (
+            b"ALTER TABLE t ADD PRIMARY KEY (id)",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["add-unique-constraint"],
+        ),
+        (
+            b"ALTER TABLE t SET TABLESPACE slow",
+            ACCESS_EXCLUSIVE,
+            True,
+            ["table-rewrite"],
+        ),
+        (b"VACUUM (FULL, VERBOSE) t", ACCESS_EXCLUSIVE, True, ["table-rewrite"]),
+        (b"VACUUM t", SHARE_UPDATE_EXCLUSIVE, False, []),
+        (b"CLUSTER t USING i", ACCESS_EXCLUSIVE, True, ["table-rewrite"]),
+        (b"REINDEX TABLE t", SHARE, False, ["reindex"]),
+        (b"REINDEX TABLE CONCURRENTLY t", SHARE_UPDATE_EXCLUSIVE, False, []),
+        (b"LOCK TABLE t IN SHARE MODE", SHARE, False, ["lock-table"]),
+        (b"UPDATE t SET a = 1", ROW_EXCLUSIVE, False, ["unbatched-update"]),
+        (b"UPDATE t SET a = 1 WHERE id < 1000", ROW_EXCLUSIVE, False, []),
+        (b"INSERT INTO t VALUES (1)", ROW_EXCLUSIVE, False, []),
+        (b"DROP INDEX CONCURRENTLY i", SHARE_UPDATE_EXCLUSIVE, False, []),
+    ],
+)
+def test_lint_statement(statement, lock, rewrite, rules):
+    (report,) = lint(statement + b";")
+
+    assert report.table == ("i" if b"DROP INDEX" in statement else "t")
+    assert report.lock == lock
+    assert report.rewrite == rewrite
+    assert [finding.rule for finding in report.findings] == rules
+
+
+def test_lint_new_table():
+    reports = lint(
+        b"CREATE TABLE t (id int);\n"
+        b"CREATE INDEX i ON t (id);\n"
+        b"ALTER TABLE t ALTER COLUMN id SET NOT NULL;\n"
+    )
+
+    assert [report.findings for report in reports] == [[], [], []]
+    assert reports[1].lock is None
+
+    # Only empty within the migration that created it
+    (report,) = Linter().lint("2_test.sql", HEADER + b"CREATE INDEX i ON t (id);")
+    assert report.findings
+
+
+def test_lint_validated_check():
+    linter = Linter()
+    lint(
+        b"ALTER TABLE t ADD CONSTRAINT a_nn CHECK (a IS NOT NULL) NOT VALID;\n"
+        b"ALTER TABLE t VALIDATE CONSTRAINT a_nn;\n",
+        linter,
+    )
+
+    # A later migration can rely on the validated check
+    (report,) = lint(b"ALTER TABLE t ALTER COLUMN a SET NOT NULL;", linter)
+    assert report.findings == []
+    assert not report.rewrite
+
+
+def test_lint_ignore_comment():
+    reports = lint(
+        b"CREATE INDEX i ON t (a); -- petite-lint: ignore create-index\n"
+        b"-- petite-lint: ignore create-index, lock-table\n"
+        b"CREATE INDEX j ON t (a);\n"
+    )
+
+    # Comments after a statement belong to it not the next statement
+    assert [len(report.findings) for report in reports] == [1, 0]
+
+
+def test_lint_ignore_comment_first_line():
+    # Without a statement before it the first line is the comment's own
+    [report] = Linter().lint(
+        "1_test.sql", b"-- petite-lint: ignore create-index\nCREATE INDEX i ON t (a);"
+    )
+
+    assert "create-index" not in [finding.rule for finding in report.findings]
+
+
+def test_lint_configured_rules():
+    linter = Linter(ignored=["create-index"], warnings=["set-not-null"])
+    reports = lint(
+        b"CREATE INDEX i ON t (a);\nALTER TABLE t ALTER COLUMN a SET NOT NULL;\n",
+        linter,
+    )
+
+    assert reports[0].findings == []
+    assert reports[1].findings[0].severity == WARNING
+
+    with pytest.raises(ValueError):
+        Linter(ignored=["unknown"])
+
+
+def test_lint_missing_lock_timeout():
+    reports = Linter().lint(
+        "1_test.sql",
+        b"ALTER TABLE t DROP COLUMN a;\nALTER TABLE t DROP COLUMN b;\n",
+    )
+
+    # Reported once per migration
+    assert [finding.rule for finding in reports[0].findings] == ["missing-lock-timeout"]
+    assert reports[1].findings == []
+
+
+def test_lint_line_numbers():
+    reports = lint(
+        b"\nCOPY t FROM stdin;\n1\n2\n\\.\n"
+        b"CREATE INDEX i\nON t (a);\nUPDATE t SET a = 1;\n"
+    )
+
+    assert [(report.kind, report.line) for report in reports] == [
+        ("CREATE INDEX", 7),
+        ("UPDATE", 9),
+    ]
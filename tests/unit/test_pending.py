@@ -0,0 +1,51 @@
+from petite.utils.pending import diff_migrations, find_pending
+
+
+def test_diff_migrations():
+    files = ["1.sql", "2.sql", "3.sql", "5.sql", "6.sql"]
+    applied = ["1.sql", "3.sql", "4.sql", "5.sql"]
+
+    assert diff_migrations(files, applied) == (["2.sql"], ["6.sql"])
+
+
+def test_diff_migrations_nothing_applied():
+    assert diff_migrations(["1.sql", "2.sql"], []) == ([], ["1.sql", "2.sql"])
+
+
+def test_diff_migrations_everything_applied():
+    assert diff_migrations(["1.sql"], ["0.sql", "1.sql"]) == ([], [])
+
+
+def test_find_pending(tmp_path):
+    result = find_pending(tmp_path, ["1.sql", "2.sql", "3.sql"], ["1.sql", "3.sql"])
+
+    assert result.last_applied == "3.sql"
+    assert result.pending == []
+    assert result.out_of_order == ["2.sql"]
+    assert not result.diverged
+
+
+def test_find_pending_diverged(tmp_path):
+    result = find_pending(tmp_path, ["1.sql", "2.sql"], ["1.sql", "3.sql"])
+
+    assert result.diverged
+
+
+def test_find_pending_baseline(tmp_path):
+    (tmp_path / "2_b_baseline.sql").write_text(
+        "-- petite: baseline=2_b.sql\nCREATE TABLE a ();\n"
+    )
+    files = ["2_b_baseline.sql", "3_c.sql"]
+
+    result = find_pending(tmp_path, files, ["1_a.sql", "2_b.sql"])
+
+    assert result.baselines == ["2_b_baseline.sql"]
+    assert result.pending == ["3_c.sql"]
+    assert result.out_of_order == []
+    assert not result.diverged
+
+    # A fresh database applies the baseline like any other migration
+    result = find_pending(tmp_path, files, [])
+
+    assert result.baselines == []
+    assert result.pending == files
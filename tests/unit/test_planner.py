@@ -0,0 +1,109 @@
+import pytest
+
+from petite.utils.file_system import MigrationFile
+from petite.utils.planner import plan_migrations
+from petite.utils.splitter import split_statements
+from petite.utils.timeouts import Timeouts
+
+
+def plan(migrations, no_transaction=False):
+    return [
+        (batch.transactional, [migration.name for migration in batch.migrations])
+        for batch in plan_migrations(migrations, split_statements, no_transaction)
+    ]
+
+
+def test_plan_migrations_groups_transactional():
+    migrations = [
+        ("1.sql", b"CREATE TABLE a();"),
+        ("2.sql", b"CREATE TABLE b();"),
+        ("3.sql", b"CREATE INDEX CONCURRENTLY ON a (id);"),
+        ("4.sql", b"VACUUM a;"),
+        ("5.sql", b"CREATE TABLE c();"),
+    ]
+
+    assert plan(migrations) == [
+        (True, ["1.sql", "2.sql"]),
+        (False, ["3.sql", "4.sql"]),
+        (True, ["5.sql"]),
+    ]
+
+
+def test_plan_migrations_directives():
+    migrations = [
+        ("1.sql", b"-- petite: transaction=off\nCREATE TABLE a();"),
+        ("2.sql", b"-- petite: transaction=on\nDO $$ BEGIN VACUUM; END $$;"),
+        ("3.sql", b"-- petite: lock_timeout=1s\nCREATE TABLE b();"),
+    ]
+
+    assert plan(migrations) == [(False, ["1.sql"]), (True, ["2.sql", "3.sql"])]
+    assert plan_migrations(migrations, split_statements)[1].migrations[
+        1
+    ].timeouts == Timeouts(lock_timeout="1s")
+
+
+def test_plan_migrations_no_transaction():
+    migrations = [("1.sql", b"CREATE TABLE a();"), ("2.sql", b"CREATE TABLE b();")]
+
+    assert plan(migrations, no_transaction=True) == [(False, ["1.sql", "2.sql"])]
+
+
+def test_plan_migrations_invalid_directive():
+    with pytest.raises(ValueError, match="1.sql"):
+        plan([("1.sql", b"-- petite: transaction=sometimes\n")])
+
+
+def test_plan_migrations_backfill():
+    backfill = b"-- petite: backfill=a\nUPDATE a SET b = 1 WHERE id BETWEEN $1 AND $2;"
+    migrations = [
+        ("1.sql", b"-- petite: transaction=off\nCREATE TABLE a();"),
+        ("2.sql", backfill),
+        ("3.sql", backfill),
+        ("4.sql", b"-- petite: transaction=off\nCREATE TABLE b();"),
+    ]
+
+    # Each backfill commits its own chunks so is never grouped
+    assert plan(migrations) == [
+        (False, ["1.sql"]),
+        (False, ["2.sql"]),
+        (False, ["3.sql"]),
+        (False, ["4.sql"]),
+    ]
+
+
+def test_plan_migrations_backfill_statements():
+    with pytest.raises(ValueError, match="exactly one statement"):
+        plan([("1.sql", b"-- petite: backfill=a\nSELECT 1;\nSELECT 2;")])
+
+
+def test_plan_migrations_python():
+    migrations = [
+        ("1.sql", b"CREATE TABLE a();"),
+        # Not split or parsed for directives
+        ("2.py", b"-- petite: transaction=off\ndef migrate(ctx): pass\n"),
+        ("3.sql", b"CREATE TABLE b();"),
+    ]
+
+    assert plan(migrations, no_transaction=False) == [
+        (True, ["1.sql"]),
+        (True, ["2.py"]),
+        (True, ["3.sql"]),
+    ]
+    assert plan_migrations(migrations, split_statements)[1].migrations[0].python
+
+
+def test_plan_migrations_releases_pages(tmp_path, mocker):
+    mocker.patch("petite.utils.planner.RELEASE_EVERY", 20)
+    release_pages = mocker.patch("petite.utils.planner.release_pages")
+    (tmp_path / "1.sql").write_bytes(b"CREATE TABLE a();\n" * 10)
+
+    assert plan([("1.sql", MigrationFile(tmp_path / "1.sql"))]) == [(True, ["1.sql"])]
+
+    # Pages are let go of while scanning rather than all staying resident
+    assert [call.args[1] for call in release_pages.call_args_list] == [
+        34,
+        70,
+        106,
+        142,
+        178,
+    ]
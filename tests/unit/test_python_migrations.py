@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import pytest
+
+from petite.utils.file_system import MigrationFile
+from petite.utils.python_migrations import load_migration
+
+
+def test_load_migration(tmp_path: Path):
+    (tmp_path / "1_test.py").write_text(
+        "import pathlib\n\ndef migrate(ctx):\n    return pathlib.Path(__file__).name\n"
+    )
+
+    migrate = load_migration("1_test.py", MigrationFile(tmp_path / "1_test.py"))
+
+    assert migrate(None) == "1_test.py"
+
+
+def test_load_migration_without_migrate():
+    with pytest.raises(ValueError, match="1_test.py doesn't define migrate"):
+        load_migration("1_test.py", b"MIGRATE = 1\n")
+
+
+def test_load_migration_syntax_error():
+    with pytest.raises(SyntaxError):
+        load_migration("1_test.py", b"def migrate(ctx)\n")
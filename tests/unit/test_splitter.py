@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from petite.utils.splitter import Statement, classify_statement, split_statements
+
+
+def statement_text(content: bytes):
+    return [content[s.start : s.end] for s in split_statements(content)]
+
+
+def test_split_statements_offsets():
+    content = b"CREATE TABLE a();\n  CREATE TABLE b();"
+
+    assert split_statements(content) == [
+        Statement(0, 16, "CREATE TABLE"),
+        Statement(20, 36, "CREATE TABLE"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content,expected",
+    [
+        (b"SELECT 1; SELECT 2", [b"SELECT 1", b"SELECT 2"]),
+        (b"SELECT 1;\n\n  ", [b"SELECT 1"]),
+        (b";;  ;\n-- only a comment\n/* and another */", []),
+        (b"-- header\nSELECT 1 ;", [b"SELECT 1"]),
+        (b"SELECT 'a;b''c;'; SELECT 2", [b"SELECT 'a;b''c;'", b"SELECT 2"]),
+        (b"SELECT E'it\\'s; fine'; SELECT 2", [b"SELECT E'it\\'s; fine'", b"SELECT 2"]),
+        # Backslashes are not escapes in standard strings
+        (b"SELECT 'a\\'; SELECT 2", [b"SELECT 'a\\'", b"SELECT 2"]),
+        (b'SELECT "a;""b"; SELECT 2', [b'SELECT "a;""b"', b"SELECT 2"]),
+        (b"SELECT 1 -- a; b\n; SELECT 2", [b"SELECT 1 -- a; b", b"SELECT 2"]),
+        (
+            b"SELECT /* a; /* nested; */ b; */ 1; SELECT 2",
+            [b"SELECT /* a; /* nested; */ b; */ 1", b"SELECT 2"],
+        ),
+        (
+            b"CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql; SELECT 2",
+            [
+                b"CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql",
+                b"SELECT 2",
+            ],
+        ),
+        (
+            b"DO $body$ BEGIN RAISE NOTICE '$$;'; END $body$; SELECT 2",
+            [b"DO $body$ BEGIN RAISE NOTICE '$$;'; END $body$", b"SELECT 2"],
+        ),
+        (
+            b"SELECT $1; SELECT a$b; SELECT 2",
+            [b"SELECT $1", b"SELECT a$b", b"SELECT 2"],
+        ),
+        (b"SELECT 'unterminated; SELECT 2", [b"SELECT 'unterminated; SELECT 2"]),
+    ],
+)
+def test_split_statements(content, expected):
+    assert statement_text(content) == expected
+
+
+@pytest.mark.parametrize("quote", [b"'", b"E'", b'"'])
+def test_split_statements_unterminated_quote_is_linear(quote):
+    content = b"SELECT " + quote + b"a;b" * 100_000
+
+    start = time.perf_counter()
+    assert statement_text(content) == [content]
+
+    # Backtracking over the body would take far longer than this
+    assert time.perf_counter() - start < 1
+
+
+def test_split_statements_copy():
+    content = (
+        b"COPY test (a, b) FROM stdin;\n"
+        b"1\tsemi;colon\n"
+        b"2\t'quote\n"
+        b"\\.\n"
+        b"SELECT 1;\n"
+    )
+
+    copy, select = split_statements(content)
+
+    assert content[copy.start : copy.end] == b"COPY test (a, b) FROM stdin"
+    assert copy.copy_data is not None
+    assert (
+        content[copy.copy_data[0] : copy.copy_data[1]] == b"1\tsemi;colon\n2\t'quote\n"
+    )
+    assert content[select.start : select.end] == b"SELECT 1"
+    assert select.copy_data is None
+
+
+def test_split_statements_copy_to_stdout():
+    content = b"COPY test TO stdout;\nSELECT 1;"
+
+    assert statement_text(content) == [b"COPY test TO stdout", b"SELECT 1"]
+    assert split_statements(content)[0].copy_data is None
+
+
+def test_split_statements_non_ascii():
+    content = "SELECT 'héllo;'; SELECT 'wörld'".encode("utf-8")
+
+    assert statement_text(content) == [
+        "SELECT 'héllo;'".encode("utf-8"),
+        "SELECT 'wörld'".encode("utf-8"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "statement,expected",
+    [
+        (b"INSERT INTO test VALUES (1)", ("INSERT", True)),
+        (b"CREATE OR REPLACE FUNCTION f() RETURNS int", ("CREATE FUNCTION", True)),
+        (b"create unique index on test (a)", ("CREATE INDEX", True)),
+        (b"CREATE INDEX CONCURRENTLY ON test (a)", ("CREATE INDEX", False)),
+        (b"CREATE MATERIALIZED VIEW v AS SELECT 1", ("CREATE MATERIALIZED VIEW", True)),
+        (b"VACUUM ANALYZE test", ("VACUUM", False)),
+        (b"REINDEX TABLE CONCURRENTLY test", ("REINDEX", False)),
+        (b"CREATE DATABASE test", ("CREATE DATABASE", False)),
+    ],
+)
+def test_classify_statement(statement, expected):
+    assert classify_statement(statement) == expected
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import petite
+
+# Modules that make up most of the cost of a slow startup. Checking they
+# aren't loaded catches regressions without depending on how fast the
+# machine running the tests is.
+HEAVY_MODULES = [
+    "psycopg",
+    "sqlglot",
+    "dotenv",
+    "asyncio",
+    "petite.utils.database",
+    "petite.utils.splitter",
+]
+
+# Only needed to render help so commands that do real work shouldn't load it
+HELP_MODULES = ["rich.table"]
+
+# Run in a fresh interpreter so modules imported by other tests don't count
+STARTUP_SCRIPT = """
+import json
+import sys
+
+from petite import app
+
+try:
+    app(sys.argv[1:], prog_name="petite")
+except SystemExit:
+    pass
+
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def run_startup(args, cwd: Path):
+    src_path = Path(petite.__file__).parents[1]
+
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, *args],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": str(src_path)},
+        capture_output=True,
+        text=True,
+    )
+
+    return set(json.loads(result.stderr.strip().splitlines()[-1]))
+
+
+@pytest.mark.parametrize(
+    "command, allowed",
+    [
+        (["--help"], HELP_MODULES),
+        (["new", "--help"], HELP_MODULES),
+        (["new", "test", "--migrations-directory", "migrations"], []),
+    ],
+)
+def test_startup_modules(tmp_path: Path, command, allowed):
+    (tmp_path / "migrations").mkdir()
+
+    loaded = run_startup(command, tmp_path)
+
+    assert "petite" in loaded
+    assert [
+        name
+        for name in HEAVY_MODULES + HELP_MODULES
+        if name in loaded and name not in allowed
+    ] == []
@@ -0,0 +1,11 @@
+import pytest
+
+from petite.utils.timeouts import RetryPolicy
+
+
+@pytest.mark.parametrize("attempt,limit", [(0, 1.0), (1, 2.0), (3, 8.0), (10, 30.0)])
+def test_retry_policy_delay(attempt, limit):
+    policy = RetryPolicy(retries=3, base_delay=1.0, max_delay=30.0)
+
+    for _ in range(50):
+        assert 0 <= policy.delay(attempt) <= limit